@@ -16,6 +16,8 @@ are to the header:
 + 	char command[SERIALCOMMANDLENGTH];
 + 	void (*function)();
 + } SerialCommandCallback;   
+- #define MAXSERIALCOMMANDS	10
++ #define MAXSERIALCOMMANDS	16
   
 SerialCommand - An Arduino library to tokenize and parse commands received over
 a serial port. 
@@ -52,7 +54,7 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #define TERM_CHAR '\n'
 #define SERIALCOMMANDLENGTH 16
 #define SERIALCOMMANDBUFFER 64
-#define MAXSERIALCOMMANDS	10
+#define MAXSERIALCOMMANDS	16
 #define MAXDELIMETER 2
 
 #define SERIALCOMMANDDEBUG 1
@@ -32,6 +32,34 @@ int control_mode_flags;
 #define CONTROL_MODE_FUNC_A   B00001000
 #define CONTROL_MODE_FUNC_B   B00010000
 
+//binary status frame: SYNC0 SYNC1 LENGTH PAYLOAD[LENGTH] CHECKSUM
+//where CHECKSUM is the 8-bit sum of LENGTH and all PAYLOAD bytes
+#define STATUS_FRAME_SYNC0 0xAA
+#define STATUS_FRAME_SYNC1 0x55
+
+typedef struct {
+    uint16_t seq;
+    uint32_t millis;
+    uint8_t  control_mode;
+    float    gradient_setpoint;
+    float    temperatureA_measured;
+    float    temperatureA_target;
+    float    chanA_PID_output;
+    float    chanA_func_output;
+    float    chanA_output;
+    float    temperatureB_measured;
+    float    temperatureB_target;
+    float    chanB_PID_output;
+    float    chanB_func_output;
+    float    chanB_output;
+    float    temperatureC_measured;
+} __attribute__((packed)) StatusFrame;
+
+uint16_t status_frame_seq = 0;
+
+//status streaming, a period of zero disables it
+unsigned long stream_period_ms = 0;
+unsigned long stream_last_ms   = 0;
 
 
 //constants for RPGP-104M Thermistor A
@@ -100,6 +128,7 @@ void setup()
     Serial.begin(SERIAL_SPEED);
     // Setup callbacks for SerialCommand commands
     SCmd.addCommand("STATUS?",   getStatusCommand);
+    SCmd.addCommand("STATUS_BIN?", getStatusBinaryCommand);
     SCmd.addCommand("TEMP_A",    setChanA_TemperatureTargetCommand);
     SCmd.addCommand("TEMP_B",    setChanB_TemperatureTargetCommand);
     SCmd.addCommand("GRAD"  ,    setGradientTargetCommand);
@@ -108,6 +137,8 @@ void setup()
     SCmd.addCommand("FUNC_A",    setChanA_FuncCommand);
     SCmd.addCommand("FUNC_B",    setChanB_FuncCommand);
     SCmd.addCommand("FUNC_SYNC", funcSyncCommand);
+    SCmd.addCommand("STREAM",    setStreamPeriodCommand);
+    SCmd.addCommand("PING",      pingCommand);
     SCmd.addDefaultHandler(unrecognizedCommand);
 
     //configure the thermistor pins
@@ -200,6 +231,12 @@ void loop()
     //compute and constrain total output
     chanA_output = constrain(time_correction*(chanA_PID_output + chanA_func_output),-1.0,1.0);
     chanB_output = constrain(time_correction*(chanB_PID_output + chanB_func_output),-1.0,1.0);
+    //push a status frame when streaming, the rate is limited by the drive period
+    if((stream_period_ms > 0) && (millis() - stream_last_ms >= stream_period_ms))
+    {
+        stream_last_ms = millis();
+        writeStatusFrame();
+    }
     //drive the system
     HBridge.drive(chanA_output, chanB_output, HBRIDGE_DRIVE_PERIOD - time_lost);
 }
@@ -334,6 +371,42 @@ void printStatusYAML()
     Serial.println("...");
 }
 
+void writeStatusFrame()
+{
+    // report all state variables as a fixed layout binary frame
+    StatusFrame frame;
+    byte *payload;
+    byte length, checksum;
+    unsigned int i;
+    frame.seq                   = status_frame_seq++;
+    frame.millis                = millis();
+    frame.control_mode          = control_mode_flags;
+    frame.gradient_setpoint     = gradient_setpoint;
+    frame.temperatureA_measured = T_A;
+    frame.temperatureA_target   = chanA_PID_setpoint;
+    frame.chanA_PID_output      = chanA_PID_output;
+    frame.chanA_func_output     = chanA_func_output;
+    frame.chanA_output          = chanA_output;
+    frame.temperatureB_measured = T_B;
+    frame.temperatureB_target   = chanB_PID_setpoint;
+    frame.chanB_PID_output      = chanB_PID_output;
+    frame.chanB_func_output     = chanB_func_output;
+    frame.chanB_output          = chanB_output;
+    frame.temperatureC_measured = T_C;
+    payload  = (byte *) &frame;
+    length   = sizeof(StatusFrame);
+    checksum = length;
+    for (i = 0; i < length; i++)
+    {
+        checksum += payload[i];
+    }
+    Serial.write(STATUS_FRAME_SYNC0);
+    Serial.write(STATUS_FRAME_SYNC1);
+    Serial.write(length);
+    Serial.write(payload, length);
+    Serial.write(checksum);
+}
+
 //------------------------------------------------------------------------------
 //COMMAND HANDLER FUNCTIONS - called by the SCmd dispatcher
 
@@ -397,6 +470,19 @@ void getStatusCommand(){
     }
 }
 
+void getStatusBinaryCommand(){
+    char *arg;
+    arg = SCmd.next();
+    if (arg != NULL)
+    {
+        Serial.println("### Error: STATUS_BIN? requires 0 arguments ###");
+    }
+    else
+    {
+       writeStatusFrame();
+    }
+}
+
 void setChanA_PIDModeCommand(){
     char *arg;    
     int cmp;
@@ -562,6 +648,25 @@ void funcSyncCommand(){
     }
 }
 
+void setStreamPeriodCommand(){
+    char *arg;
+    arg = SCmd.next();
+    if (arg != NULL)
+    {
+        stream_period_ms = atol(arg);
+        stream_last_ms   = millis();
+    }
+    else
+    {
+        Serial.println("### Error: STREAM requires 1 argument (unsigned long period_ms) ###");
+    }
+}
+
+void pingCommand(){
+    //sentinel for the host, everything sent before it has been handled
+    Serial.println("PONG");
+}
+
 void unrecognizedCommand()
 {
     Serial.println("### Error: command not recognized ###");
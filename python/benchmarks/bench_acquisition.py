@@ -0,0 +1,351 @@
+"""
+   bench_acquisition - headless benchmarks of the peltier test acquisition path
+
+   Runs against the simulated devices (or replays a recorded journal) and
+   measures the status exchange, 'Application.update_data', the plotter and
+   the exporters, then saves the numbers as JSON:
+
+       python bench_acquisition.py -o results.json
+       python bench_acquisition.py --replay 2013-01-01_120000_peltier_test.journal
+       python bench_acquisition.py --compare old.json new.json
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import os, sys, time, json, shutil, platform, resource, tempfile, itertools
+from collections import OrderedDict
+from optparse import OptionParser
+#3rd Party
+import numpy
+import matplotlib
+matplotlib.use('Agg') #headless, must come before anything imports pyplot
+#peltiator framework provided
+from peltiator.apps.lib.stats import LatencyHistogram
+from peltiator.drivers.devices.arduino.simulator import SimulatedConfiguration
+from peltiator.apps.peltier_test.lib.application.application import Application, DATA_COLUMNS
+from peltiator.apps.peltier_test.lib.application.data_store import ColumnStore
+from peltiator.apps.peltier_test.lib.application.data_export import supported_extensions
+from peltiator.apps.peltier_test.lib.application.journal import JournalReader
+from peltiator.apps.peltier_test.lib.gui.data_plotter import DataPlotter, AggFigure
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+RESULTS_FORMAT_VERSION  = 1
+DEFAULT_SPEEDUP         = 100.0 #simulated controller, answers within one 0.1/speedup s loop
+DEFAULT_SAMPLES         = 200
+DEFAULT_HISTORY_LENGTHS = (0, 10**4, 10**5)
+DEFAULT_PLOT_LENGTHS    = (10**3, 10**4, 10**5)
+DEFAULT_EXPORT_LENGTHS  = (10**4, 10**5)
+PLOT_UPDATES            = 50 #incremental updates timed per length
+PLOT_UPDATE_SIZE        = 10 #new samples per incremental update
+MB = 2.0**20
+
+###############################################################################
+# HELPERS
+###############################################################################
+def peak_rss_mb():
+    "peak resident set size of this process so far"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss/MB     #bytes
+    return maxrss*1024/MB    #kilobytes
+
+def latency_summary(latencies):
+    hist = LatencyHistogram()
+    for latency in latencies:
+        hist.record(latency)
+    return hist.summary()
+
+def synthetic_records(n, start = 0, period = 0.1):
+    "'n' plausible status records, numbered from 'start'"
+    records = []
+    for i in xrange(start, start + n):
+        t = i*period
+        ripple = 0.1*numpy.sin(0.05*t)
+        records.append({'timestamp'            : 1.0e9 + t,
+                        'temperatureA_target'  : 27.5,
+                        'temperatureB_target'  : 22.5,
+                        'temperatureA_measured': 27.5 + ripple,
+                        'temperatureB_measured': 22.5 - ripple,
+                        'temperatureC_measured': 25.0,
+                        'chanA_output'         : 0.25 + ripple,
+                        'chanB_output'         : -0.25 - ripple,
+                        'voltage'              : 2.0e-4 + 1.0e-6*ripple,
+                        'voltage_timestamp'    : 1.0e9 + t,
+                       })
+    return records
+
+def environment():
+    env = OrderedDict()
+    env['timestamp'] = time.time()
+    env['python']    = platform.python_version()
+    env['platform']  = platform.platform()
+    env['numpy']     = numpy.__version__
+    env['matplotlib'] = matplotlib.__version__
+    return env
+
+###############################################################################
+# RECORDED DEVICES
+###############################################################################
+class ReplayInterface(object):
+    "plays back the status records of a journal in place of the controller"
+    def __init__(self, reader):
+        self.names   = [name for name in reader.keys() if not name.startswith('voltage')]
+        self.records = reader.records
+        self.binary_status = True
+        self._index = itertools.cycle(xrange(len(self.records)))
+    def get_status(self):
+        row = self.records[next(self._index)]
+        record = OrderedDict((name, row[name].item()) for name in self.names)
+        record['timestamp'] = time.time()
+        return record
+    def is_streaming(self):
+        return False
+    def stop_streaming(self):
+        pass
+    def send_command(self, cmd):
+        return ""
+    def latency_summary(self):
+        return OrderedDict()
+
+
+class ReplayDMM(object):
+    "plays back the voltages of a journal in place of the DMM"
+    def __init__(self, reader):
+        voltages = reader['voltage']
+        self._values = itertools.cycle(voltages[numpy.isfinite(voltages)].tolist() or [0.0])
+    def initialize(self):
+        pass
+    def setup_measurement(self, mode):
+        pass
+    def read(self):
+        return next(self._values)
+
+
+class ReplayConfiguration(object):
+    def __init__(self, journal_filename):
+        reader = JournalReader(journal_filename)
+        if not len(reader):
+            raise ValueError, "journal '%s' holds no records" % journal_filename
+        self._devices = {'peltier_pid': ReplayInterface(reader),
+                         'dmm'        : ReplayDMM(reader),
+                         'oven'       : None,
+                        }
+    def load_device(self, handle):
+        return self._devices[handle]
+    def close(self):
+        pass
+
+###############################################################################
+# HEADLESS PLOTTER
+###############################################################################
+class HeadlessDataPlotter(DataPlotter):
+    "the DataPlotter drawing code without its Tk Frame"
+    def __init__(self):
+        self.attach_figure(AggFigure())
+
+###############################################################################
+# BENCHMARKS
+###############################################################################
+def bench_get_status(app, samples):
+    "status exchange rate and latency in each mode the firmware supports"
+    iface = app.peltier_pid
+    results = OrderedDict()
+    binary_supported = iface.binary_status
+    modes = [('binary', True), ('yaml', False)] if binary_supported else [('yaml', False)]
+    for mode, binary in modes:
+        iface.binary_status = binary
+        latencies = []
+        t_start = time.time()
+        for _ in xrange(samples):
+            t0 = time.time()
+            iface.get_status()
+            latencies.append(time.time() - t0)
+        elapsed = time.time() - t_start
+        results[mode] = OrderedDict((('samples_per_s', samples/elapsed),
+                                     ('latency', latency_summary(latencies)),
+                                    ))
+    iface.binary_status = binary_supported
+    return results
+
+def bench_update_data(app, samples, history_lengths):
+    "acquisition rate and per-sample latency with a given history already stored"
+    results = OrderedDict()
+    for length in history_lengths:
+        app.clear_data()
+        app.data.extend(synthetic_records(length))
+        latencies = []
+        t_start = time.time()
+        for _ in xrange(samples):
+            t0 = time.time()
+            app.update_data(verbose = False)
+            latencies.append(time.time() - t0)
+        elapsed = time.time() - t_start
+        results[str(length)] = OrderedDict((('history_length', length),
+                                            ('samples_per_s' , samples/elapsed),
+                                            ('latency'       , latency_summary(latencies)),
+                                           ))
+    app.clear_data()
+    return results
+
+def bench_plot(lengths, updates = PLOT_UPDATES, update_size = PLOT_UPDATE_SIZE):
+    "first render, incremental update and full redraw times versus stored points"
+    results = OrderedDict()
+    for length in lengths:
+        store = ColumnStore(columns = DATA_COLUMNS)
+        store.extend(synthetic_records(length))
+        plotter = HeadlessDataPlotter()
+        t0 = time.time()
+        plotter.update(store)
+        first = time.time() - t0
+        latencies = []
+        for i in xrange(updates):
+            store.extend(synthetic_records(update_size, start = length + i*update_size))
+            t0 = time.time()
+            plotter.update(store)
+            latencies.append(time.time() - t0)
+        t0 = time.time()
+        plotter.figure_widget.update()
+        redraw = time.time() - t0
+        results[str(length)] = OrderedDict((('points'          , length),
+                                            ('first_update_s'  , first),
+                                            ('update'          , latency_summary(latencies)),
+                                            ('full_redraw_s'   , redraw),
+                                           ))
+    return results
+
+def bench_export(app, lengths, dirpath):
+    "export throughput per format"
+    results = OrderedDict()
+    for length in lengths:
+        app.clear_data()
+        app.data.extend(synthetic_records(length))
+        per_format = OrderedDict()
+        for ext in supported_extensions():
+            filename = os.path.join(dirpath, "export_%d%s" % (length, ext))
+            t0 = time.time()
+            app.export_data(filename)
+            elapsed = time.time() - t0
+            size = os.path.getsize(filename)
+            os.remove(filename)
+            per_format[ext.lstrip('.')] = OrderedDict((('seconds'  , elapsed),
+                                                       ('megabytes', size/MB),
+                                                       ('mb_per_s' , size/MB/elapsed),
+                                                       ('rows_per_s', length/elapsed),
+                                                      ))
+        results[str(length)] = per_format
+    app.clear_data()
+    return results
+
+def run_benchmarks(config, opts):
+    results = OrderedDict()
+    results['format_version'] = RESULTS_FORMAT_VERSION
+    results['environment'] = environment()
+    results['parameters']  = OrderedDict((('devices', "replay" if opts.replay else "simulated"),
+                                          ('speedup', opts.speedup),
+                                          ('samples', opts.samples),
+                                         ))
+    peak_rss = results['peak_rss_mb'] = OrderedDict()
+    dirpath = tempfile.mkdtemp(prefix = "peltiator_bench_")
+    devnull = open(os.devnull, 'w')
+    try:
+        app = Application(config, output_stream = devnull, journal_dirpath = dirpath,
+                          intro_msg = "bench_acquisition")
+        peak_rss['startup'] = peak_rss_mb()
+        results['get_status'] = bench_get_status(app, opts.samples)
+        peak_rss['get_status'] = peak_rss_mb()
+        results['update_data'] = bench_update_data(app, opts.samples, opts.history_lengths)
+        peak_rss['update_data'] = peak_rss_mb()
+        results['plot'] = bench_plot(opts.plot_lengths)
+        peak_rss['plot'] = peak_rss_mb()
+        results['export'] = bench_export(app, opts.export_lengths, dirpath)
+        peak_rss['export'] = peak_rss_mb()
+        app.close()
+    finally:
+        devnull.close()
+        shutil.rmtree(dirpath, ignore_errors = True)
+    return results
+
+###############################################################################
+# COMPARISON
+###############################################################################
+def flatten(results, prefix = ""):
+    "numeric leaves of a results tree keyed by their dotted path"
+    flat = OrderedDict()
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(old, new, skip = ('environment.', 'parameters.', 'format_version')):
+    old, new = flatten(old), flatten(new)
+    lines = []
+    for path, new_value in new.items():
+        if path.startswith(skip) or path not in old:
+            continue
+        old_value = old[path]
+        change = (new_value - old_value)/abs(old_value)*100 if old_value else float('nan')
+        lines.append("%-60s %12.6g %12.6g %+8.1f%%" % (path, old_value, new_value, change))
+    return lines
+
+###############################################################################
+# MAIN
+###############################################################################
+def _int_list(text):
+    return tuple(int(float(x)) for x in text.split(',') if x)
+
+def main():
+    OP = OptionParser(usage = "%prog [options]\n       %prog --compare OLD.json NEW.json")
+    OP.add_option("-o", "--output", dest = "output", default = None,
+                  help = "JSON file for the results, default 'bench_acquisition_<time>.json'")
+    OP.add_option("--replay", dest = "replay", default = None,
+                  help = "replay the records of this journal instead of simulating the devices")
+    OP.add_option("--speedup", dest = "speedup", type = 'float', default = DEFAULT_SPEEDUP,
+                  help = "simulated controller speedup over real time")
+    OP.add_option("--samples", dest = "samples", type = 'int', default = DEFAULT_SAMPLES,
+                  help = "samples timed per acquisition benchmark")
+    OP.add_option("--history-lengths", dest = "history_lengths", type = 'string',
+                  default = DEFAULT_HISTORY_LENGTHS, help = "comma separated")
+    OP.add_option("--plot-lengths", dest = "plot_lengths", type = 'string',
+                  default = DEFAULT_PLOT_LENGTHS, help = "comma separated")
+    OP.add_option("--export-lengths", dest = "export_lengths", type = 'string',
+                  default = DEFAULT_EXPORT_LENGTHS, help = "comma separated")
+    OP.add_option("--compare", dest = "compare", default = False, action = 'store_true',
+                  help = "print the relative change between two result files")
+    opts, args = OP.parse_args()
+    if opts.compare:
+        if len(args) != 2:
+            OP.error("--compare needs two result files")
+        with open(args[0]) as f_old, open(args[1]) as f_new:
+            old = json.load(f_old, object_pairs_hook = OrderedDict)
+            new = json.load(f_new, object_pairs_hook = OrderedDict)
+        for line in compare(old, new):
+            print line
+        return 0
+    for name in ('history_lengths', 'plot_lengths', 'export_lengths'):
+        value = getattr(opts, name)
+        if isinstance(value, str):
+            setattr(opts, name, _int_list(value))
+    if opts.replay:
+        config = ReplayConfiguration(opts.replay)
+    else:
+        config = SimulatedConfiguration(speedup = opts.speedup)
+    try:
+        results = run_benchmarks(config, opts)
+    finally:
+        config.close()
+    output = opts.output
+    if output is None:
+        output = time.strftime("bench_acquisition_%Y-%m-%d_%H%M%S.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print "results written to '%s'" % output
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+   bench_status_parser - micro-benchmark of the 'STATUS?' document decoders
+
+   Times 'yaml.load', 'yaml.safe_load' (with the C loader when PyYAML has it)
+   and the schema specific 'decode_status_yaml' on documents laid out like
+   the firmware's 'printStatusYAML', and checks that they all agree:
+
+       python bench_status_parser.py
+       python bench_status_parser.py -n 20000 -o results.json
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import sys, math, json, timeit
+from collections import OrderedDict
+from optparse import OptionParser
+#3rd Party
+import yaml
+#peltiator framework provided
+from peltiator.drivers.devices.arduino.dual_peltier_pid import decode_status_yaml
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_NUMBER  = 5000
+DEFAULT_REPEAT  = 3
+STATUS_DOCUMENT = "\r\n".join(["---",
+                               "control_mode: 7",
+                               "gradient_setpoint: 5.00",
+                               "temperatureA_measured: 27.43",
+                               "temperatureA_target: 27.50",
+                               "chanA_PID_output: -0.12",
+                               "chanA_func_output: 0.00",
+                               "chanA_output: -0.12",
+                               "temperatureB_measured: 22.61",
+                               "temperatureB_target: 22.50",
+                               "chanB_PID_output: 0.08",
+                               "chanB_func_output: 0.00",
+                               "chanB_output: 0.08",
+                               "temperatureC_measured: 24.97",
+                               "...",
+                               ""])
+#an error message left over from a previous command precedes the document
+ERROR_DOCUMENT = "### Error: command 'FOO' not recognized ###\r\n" + STATUS_DOCUMENT
+
+###############################################################################
+# HELPERS
+###############################################################################
+def decoders():
+    "the decoders to compare, by name"
+    funcs = OrderedDict()
+    funcs['yaml.load']      = lambda doc: yaml.load(doc, Loader = yaml.Loader) #the previous decoder
+    funcs['yaml.safe_load'] = yaml.safe_load
+    if hasattr(yaml, 'CSafeLoader'):
+        funcs['yaml.safe_load(CSafeLoader)'] = lambda doc: yaml.load(doc, Loader = yaml.CSafeLoader)
+    funcs['decode_status_yaml'] = decode_status_yaml
+    return funcs
+
+def _same(a, b):
+    if set(a) != set(b):
+        return False
+    for key in a:
+        x, y = float(a[key]), float(b[key])
+        if not (x == y or (math.isnan(x) and math.isnan(y))):
+            return False
+    return True
+
+def check_agreement(funcs, doc):
+    "raise if any decoder disagrees with 'yaml.safe_load' on 'doc'"
+    expected = yaml.safe_load(doc)
+    for name, func in funcs.items():
+        if not _same(func(doc), expected):
+            raise AssertionError, "decoder '%s' disagrees with yaml.safe_load on:\n%s" % (name, doc)
+
+def time_decoder(func, doc, number, repeat):
+    "best time per call in microseconds"
+    timer = timeit.Timer(lambda: func(doc))
+    return min(timer.repeat(repeat = repeat, number = number))/number*1e6
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    OP = OptionParser(usage = "%prog [options]")
+    OP.add_option("-n", "--number", dest = "number", type = 'int', default = DEFAULT_NUMBER,
+                  help = "calls per timing run")
+    OP.add_option("-r", "--repeat", dest = "repeat", type = 'int', default = DEFAULT_REPEAT,
+                  help = "timing runs, the best is kept")
+    OP.add_option("-o", "--output", dest = "output", default = None,
+                  help = "also save the results to this JSON file")
+    opts, args = OP.parse_args()
+    funcs = decoders()
+    results = OrderedDict()
+    for doc_name, doc in (('status', STATUS_DOCUMENT), ('status_after_error', ERROR_DOCUMENT)):
+        check_agreement(funcs, doc)
+        times = OrderedDict()
+        for name, func in funcs.items():
+            times[name] = time_decoder(func, doc, opts.number, opts.repeat)
+        results[doc_name] = times
+        baseline = times['yaml.load']
+        print "%s document:" % doc_name
+        for name, usec in times.items():
+            print "    %-30s %10.1f us  %7.1fx" % (name, usec, baseline/usec)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
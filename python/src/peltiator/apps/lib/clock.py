@@ -0,0 +1,37 @@
+import sys, time
+################################################################################
+#clock ids for clock_gettime
+CLOCK_MONOTONIC_IDS = {'linux' : 1,
+                       'darwin': 6,
+                      }
+################################################################################
+def _make_monotonic():
+    """returns a function giving seconds on a clock that never jumps, unlike
+       'time.time' which follows wall clock adjustments (NTP, DST, the user)
+    """
+    try:
+        return time.monotonic #Python 3.3+
+    except AttributeError:
+        pass
+    platform = sys.platform.rstrip('0123456789')
+    clock_id = CLOCK_MONOTONIC_IDS.get(platform)
+    if clock_id is not None:
+        try:
+            import ctypes, ctypes.util
+            class timespec(ctypes.Structure):
+                _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+            libname = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+            clock_gettime = ctypes.CDLL(libname, use_errno = True).clock_gettime
+            clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+            def monotonic():
+                ts = timespec()
+                if clock_gettime(clock_id, ctypes.pointer(ts)) != 0:
+                    raise OSError, "clock_gettime failed"
+                return ts.tv_sec + ts.tv_nsec*1e-9
+            monotonic()
+            return monotonic
+        except (OSError, AttributeError, TypeError):
+            pass
+    return time.time #best effort
+
+monotonic = _make_monotonic()
@@ -0,0 +1,319 @@
+import os, time, select, threading, heapq, itertools
+from collections import deque
+################################################################################
+DEFAULT_SELECT_TIMEOUT = 1.0 #seconds, upper bound on an idle wait
+################################################################################
+class TimeoutError(IOError):
+    pass
+
+
+class Future(object):
+    """Result of an operation that completes later, possibly on another
+       thread. 'result(timeout)' blocks until it is available and re-raises
+       the operation's exception, if any.
+    """
+    def __init__(self):
+        self._cond      = threading.Condition()
+        self._done      = False
+        self._result    = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._cond:
+            if self._done:
+                return
+            self._result, self._exception = result, exception
+            self._done = True
+            self._cond.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout = None):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            return self._done
+
+    def exception(self, timeout = None):
+        if not self.wait(timeout):
+            raise TimeoutError, "future did not complete within %s seconds" % timeout
+        return self._exception
+
+    def result(self, timeout = None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+
+def chain(future, func):
+    "a Future of 'func' applied to the result of 'future', exceptions pass through"
+    chained = Future()
+    def done(f):
+        exception = f.exception()
+        if exception is not None:
+            chained.set_exception(exception)
+            return
+        try:
+            chained.set_result(func(f.result()))
+        except Exception, exc:
+            chained.set_exception(exc)
+    future.add_done_callback(done)
+    return chained
+
+
+def gather(futures, timeout = None):
+    "wait for all 'futures' and return their results in order"
+    deadline = None if timeout is None else time.time() + timeout
+    results = []
+    for future in futures:
+        remaining = None if deadline is None else max(0.0, deadline - time.time())
+        results.append(future.result(remaining))
+    return results
+
+
+class Reactor(object):
+    """A minimal single-threaded event loop over 'select'. Device handlers
+       register a file descriptor and get their 'handle_read()' called when
+       it becomes readable; timers run via 'call_later'. Everything that
+       touches the loop from other threads must go through
+       'call_soon_threadsafe', which wakes the loop through a self-pipe.
+       Run it in the current thread with 'run()' or in a daemon thread with
+       'start()'.
+    """
+    def __init__(self):
+        self._readers  = {}
+        self._timers   = []
+        self._ready    = deque()
+        self._counter  = itertools.count()
+        self._lock     = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        self._running  = False
+        self._thread   = None
+
+    #--------------------------------------------------------------------------
+    # scheduling
+    def add_reader(self, fd, handler):
+        self._readers[fd] = handler
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self._lock:
+            self._ready.append((callback, args))
+        if not self.in_loop_thread():
+            os.write(self._wake_w, "x")
+
+    def call_later(self, delay, callback, *args):
+        "returns a handle for 'cancel_timer', only call from the loop thread"
+        entry = [time.time() + delay, next(self._counter), callback, args]
+        heapq.heappush(self._timers, entry)
+        return entry
+
+    def cancel_timer(self, handle):
+        handle[2] = None
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    #--------------------------------------------------------------------------
+    # running
+    def start(self):
+        self._thread = threading.Thread(target = self.run, name = "reactor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.call_soon_threadsafe(self._stop)
+        if self._thread is not None and not self.in_loop_thread():
+            self._thread.join()
+
+    def _stop(self):
+        self._running = False
+
+    def run(self):
+        if self._thread is None:
+            self._thread = threading.current_thread()
+        self._running = True
+        while self._running:
+            self._run_once()
+
+    def run_until_complete(self, future, timeout = None):
+        "drive the loop on the calling thread until 'future' is done"
+        deadline = None if timeout is None else time.time() + timeout
+        self._thread = threading.current_thread()
+        while not future.done():
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError, "future did not complete within %s seconds" % timeout
+            self._run_once()
+        self._thread = None
+        return future.result()
+
+    def _run_once(self):
+        timeout = DEFAULT_SELECT_TIMEOUT
+        if self._ready:
+            timeout = 0.0
+        elif self._timers:
+            timeout = max(0.0, min(timeout, self._timers[0][0] - time.time()))
+        fds = [self._wake_r] + self._readers.keys()
+        readable, _, _ = select.select(fds, [], [], timeout)
+        for fd in readable:
+            if fd == self._wake_r:
+                os.read(self._wake_r, 4096)
+                continue
+            handler = self._readers.get(fd)
+            if handler is not None:
+                handler.handle_read()
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            if callback is not None:
+                callback(*args)
+        with self._lock:
+            ready, self._ready = self._ready, deque()
+        for callback, args in ready:
+            callback(*args)
+
+
+class RequestChannel(object):
+    """Base for devices driven by a Reactor that answer one request at a time:
+       requests wait in a FIFO, the active one is written out and its parser
+       is offered the receive buffer after every read until it returns a
+       response or its timeout fires. Subclasses provide 'fileno()',
+       '_read_available()' and '_write(data)'.
+
+       A parser takes the buffer and returns (response, bytes consumed) or
+       None when it needs more data. When the timeout fires the request fails
+       with TimeoutError, unless it was given an 'on_timeout(buff)' handler,
+       which makes the response out of whatever has arrived. Futures are
+       stamped with 't_sent' and 't_done'.
+    """
+    def __init__(self, reactor):
+        self.reactor  = reactor
+        self._queue   = deque()
+        self._active  = None
+        self._timer   = None
+        self._rx_buff = ""
+        reactor.call_soon_threadsafe(reactor.add_reader, self.fileno(), self)
+
+    def submit(self, data, parser, timeout, on_timeout = None):
+        "queue a request from any thread, returns a Future of the response"
+        future = Future()
+        future.t_sent = future.t_done = None
+        request = (data, parser, timeout, on_timeout, future)
+        self.reactor.call_soon_threadsafe(self._enqueue, request)
+        return future
+
+    def _enqueue(self, request):
+        self._queue.append(request)
+        if self._active is None:
+            self._next()
+
+    def _next(self):
+        while self._queue:
+            data, parser, timeout, on_timeout, future = self._queue.popleft()
+            future.t_sent = time.time()
+            try:
+                if data:
+                    self._write(data)
+            except (IOError, OSError), exc:
+                self._complete(future, exc)
+                continue
+            if parser is None: #write only
+                self._complete(future, None)
+                continue
+            self._active = (parser, on_timeout, future)
+            self._timer  = self.reactor.call_later(timeout, self._on_timeout, future, timeout)
+            self._try_parse()
+            return
+
+    def _complete(self, future, response):
+        future.t_done = time.time()
+        if isinstance(response, Exception):
+            future.set_exception(response)
+        else:
+            future.set_result(response)
+
+    def _on_timeout(self, future, timeout):
+        if self._active is None or self._active[2] is not future:
+            return
+        _, on_timeout, _ = self._active
+        self._active = None
+        buff, self._rx_buff = self._rx_buff, ""
+        if on_timeout is not None:
+            self._complete(future, on_timeout(buff))
+        else:
+            self._complete(future, TimeoutError("request timed out after %f seconds" % timeout))
+        self._next()
+
+    def handle_read(self):
+        try:
+            data = self._read_available()
+        except (IOError, OSError), exc:
+            self._fail_all(exc)
+            return
+        if not data:
+            return
+        self._rx_buff += data
+        self._try_parse()
+
+    def _try_parse(self):
+        if self._active is None:
+            self._rx_buff = "" #unsolicited data
+            return
+        parser, _, future = self._active
+        try:
+            parsed = parser(self._rx_buff)
+        except Exception, exc:
+            parsed = (exc, len(self._rx_buff))
+        if parsed is None:
+            return
+        response, consumed = parsed
+        self._rx_buff = self._rx_buff[consumed:]
+        self.reactor.cancel_timer(self._timer)
+        self._active = None
+        self._complete(future, response)
+        self._next()
+
+    def _fail_all(self, exc):
+        "the transport is gone, fail the active and queued requests"
+        self.reactor.remove_reader(self.fileno())
+        if self._active is not None:
+            self.reactor.cancel_timer(self._timer)
+            self._complete(self._active[2], exc)
+            self._active = None
+        while self._queue:
+            self._complete(self._queue.popleft()[-1], exc)
+
+    def close(self):
+        self.reactor.call_soon_threadsafe(self.reactor.remove_reader, self.fileno())
+
+
+def line_parser(terminator):
+    "parser factory: everything through the first 'terminator'"
+    def parse(buff):
+        index = buff.find(terminator)
+        if index == -1:
+            return None
+        end = index + len(terminator)
+        return buff[:end], end
+    return parse
@@ -0,0 +1,98 @@
+import multiprocessing
+from collections import OrderedDict
+import numpy
+################################################################################
+DEFAULT_RING_CAPACITY = 4096 #rows
+NAN = float('nan')
+PRESENT_FIELD = "_present" #which columns a row's record had
+################################################################################
+class SharedRing(object):
+    """Ring buffer of fixed-width typed rows in shared memory, written by one
+       process and read by another without pickling. Create it before starting
+       the writer process, which must be forked, so that both map the same
+       memory.
+
+       'columns' are names (float64) or (name, dtype) pairs. Each row also
+       records which columns its record had, so a missing integer is not
+       mistaken for a 0.
+
+       The writer fills a row before advancing 'count'. A reader copies the rows
+       it has not seen yet and then checks 'count' again, dropping any rows the
+       writer may have overwritten in the meantime.
+    """
+    def __init__(self, columns, capacity = DEFAULT_RING_CAPACITY):
+        self.dtypes = OrderedDict()
+        for column in columns:
+            if isinstance(column, basestring):
+                self.dtypes[column] = numpy.dtype(numpy.float64)
+            else:
+                name, dtype = column
+                self.dtypes[name] = numpy.dtype(dtype)
+        self.columns  = tuple(self.dtypes.keys())
+        self.capacity = capacity
+        self.row_dtype = numpy.dtype(self.dtypes.items() + [(PRESENT_FIELD, numpy.bool_, (len(self.columns),))])
+        self._fills = tuple(NAN if dtype.kind == 'f' else 0 for dtype in self.dtypes.values())
+        self._raw   = multiprocessing.RawArray('b', capacity*self.row_dtype.itemsize)
+        self._count = multiprocessing.RawValue('l', 0) #rows ever written
+        self.rows   = numpy.frombuffer(self._raw, dtype = self.row_dtype)
+
+    @property
+    def count(self):
+        return self._count.value
+
+    def write(self, record):
+        "store the fields of 'record' that have a column, the others are marked missing"
+        values  = []
+        present = []
+        for name, fill in zip(self.columns, self._fills):
+            val = record.get(name)
+            present.append(val is not None)
+            values.append(fill if val is None else val)
+        self.rows[self._count.value % self.capacity] = tuple(values) + (present,)
+        self._count.value += 1
+
+    def read(self, position):
+        """copies of the rows written since 'position' as a structured array,
+           with the position to continue from and the number of rows lost to
+           overruns
+        """
+        end   = self._count.value
+        start = max(position, end - self.capacity)
+        if start >= end:
+            return self.rows[:0].copy(), end, start - position
+        first, last = start % self.capacity, end % self.capacity
+        if first < last:
+            rows = self.rows[first:last].copy()
+        else: #wraps around
+            rows = numpy.concatenate((self.rows[first:], self.rows[:last]))
+        #the row being written now may have replaced one that was just copied
+        first_intact = self._count.value - self.capacity + 1
+        if first_intact > start:
+            rows  = rows[first_intact - start:]
+            start = first_intact
+        return rows, end, start - position
+
+    def column_arrays(self, rows):
+        """the rows as one array per column, leaving out the columns no row had;
+           an integer column that some rows lack becomes float64 with NaN
+           there, as a ColumnStore would store it
+        """
+        present = rows[PRESENT_FIELD]
+        columns = OrderedDict()
+        for i, name in enumerate(self.columns):
+            if not present[:,i].any():
+                continue
+            values = rows[name]
+            if not present[:,i].all():
+                if values.dtype.kind != 'f':
+                    values = values.astype(numpy.float64)
+                values[~present[:,i]] = NAN
+            columns[name] = values
+        return columns
+
+    def records(self, rows):
+        "one dict per row, keyed by column name, without the columns the row's record lacked"
+        present = rows[PRESENT_FIELD].tolist()
+        values  = zip(*[rows[name].tolist() for name in self.columns])
+        return [OrderedDict((name, val) for name, val, p in zip(self.columns, row, row_present) if p)
+                for row, row_present in zip(values, present)]
@@ -0,0 +1,350 @@
+import math, time, threading
+from collections import OrderedDict
+################################################################################
+HISTOGRAM_MIN_LATENCY     = 1e-5 #seconds
+HISTOGRAM_DECADES         = 7    #covers 10 us up to 100 s
+HISTOGRAM_BINS_PER_DECADE = 20   #about 12% bin width
+PERCENTILES = (50, 95, 99)
+DEFAULT_STAGE_WINDOW      = 256  #most recent timings kept per stage
+################################################################################
+class LatencyHistogram(object):
+    """Fixed log-spaced histogram of latencies (in seconds), recording is O(1)
+       and the memory use is constant so it can stay on for whole runs.
+       Percentiles are reported as the geometric center of their bin.
+    """
+    def __init__(self,
+                 min_latency     = HISTOGRAM_MIN_LATENCY,
+                 decades         = HISTOGRAM_DECADES,
+                 bins_per_decade = HISTOGRAM_BINS_PER_DECADE,
+                ):
+        self.min_latency     = min_latency
+        self.bins_per_decade = bins_per_decade
+        self.num_bins        = decades*bins_per_decade
+        self.reset()
+
+    def reset(self):
+        self.counts = [0]*self.num_bins
+        self.count  = 0
+        self.total  = 0.0
+        self.max    = 0.0
+
+    def record(self, latency):
+        if latency > self.min_latency:
+            index = int(math.log10(latency/self.min_latency)*self.bins_per_decade)
+            index = min(index, self.num_bins - 1)
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        threshold = q/100.0*self.count
+        cumulative = 0
+        for index, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= threshold and n > 0:
+                break
+        center = self.min_latency*10**((index + 0.5)/self.bins_per_decade)
+        return min(center, self.max)
+
+    def summary(self):
+        s = OrderedDict()
+        s['count'] = self.count
+        s['mean']  = self.total/self.count if self.count else None
+        for q in PERCENTILES:
+            s['p%d' % q] = self.percentile(q)
+        s['max']   = self.max
+        return s
+
+
+class LatencyHistograms(object):
+    """A set of LatencyHistogram keyed by a label such as the command type,
+       safe to record into from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = OrderedDict()
+
+    def record(self, key, latency):
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = LatencyHistogram()
+            hist.record(latency)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def keys(self):
+        return self._histograms.keys()
+
+    def __getitem__(self, key):
+        return self._histograms[key]
+
+    def summary(self):
+        with self._lock:
+            return OrderedDict((key, hist.summary()) for key, hist in self._histograms.items())
+
+
+class RunningStats(object):
+    """Count, mean, standard deviation, min and max of a stream of values in
+       O(1) time and memory per value (Welford's algorithm).
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean  = 0.0
+        self._m2   = 0.0
+        self.min   = None
+        self.max   = None
+
+    def record(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self._m2  += delta*(x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        "fold in the values recorded by another RunningStats"
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2  += other._m2 + delta*delta*self.count*other.count/count
+        self.mean += delta*other.count/count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self._m2/(self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def summary(self):
+        s = OrderedDict()
+        s['count'] = self.count
+        s['mean']  = self.mean if self.count else None
+        s['std']   = self.std
+        s['min']   = self.min
+        s['max']   = self.max
+        return s
+
+
+class RunningRegression(object):
+    """Least squares line y = slope*x + intercept through a stream of (x, y)
+       pairs in O(1) time and memory per pair, keeping running means and
+       co-moments updated the way Welford's algorithm does.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count  = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self._sxx   = 0.0
+        self._syy   = 0.0
+        self._sxy   = 0.0
+
+    def record(self, x, y):
+        self.count += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx/self.count
+        self.mean_y += dy/self.count
+        self._sxx += dx*(x - self.mean_x)
+        self._syy += dy*(y - self.mean_y)
+        self._sxy += dx*(y - self.mean_y)
+
+    def merge(self, other):
+        "fold in the pairs recorded by another RunningRegression"
+        if not other.count:
+            return
+        count = self.count + other.count
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = float(self.count*other.count)/count
+        self._sxx += other._sxx + dx*dx*weight
+        self._syy += other._syy + dy*dy*weight
+        self._sxy += other._sxy + dx*dy*weight
+        self.mean_x += dx*other.count/count
+        self.mean_y += dy*other.count/count
+        self.count = count
+
+    @property
+    def slope(self):
+        if self.count < 2 or self._sxx <= 0:
+            return None
+        return self._sxy/self._sxx
+
+    @property
+    def intercept(self):
+        slope = self.slope
+        if slope is None:
+            return None
+        return self.mean_y - slope*self.mean_x
+
+    @property
+    def residual_variance(self):
+        if self.count < 3 or self._sxx <= 0:
+            return None
+        #clipped, rounding can take a near perfect fit slightly negative
+        return max(self._syy - self._sxy*self._sxy/self._sxx, 0.0)/(self.count - 2)
+
+    @property
+    def slope_stderr(self):
+        var = self.residual_variance
+        if var is None:
+            return None
+        return math.sqrt(var/self._sxx)
+
+    @property
+    def intercept_stderr(self):
+        var = self.residual_variance
+        if var is None:
+            return None
+        return math.sqrt(var*(1.0/self.count + self.mean_x*self.mean_x/self._sxx))
+
+    def summary(self):
+        s = OrderedDict()
+        s['count']            = self.count
+        s['slope']            = self.slope
+        s['slope_stderr']     = self.slope_stderr
+        s['intercept']        = self.intercept
+        s['intercept_stderr'] = self.intercept_stderr
+        s['mean_x']           = self.mean_x if self.count else None
+        s['mean_y']           = self.mean_y if self.count else None
+        return s
+
+
+class RollingStats(object):
+    """Mean, percentiles and max of the 'window' most recent values; recording
+       is a single store into a preallocated list, the work is done on
+       'summary'
+    """
+    def __init__(self, window = DEFAULT_STAGE_WINDOW):
+        self.window  = window
+        self._values = [0.0]*window
+        self.count   = 0 #ever recorded
+
+    def record(self, x):
+        self._values[self.count % self.window] = x
+        self.count += 1
+
+    def values(self):
+        "the values in the window, oldest first"
+        if self.count <= self.window:
+            return self._values[:self.count]
+        i = self.count % self.window
+        return self._values[i:] + self._values[:i]
+
+    def summary(self):
+        values = sorted(self.values())
+        n = len(values)
+        s = OrderedDict()
+        s['count'] = self.count
+        s['mean']  = sum(values)/n if n else None
+        for q in PERCENTILES:
+            s['p%d' % q] = values[min(n - 1, int(q/100.0*n))] if n else None
+        s['max']   = values[-1] if n else None
+        return s
+
+
+class _StageTimer(object):
+    __slots__ = ('timers', 'name', 't0')
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name   = name
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timers.record(self.name, time.time() - self.t0)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageTimers(object):
+    """Rolling timing statistics for the stages of a hot path:
+
+           with timers.stage("get_status"):
+               ...
+
+       When disabled 'stage' hands out a shared do-nothing context manager,
+       so the instrumentation can stay in place at negligible cost.
+    """
+    def __init__(self, enabled = True, window = DEFAULT_STAGE_WINDOW):
+        self.enabled = enabled
+        self.window  = window
+        self._lock   = threading.Lock()
+        self._stats  = OrderedDict()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def record(self, name, duration):
+        stats = self._stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(name, RollingStats(self.window))
+        stats.record(duration)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        with self._lock:
+            items = self._stats.items()
+        return OrderedDict((name, stats.summary()) for name, stats in items)
+
+
+def format_stage_table(summary, title = "stage"):
+    "format a StageTimers summary as text lines with times in milliseconds"
+    lines = ["%-24s %8s %9s %9s %9s %9s" % (title, "count", "mean (ms)", "p50 (ms)", "p95 (ms)", "max (ms)")]
+    for key, s in summary.items():
+        if not s['count']:
+            continue
+        lines.append("%-24s %8d %9.3f %9.3f %9.3f %9.3f" % (key, s['count'], 1e3*s['mean'],
+                                                            1e3*s['p50'], 1e3*s['p95'],
+                                                            1e3*s['max']))
+    return lines
+
+
+def format_latency_table(summary, title = "latency"):
+    "format a LatencyHistograms summary as text lines with times in milliseconds"
+    lines = ["%-16s %8s %9s %9s %9s %9s" % (title, "count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)")]
+    for key, s in summary.items():
+        if not s['count']:
+            continue
+        lines.append("%-16s %8d %9.2f %9.2f %9.2f %9.2f" % (key, s['count'],
+                                                            1e3*s['p50'], 1e3*s['p95'],
+                                                            1e3*s['p99'], 1e3*s['max']))
+    return lines
@@ -0,0 +1,113 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import threading
+from collections import OrderedDict
+#peltiator framework provided
+from peltiator.apps.lib.clock import monotonic
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_MIN_PERIOD = 0.1  #seconds, the rate during transients
+DEFAULT_MAX_PERIOD = 2.0  #seconds, the rate on quiet plateaus
+DEFAULT_DOUBLING   = 2.0  #seconds of quiet per doubling of the period
+DEFAULT_HOLD       = 10.0 #seconds at the fastest rate after a setpoint change
+DEFAULT_SPAN       = 1.0  #seconds between the samples a rate of change is taken over
+#signal: rate of change (per second) above which the signal counts as moving
+DEFAULT_THRESHOLDS = OrderedDict([("temperatureA_measured", 0.1),  #K/s
+                                  ("temperatureB_measured", 0.1),  #K/s
+                                  ("voltage"              , 4e-6), #V/s
+                                 ])
+#commands that move a setpoint
+SETPOINT_COMMANDS = ("GRAD", "TEMP_A", "TEMP_B")
+
+###############################################################################
+# CLASSES
+###############################################################################
+class AdaptiveRatePolicy(object):
+    """Chooses the sampling period from the signal dynamics: 'min_period'
+       for 'hold' seconds after a setpoint change or whenever a signal moves
+       faster than its threshold, then doubling every 'doubling' seconds of
+       quiet up to 'max_period'.
+
+       Feed it with 'observe(fixture, records)', e.g. as an Application data
+       listener, and read 'period' before each tick.
+    """
+    def __init__(self,
+                 min_period = DEFAULT_MIN_PERIOD,
+                 max_period = DEFAULT_MAX_PERIOD,
+                 doubling   = DEFAULT_DOUBLING,
+                 hold       = DEFAULT_HOLD,
+                 span       = DEFAULT_SPAN,
+                 thresholds = DEFAULT_THRESHOLDS,
+                ):
+        if not 0 < min_period <= max_period:
+            raise ValueError, "need 0 < min_period <= max_period, got %r and %r" % (min_period, max_period)
+        if doubling <= 0:
+            raise ValueError, "doubling must be positive, got %r" % doubling
+        self.min_period = min_period
+        self.max_period = max_period
+        self.doubling   = doubling
+        self.hold       = hold
+        self.span       = span
+        self.thresholds = OrderedDict(thresholds)
+        self._lock = threading.Lock()
+        self._references = {} #fixture name: the record rates of change are taken from
+        self._hold_until = monotonic() + hold
+        self.boosts = 0
+
+    @property
+    def period(self):
+        "the period to sample at now"
+        quiet = monotonic() - self._hold_until
+        if quiet <= 0:
+            return self.min_period
+        return min(self.min_period*2**(quiet/self.doubling), self.max_period)
+
+    def boost(self, hold = None):
+        "sample at the fastest rate for 'hold' seconds from now"
+        if hold is None:
+            hold = self.hold
+        with self._lock:
+            self._hold_until = max(self._hold_until, monotonic() + hold)
+            self.boosts += 1
+
+    def on_command(self, cmd):
+        "boost when 'cmd' moves a setpoint"
+        if cmd.strip().split(" ", 1)[0].upper() in SETPOINT_COMMANDS:
+            self.boost()
+
+    def _is_moving(self, reference, record):
+        dt = record['timestamp'] - reference['timestamp']
+        for name, threshold in self.thresholds.items():
+            try:
+                rate = abs(record[name] - reference[name])/dt
+            except (KeyError, TypeError):
+                continue
+            if rate > threshold: #NaN compares False and counts as quiet
+                return True
+        return False
+
+    def observe(self, fixture, records):
+        moving = False
+        with self._lock:
+            for record in records:
+                reference = self._references.get(fixture.name)
+                if reference is None:
+                    self._references[fixture.name] = record
+                elif record['timestamp'] - reference['timestamp'] >= self.span:
+                    moving = moving or self._is_moving(reference, record)
+                    self._references[fixture.name] = record
+            if moving:
+                self._hold_until = max(self._hold_until, monotonic() + self.span)
+
+    def __call__(self, fixture, records):
+        "the data listener signature"
+        self.observe(fixture, records)
+
+    def reset(self):
+        with self._lock:
+            self._references.clear()
+            self._hold_until = monotonic() + self.hold
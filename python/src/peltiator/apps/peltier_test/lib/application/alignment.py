@@ -0,0 +1,132 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import time, itertools, threading, bisect
+from collections import deque
+from Queue import Queue, Empty
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+ALIGNMENT_POLICIES     = ('nearest', 'interpolate')
+DEFAULT_HISTORY_LENGTH = 64
+DEFAULT_READ_TIMEOUT   = 5.0 #seconds
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def align_sample(history, timestamp, policy = 'nearest', max_skew = None):
+    """estimate a value at 'timestamp' from a time ordered sequence of
+       (timestamp, value) samples; returns (value, sample timestamp) or None
+       when no sample lies within 'max_skew' seconds.
+
+       'nearest'     - the sample closest in time
+       'interpolate' - linear interpolation between the samples bracketing
+                       the timestamp, nearest when it is outside the history
+    """
+    if policy not in ALIGNMENT_POLICIES:
+        raise ValueError, "alignment policy must be one of %r, got %r" % (ALIGNMENT_POLICIES, policy)
+    if not history:
+        return None
+    times = [t for t, _ in history]
+    i = bisect.bisect_left(times, timestamp)
+    if policy == 'interpolate' and 0 < i < len(times):
+        (t0, v0), (t1, v1) = history[i-1], history[i]
+        if max_skew is not None and (t1 - t0) > 2*max_skew:
+            return None #gap is too wide to bridge
+        if t1 == t0:
+            return v1, t1
+        frac = (timestamp - t0)/(t1 - t0)
+        return v0 + frac*(v1 - v0), timestamp
+    #nearest of the neighbours
+    candidates = [history[j] for j in (i-1, i) if 0 <= j < len(history)]
+    t, v = min(candidates, key = lambda sample: abs(sample[0] - timestamp))
+    if max_skew is not None and abs(t - timestamp) > max_skew:
+        return None
+    return v, t
+
+###############################################################################
+# CLASSES
+###############################################################################
+class InstrumentReader(object):
+    """Performs the reads of one instrument on its own persistent thread, so
+       it can be read at the same time as other instruments. Each reading is
+       stamped with the midpoint of its read call and kept in 'history'.
+
+       Call 'request()' to start a read and 'result()' to wait for it. Only
+       the result of the latest request is returned, those of earlier ones
+       that were never collected (e.g. after a timeout) are dropped.
+    """
+    def __init__(self, read_func, history_length = DEFAULT_HISTORY_LENGTH, name = None):
+        self.read_func = read_func
+        self.name      = name
+        self.history   = deque(maxlen = history_length)
+        self._history_lock = threading.Lock()
+        self._requests = Queue()
+        self._results  = Queue()
+        self._request_ids  = itertools.count()
+        self._last_request = None
+        self._pending_lock = threading.Lock()
+        self._pending      = 0 #requests not yet read
+        self._thread   = threading.Thread(target = self._run, name = name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, *args):
+        "start a read, 'args' are passed on to 'read_func'"
+        request_id = next(self._request_ids)
+        self._last_request = request_id
+        with self._pending_lock:
+            self._pending += 1
+        self._requests.put((request_id, args))
+
+    def result(self, timeout = DEFAULT_READ_TIMEOUT):
+        "(timestamp, value) of the latest requested read, re-raises the read's exception"
+        deadline = time.time() + timeout
+        while True:
+            try:
+                request_id, ok, obj = self._results.get(timeout = max(0.0, deadline - time.time()))
+            except Empty:
+                raise IOError, "instrument read timed out after %f seconds" % timeout
+            if request_id == self._last_request:
+                break #earlier ids are late results that nobody waited for
+        if not ok:
+            raise obj
+        return obj
+
+    def is_busy(self):
+        "whether a requested read has not finished yet, e.g. after 'result' timed out"
+        with self._pending_lock:
+            return self._pending > 0
+
+    def read(self, timeout = DEFAULT_READ_TIMEOUT):
+        self.request()
+        return self.result(timeout = timeout)
+
+    def get_history(self):
+        with self._history_lock:
+            return list(self.history)
+
+    def close(self):
+        self._requests.put(None)
+
+    def _run(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request_id, args = item
+            try:
+                t0 = time.time()
+                value = self.read_func(*args)
+                t1 = time.time()
+                sample = (0.5*(t0 + t1), value)
+                with self._history_lock:
+                    self.history.append(sample)
+                result = (request_id, True, sample)
+            except Exception, exc:
+                result = (request_id, False, exc)
+            with self._pending_lock:
+                self._pending -= 1
+            self._results.put(result)
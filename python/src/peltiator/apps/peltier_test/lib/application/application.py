@@ -3,18 +3,24 @@
 ###############################################################################
 #Standard Python
 #import os, sys, time, datetime, Queue, threading
-import os, sys, imp, time, warnings, threading
+import os, sys, time, warnings, threading
 from collections import OrderedDict
 from Queue import Queue, Empty
 #3rd Party
-import yaml, IPython, numpy
-#Automat framework provided
-from automat.core.hwcontrol.config.configuration import Configuration
-#pyTEIS framework provided
-from pyTEIS import pkg_info
-from pyTEIS.apps.lib.thread2 import Thread as KillableThread
+#(IPython, automat and pyTEIS are imported where they are needed, so that
+#the Application also runs headless, e.g. in 'benchmarks')
+import yaml, numpy
+#peltiator framework provided
+from peltiator.apps.lib.stats import LatencyHistograms, StageTimers, format_latency_table, format_stage_table
 #application local
-from script_program import ScriptProgram
+from script_engine import ScriptEngine
+from event_queue import ScriptEventQueue
+from data_export import ExportThread, export_columns, supported_extensions
+from alignment import InstrumentReader
+from scheduler import DeadlineScheduler
+from fixture import Fixture, DATA_COLUMNS, DEFAULT_FIXTURES
+from worker_process import FixtureWorker, ProcessFixture, WorkerSupervisor
+from seebeck import SeebeckEstimator, format_seebeck_summary
 
 ###############################################################################
 # CONSTANTS
@@ -25,6 +31,11 @@ PyTEIS Peltier Test %(version)s
     author: Craig Versek (cversek@gmail.com)
 *******************************************************************************
 """
+DEFAULT_STREAM_PERIOD = 0.1 #seconds
+DEFAULT_ACQUISITION_PERIOD = 0.1 #seconds
+DEFAULT_ALIGNMENT_POLICY   = 'nearest'
+DEFAULT_ALIGNMENT_MAX_SKEW = 0.5 #seconds, voltages further away are left as NaN
+FIXTURE_UPDATE_TIMEOUT     = 10.0 #seconds
 
 ###############################################################################
 # FUNCTIONSthreading
@@ -34,11 +45,8 @@ def stream_print(text,
                  eol = '\n', 
                  prefix = None
                 ):
-        if prefix:
-            stream.write(prefix)
-        stream.write(text)
-        if eol:
-            stream.write(eol)
+        #a single write, so that lines printed by concurrent fixtures stay whole
+        stream.write((prefix or "") + text + (eol or ""))
         stream.flush()
 ###############################################################################
 # CLASSES
@@ -50,20 +58,57 @@ class Application(object):
                  output_stream   = sys.stdout,
                  error_stream    = sys.stderr,
                  textbox_printer = lambda text: None,
+                 data_max_length = None,
+                 journal_dirpath = None,
+                 alignment_policy   = DEFAULT_ALIGNMENT_POLICY,
+                 alignment_max_skew = DEFAULT_ALIGNMENT_MAX_SKEW,
+                 stage_timing       = True,
+                 fixtures           = None,
+                 worker_processes   = False,
+                 rate_policy        = None,
                 ):
         self.config = config
+        #(peltier controller handle, DMM handle) pairs, each polled concurrently
+        if fixtures is None:
+            fixtures = getattr(config, 'fixtures', None) or DEFAULT_FIXTURES
+        self.fixture_handles = [tuple(pair) for pair in fixtures]
+        #sample each fixture in its own process, see 'worker_process'
+        self.worker_processes = worker_processes
+        self.supervisor = None
+        #how DMM voltages are matched to the controller's status timestamps
+        self.alignment_policy   = alignment_policy
+        self.alignment_max_skew = alignment_max_skew
+        self.data_max_length = data_max_length #None grows without bound
+        #every record is journaled to disk as it arrives, None means the cwd
+        if journal_dirpath is None:
+            journal_dirpath = os.getcwd()
+        self.journal_dirpath = journal_dirpath
         self.output_stream   = output_stream
         self.error_stream    = error_stream
         self.textbox_printer = textbox_printer
         self.user_ns  = {}
         #print the introductory message
         if intro_msg is None:
+            from pyTEIS import pkg_info
             intro_msg = INTRO_MSG_TEMPLATE % {'version' :pkg_info.metadata['version']}
         self.print_comment(intro_msg)
+        self.latency = LatencyHistograms()
+        #where the time of each sample goes, see 'stats'
+        self.stage_timers = StageTimers(enabled = stage_timing)
+        #analyses fed with every batch of new records, see 'add_data_listener'
+        self._data_listeners = []
+        self._listeners_lock = threading.Lock()
+        #an AdaptiveRatePolicy paces acquisition and script loops, None for fixed periods
+        self.rate_policy = rate_policy
+        if rate_policy is not None:
+            self.add_data_listener(rate_policy)
+        #the Seebeck coefficient estimated as the records arrive, see 'seebeck_report'
+        self.seebeck = SeebeckEstimator()
+        self.add_data_listener(self.seebeck)
         self._init_metadata()        
-        self._init_data()
         self._init_devices()
         self._init_script_thread()
+        self._init_acquisition_thread()
 
     def _init_metadata(self):
         md = OrderedDict()
@@ -72,28 +117,118 @@ class Application(object):
         self.metadata = md
 
     def _init_data(self):
-        self.data = OrderedDict((("timestamp",[]),
-                                 ("temperatureA_target",[]),
-                                 ("temperatureB_target",[]),
-                                 ("temperatureA_measured",[]),
-                                 ("temperatureB_measured",[]),
-                                 ("temperatureC_measured",[]),
-                                 ("chanA_output",[]),
-                                 ("chanB_output",[]),
-                                 ("voltage",[]),
-                               ))
+        for fixture in self.fixtures:
+            fixture.clear_data() #the next record starts a new journal
+        self.seebeck.reset()
+
+    def close_journal(self):
+        for fixture in self.fixtures:
+            fixture.close_journal()
 
     def _init_devices(self):
-        self.peltier_pid = self.config.load_device('peltier_pid')
-        self.dmm = self.config.load_device('dmm')
-        self.dmm.initialize()
-        self.dmm.setup_measurement('V dc')
+        self.fixtures = []
+        labelled = len(self.fixture_handles) > 1
+        for peltier_pid_handle, dmm_handle in self.fixture_handles:
+            label = peltier_pid_handle if labelled else None
+            if self.worker_processes:
+                worker = FixtureWorker(self.config, peltier_pid_handle, dmm_handle,
+                                       alignment_policy   = self.alignment_policy,
+                                       alignment_max_skew = self.alignment_max_skew,
+                                      )
+                fixture = ProcessFixture(self, peltier_pid_handle, worker, label = label)
+            else:
+                peltier_pid = self.config.load_device(peltier_pid_handle)
+                peltier_pid.stage_timers = self.stage_timers
+                dmm = self.config.load_device(dmm_handle)
+                dmm.initialize()
+                dmm.setup_measurement('V dc')
+                fixture = Fixture(self, peltier_pid_handle, peltier_pid, dmm, label = label)
+            self.fixtures.append(fixture)
+        if self.worker_processes:
+            #draining the rings is cheap, the sampling already runs in parallel
+            self._inline_fixtures = self.fixtures
+            threaded = []
+            self.supervisor = WorkerSupervisor([fixture.worker for fixture in self.fixtures],
+                                               on_restart = self._on_worker_restart)
+            self.supervisor.start()
+        else:
+            #every fixture but the first is updated on its own thread, so that the
+            #round trips of all fixtures overlap within one acquisition tick
+            self._inline_fixtures = self.fixtures[:1]
+            threaded = self.fixtures[1:]
+        self._fixture_workers = [InstrumentReader(fixture.update, history_length = 1,
+                                                  name = "%s_updater" % fixture.name)
+                                 for fixture in threaded]
         self.oven = self.config.load_device('oven')
 
+    def _on_worker_restart(self, worker):
+        self.print_comment("Warning: restarted the worker process of '%s' (%d restarts)"
+                           % (worker.peltier_pid_handle, worker.restarts))
+
+    def get_fixture(self, fixture = None):
+        "look up a fixture by index or controller handle, None is the first"
+        if fixture is None:
+            return self.fixtures[0]
+        if isinstance(fixture, Fixture):
+            return fixture
+        if isinstance(fixture, int):
+            return self.fixtures[fixture]
+        for f in self.fixtures:
+            if f.name == fixture:
+                return f
+        raise KeyError, "no fixture named '%s'" % fixture
+
+    #the first fixture stands in for the single fixture of older code and scripts
+    @property
+    def peltier_pid(self):
+        return self.fixtures[0].peltier_pid
+
+    @property
+    def dmm(self):
+        return self.fixtures[0].dmm
+
+    @property
+    def data(self):
+        return self.fixtures[0].data
+
+    @property
+    def journal(self):
+        return self.fixtures[0].journal
+
+    def add_data_listener(self, listener):
+        """call 'listener(fixture, records)' with the new records of every
+           fixture after they are stored, on the thread that sampled them
+        """
+        with self._listeners_lock:
+            self._data_listeners = self._data_listeners + [listener]
+
+    def remove_data_listener(self, listener):
+        with self._listeners_lock:
+            self._data_listeners = [l for l in self._data_listeners if l != listener]
+
+    def _notify_data_listeners(self, fixture, records):
+        for listener in self._data_listeners: #replaced, never mutated, so no lock
+            try:
+                listener(fixture, records)
+            except Exception, exc:
+                #a broken analysis must not stop the acquisition
+                self.print_comment("\t***error*** data listener %r: %r" % (listener, exc))
+
     def _init_script_thread(self):
-        self._script_thread = None
-        self._script_event_queue  = Queue()
+        self._script_event_queue  = ScriptEventQueue()
         self._script_failure_event = threading.Event()
+        self.script_engine = ScriptEngine(self)
+
+    def _init_acquisition_thread(self):
+        self._acquisition_thread = None
+        self._acquisition_stop_event = threading.Event()
+        self.acquisition_scheduler = None
+        #samples asked for with 'request_update', taken on their own thread
+        self._sample_lock = threading.Lock() #one sample at a time, periodic or requested
+        self._update_request_event   = threading.Event()
+        self._update_request_verbose = False
+        self._update_thread = None
+        self._closing = False
 
     def setup_textbox_printer(self, textbox_printer):
         self.textbox_printer = textbox_printer
@@ -121,96 +256,278 @@ class Application(object):
         status_msg = '\n'.join(status_msg) 
         #start the shell
         # directly open the shell
+        import IPython
         IPython.embed( user_ns=self.user_ns, banner2=status_msg)
 
-    def run_script(self,filepath):
-        self.print_comment("Running script '%s'..." % filepath)   
-        def task():
-            prog = ScriptProgram(app=self)
-            try:
-                basepath, filename = os.path.split(filepath)
-                mod_name, _ = os.path.splitext(filename)
-                filename, pathname, description = imp.find_module(mod_name,[basepath])
-                mod = imp.load_module(mod_name,filename,pathname,description)
-                mod.main(prog)
-            except SystemExit:
-                prog.send_event('ABORTED') 
-            except:
-                prog.send_event('ERROR', sys.exc_info())
-        
-        self._script_thread = KillableThread(target=task)
-        self._script_thread.daemon = True # make thread a daemon so it will not block on program exit
-        self._script_thread.start()  #launch thread!
+    def run_script(self, filepath, fixture = None):
+        """run the script's 'main(prog)' on its own thread, bound to 'fixture'
+           (index or controller handle) if given; returns the ScriptRun
+        """
+        if fixture is None:
+            self.print_comment("Running script '%s'..." % filepath)
+        else:
+            self.print_comment("Running script '%s' on fixture '%s'..." % (filepath, self.get_fixture(fixture).name))
+        return self.script_engine.run(filepath, fixture = fixture)
+
+    def run_script_per_fixture(self, filepath):
+        "run one copy of the script for each fixture, concurrently"
+        return [self.run_script(filepath, fixture = fixture.name) for fixture in self.fixtures]
+
+    def is_script_running(self):
+        return self.script_engine.is_running()
+
+    def abort_scripts(self, wait = True):
+        """cancel the running scripts, which stop at their next device call or
+           sample; returns the runs that did not stop in time, or with 'wait'
+           false returns at once with the runs still winding down
+        """
+        if not wait:
+            runs = self.script_engine.active_runs()
+            for run in runs:
+                run.cancel()
+            return [run for run in runs if run.is_alive()]
+        stuck = self.script_engine.cancel_all()
+        for run in stuck:
+            self.print_comment("Warning: script '%s' did not stop after being aborted" % run.filepath)
+        return stuck
              
     def clear_data(self):
         self._init_data()
 
     def close(self):
-        pass
+        if hasattr(self, 'script_engine'): #missing if devices never loaded
+            for run in self.script_engine.active_runs():
+                run.cancel()
+        self.stop_acquisition()
+        if getattr(self, '_update_thread', None) is not None:
+            self._closing = True
+            self._update_request_event.set()
+            self._update_thread.join()
+            self._update_thread = None
+        if getattr(self, 'supervisor', None) is not None:
+            self.supervisor.stop()
+        for worker in getattr(self, '_fixture_workers', []):
+            worker.close()
+        for fixture in getattr(self, 'fixtures', []): #empty if devices never loaded
+            fixture.close()
 
     def __del__(self):
         self.close()
 
     def update_data(self, verbose = True):
-        if verbose:
-            self.print_comment("Status update:")
-        try:
-            record = self.peltier_pid.get_status()
-            record['voltage'] = self.dmm.read()
-            for key, val in record.items():
+        """sample every fixture once, concurrently when there are several;
+           returns the data of the first fixture
+        """
+        with self.stage_timers.stage("update.total"):
+            #a fixture whose previous update is still running sits this tick out,
+            #rather than queueing updates it can only fall further behind on
+            requested = []
+            for worker in self._fixture_workers:
+                if worker.is_busy():
+                    self.print_comment("Warning: '%s' is still busy with an earlier update, skipped it"
+                                       % worker.name)
+                    continue
+                worker.request(verbose)
+                requested.append(worker)
+            #wait for all of them before reporting the first failure, so that
+            #no result is left behind for the next tick
+            errors = []
+            for fixture in self._inline_fixtures:
                 try:
-                    if verbose:                
-                        self.print_comment("\t%s: %s" % (key,val))
-                    self.data[key].append(val)
-                except KeyError:
-                    pass
-        except IOError, exc:
-            msg = str(exc)
-            self.print_comment("\t***error*** %s" % msg)        
-        return self.data
+                    fixture.update(verbose = verbose)
+                except Exception, exc:
+                    errors.append(exc)
+            for worker in requested:
+                try:
+                    worker.result(timeout = FIXTURE_UPDATE_TIMEOUT)
+                except Exception, exc:
+                    errors.append(exc)
+            if errors:
+                raise errors[0]
+            return self.data
+
+    def start_acquisition(self, period = DEFAULT_ACQUISITION_PERIOD, verbose = False):
+        """sample the instruments every 'period' seconds on a worker thread; the
+           samples go into 'self.data', which readers such as the GUI only read.
+           With a 'rate_policy' the period follows the policy instead.
+        """
+        if self.rate_policy is not None:
+            self.rate_policy.reset() #start at the fastest rate
+            period = self.rate_policy.period
+        if self.is_acquiring():
+            self.stop_acquisition()
+        self._acquisition_stop_event.clear()
+        self._acquisition_thread = threading.Thread(target = self._acquisition_loop,
+                                                    args   = (period, verbose),
+                                                   )
+        self._acquisition_thread.daemon = True
+        self._acquisition_thread.start()
+        #worker processes sample on their own, the thread collects their records
+        for fixture in self.fixtures:
+            if isinstance(fixture, ProcessFixture):
+                fixture.worker.set_period(period)
+
+    def stop_acquisition(self):
+        if not self.is_acquiring():
+            return
+        self._acquisition_stop_event.set()
+        self._acquisition_thread.join()
+        self._acquisition_thread = None
+        for fixture in self.fixtures:
+            if isinstance(fixture, ProcessFixture):
+                fixture.worker.set_period(0)
+
+    def is_acquiring(self):
+        return self._acquisition_thread is not None
+
+    def _sample(self, verbose):
+        with self._sample_lock:
+            try:
+                self.update_data(verbose = verbose)
+            except Exception, exc:
+                #keep sampling, but leave a trace of what went wrong
+                self.print_comment("\t***error*** acquisition: %r" % exc)
+
+    def request_update(self, verbose = True):
+        """take one sample on a background thread without waiting for it, e.g.
+           for a script's 'UPDATE' event, so the caller (the GUI) never blocks
+           on the devices; requests made while a sample runs are served by one
+           more sample, and none are needed while acquiring
+        """
+        if self.is_acquiring():
+            return
+        self._update_request_verbose = self._update_request_verbose or verbose
+        if self._update_thread is None:
+            self._update_thread = threading.Thread(target = self._update_request_loop,
+                                                   name   = "update_requests",
+                                                  )
+            self._update_thread.daemon = True
+            self._update_thread.start()
+        self._update_request_event.set()
+
+    def _update_request_loop(self):
+        while True:
+            self._update_request_event.wait()
+            if self._closing:
+                return
+            self._update_request_event.clear()
+            verbose, self._update_request_verbose = self._update_request_verbose, False
+            self._sample(verbose)
+
+    def _acquisition_loop(self, period, verbose):
+        sample = lambda: self._sample(verbose)
+        adapt = None
+        if self.rate_policy is not None:
+            def adapt():
+                period = self.rate_policy.period
+                for fixture in self.fixtures:
+                    if isinstance(fixture, ProcessFixture):
+                        fixture.worker.set_period(period)
+                return period
+        #a slow sample skips ticks rather than bunching the following ones
+        self.acquisition_scheduler = DeadlineScheduler(period, sample,
+                                                       policy     = 'skip',
+                                                       stop_event = self._acquisition_stop_event,
+                                                       adapt      = adapt,
+                                                      )
+        self.acquisition_scheduler.run()
+
+    def start_streaming(self, period = DEFAULT_STREAM_PERIOD):
+        self.print_comment("Starting status streaming every %0.3f seconds." % period)
+        for fixture in self.fixtures:
+            fixture.peltier_pid.start_streaming(period = period)
+
+    def stop_streaming(self):
+        for fixture in self.fixtures:
+            fixture.peltier_pid.stop_streaming()
+        self.print_comment("Stopped status streaming.")
+
+    def latency_report(self, verbose = True):
+        """per command type exchange latency percentiles for the peltier
+           controller and the DMM, e.g. 'app.latency_report()' from the shell
+        """
+        summary = OrderedDict()
+        for fixture in self.fixtures:
+            summary.update(fixture.latency_summary())
+        summary.update(self.latency.summary())
+        if verbose:
+            for line in format_latency_table(summary, title = "command"):
+                self.print_comment(line)
+        return summary
+
+    def stats(self, verbose = True):
+        """rolling timing statistics of the stages of 'update_data' (and of
+           the GUI and script loops when they run), e.g. 'app.stats()' from
+           the shell; switch them off with 'app.stage_timers.enabled = False'
+        """
+        summary = self.stage_timers.summary()
+        if verbose:
+            for line in format_stage_table(summary):
+                self.print_comment(line)
+        return summary
+
+    def seebeck_report(self, verbose = True):
+        """the running fit of voltage against temperatureA - temperatureB per
+           fixture, overall and per gradient step, e.g. 'app.seebeck_report()'
+           from the shell
+        """
+        summary = self.seebeck.summary()
+        if verbose:
+            for line in format_seebeck_summary(summary):
+                self.print_comment(line)
+        return summary
+
+    def stream_counters(self, fixture = None):
+        "counts of received, dropped, late and bad streamed records"
+        return self.get_fixture(fixture).peltier_pid.stream_counters
     
-    def send_command_to_peltier_pid(self, cmd):
+    def send_command_to_peltier_pid(self, cmd, fixture = None):
         cmd.rstrip("\n\r ")
         #self.print_comment("Sending command: %s" % cmd)
-        resp = self.peltier_pid.send_command(cmd)
+        resp = self.get_fixture(fixture).peltier_pid.send_command(cmd)
+        if self.rate_policy is not None:
+            #sample the transient that a setpoint change starts at the fastest rate
+            self.rate_policy.on_command(cmd)
         #self.print_comment("Got response: %s" % resp)
         return resp
 
-    def change_gradient_setpoint(self, grad):
-        self.send_command_to_peltier_pid("GRAD %0.2f" % grad)
+    def change_gradient_setpoint(self, grad, fixture = None):
+        self.send_command_to_peltier_pid("GRAD %0.2f" % grad, fixture = fixture)
 
-    def change_setpointA(self, temp):
-        self.send_command_to_peltier_pid("TEMP_A %0.2f" % temp)
+    def change_setpointA(self, temp, fixture = None):
+        self.send_command_to_peltier_pid("TEMP_A %0.2f" % temp, fixture = fixture)
   
-    def change_setpointB(self, temp):
-        self.send_command_to_peltier_pid("TEMP_B %0.2f\n" % temp)
+    def change_setpointB(self, temp, fixture = None):
+        self.send_command_to_peltier_pid("TEMP_B %0.2f\n" % temp, fixture = fixture)
         
-    def export_data(self, filename):
+    def export_data(self, filename, background = False, fixture = None):
+        """write the data collected so far to 'filename', the format follows the
+           extension (see 'data_export.supported_extensions'); with 'background'
+           the file is written by a thread which is returned
+        """
         base, ext = os.path.splitext(filename)
-        if ext == ".csv":
-            delimiter      = ", "
-            comment_prefix = "#"
-            newline        = "\n"
-            #write metadata
-            with open(filename, 'w') as f:
-                for key, val in self.metadata.items():
-                    line = delimiter.join((comment_prefix,str(key),str(val)))                       
-                    f.write(line + newline)
-            #write data in append mode
-            colnames_array = numpy.array(self.data.keys()).reshape((1,-1))
-            data_array     = numpy.array(self.data.values()).transpose()
-            output_array   = numpy.vstack((colnames_array, data_array))
-            with open(filename, 'a') as f:
-                numpy.savetxt(f, output_array, delimiter=delimiter, fmt='%s', newline=newline)
-        else:
-            self.print_comment("Warning: file extension '%s' not understood" % ext)         
-
+        if not ext.lower() in supported_extensions():
+            self.print_comment("Warning: file extension '%s' not understood" % ext)
+            return None
+        fixture  = self.get_fixture(fixture)
+        columns  = fixture.data.snapshot()
+        metadata = OrderedDict(self.metadata)
+        if fixture.label is not None:
+            metadata['fixture'] = fixture.label
+        if background:
+            export_thread = ExportThread(filename, columns, metadata)
+            export_thread.start()
+            return export_thread
+        export_columns(filename, columns, metadata)
+        return None
     
 
 ################################################################################
 #  TEST CODE
 ################################################################################
 if __name__ == "__main__":
+    from automat.core.hwcontrol.config.configuration import Configuration
+    from pyTEIS import pkg_info
     CONFIG_FILENAME = "peltier_test.cfg"
     #load the configuration
     config_dirpath = pkg_info.platform['config_dirpath']
@@ -0,0 +1,138 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import os, zipfile, tempfile, threading
+#3rd Party
+import numpy, yaml
+from numpy.lib import format as npy_format
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_CHUNK_SIZE = 2**14 #rows written per chunk
+CSV_DELIMITER      = ", "
+CSV_COMMENT_PREFIX = "#"
+CSV_NEWLINE        = "\n"
+NPZ_METADATA_KEY   = "__metadata__"
+HDF5_EXTENSIONS    = (".h5", ".hdf5")
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def supported_extensions():
+    exts = [".csv", ".npz"]
+    if h5py is not None:
+        exts.extend(HDF5_EXTENSIONS)
+    return exts
+
+def _column_format(dtype):
+    kind = numpy.dtype(dtype).kind
+    if kind in 'iub':
+        return '%d'
+    if kind == 'f':
+        return '%r' #shortest repr that round trips
+    return '%s'
+
+def export_csv(filename, columns, metadata, chunk_size = DEFAULT_CHUNK_SIZE):
+    """write the metadata as comment lines and then the columns, 'chunk_size'
+       rows at a time so that memory use does not depend on the run length
+    """
+    names = columns.keys()
+    arrays = columns.values()
+    fmt = CSV_DELIMITER.join(_column_format(a.dtype) for a in arrays)
+    length = min(len(a) for a in arrays) if arrays else 0
+    with open(filename, 'w') as f:
+        for key, val in metadata.items():
+            line = CSV_DELIMITER.join((CSV_COMMENT_PREFIX,str(key),str(val)))
+            f.write(line + CSV_NEWLINE)
+        f.write(CSV_DELIMITER.join(names) + CSV_NEWLINE)
+        for start in xrange(0, length, chunk_size):
+            stop = min(start + chunk_size, length)
+            chunk = [a[start:stop].tolist() for a in arrays]
+            for row in zip(*chunk):
+                f.write(fmt % row + CSV_NEWLINE)
+
+def _write_npy_chunked(f, a, chunk_size):
+    "the '.npy' format of the 1D array 'a', written 'chunk_size' rows at a time"
+    a = numpy.asanyarray(a)
+    if a.ndim != 1 or a.dtype.hasobject:
+        npy_format.write_array(f, a)
+        return
+    npy_format.write_array_header_1_0(f, npy_format.header_data_from_array_1_0(a))
+    for start in xrange(0, len(a), chunk_size):
+        f.write(numpy.ascontiguousarray(a[start:start + chunk_size]).tostring())
+
+def export_npz(filename, columns, metadata, chunk_size = DEFAULT_CHUNK_SIZE):
+    """one '.npy' member per column plus the metadata as a YAML string, as
+       'numpy.load' reads them; each column goes through a temporary file
+       'chunk_size' rows at a time (the zipfile module cannot stream into a
+       member), so no whole-column copy is made
+    """
+    arrays = list(columns.items())
+    arrays.append((NPZ_METADATA_KEY, numpy.array(yaml.safe_dump(dict(metadata)))))
+    fd, tmp_filename = tempfile.mkstemp(suffix = ".npy")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED, allowZip64 = True) as zf:
+            for name, a in arrays:
+                with open(tmp_filename, 'wb') as f:
+                    _write_npy_chunked(f, a, chunk_size)
+                zf.write(tmp_filename, arcname = name + ".npy")
+    finally:
+        os.remove(tmp_filename)
+
+def export_hdf5(filename, columns, metadata, chunk_size = DEFAULT_CHUNK_SIZE):
+    "one dataset per column, metadata as file attributes"
+    if h5py is None:
+        raise ImportError, "HDF5 export requires the 'h5py' package"
+    with h5py.File(filename, 'w') as f:
+        for key, val in metadata.items():
+            f.attrs[str(key)] = str(val)
+        for name, a in columns.items():
+            dset = f.create_dataset(name, shape = a.shape, dtype = a.dtype,
+                                    chunks = (min(chunk_size, max(len(a),1)),))
+            for start in xrange(0, len(a), chunk_size):
+                stop = min(start + chunk_size, len(a))
+                dset[start:stop] = a[start:stop]
+
+EXPORTERS = {".csv" : export_csv,
+             ".npz" : export_npz,
+             ".h5"  : export_hdf5,
+             ".hdf5": export_hdf5,
+            }
+
+def export_columns(filename, columns, metadata, chunk_size = DEFAULT_CHUNK_SIZE):
+    "pick the format from the file extension, raises ValueError if unknown"
+    _, ext = os.path.splitext(filename)
+    try:
+        exporter = EXPORTERS[ext.lower()]
+    except KeyError:
+        raise ValueError, "file extension '%s' not understood, use one of %s" % (ext, ", ".join(supported_extensions()))
+    exporter(filename, columns, metadata, chunk_size = chunk_size)
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ExportThread(threading.Thread):
+    """Writes a snapshot of the data in the background, so acquisition and the
+       GUI keep running. Check 'is_alive()' and then 'error' when it is done.
+    """
+    def __init__(self, filename, columns, metadata, chunk_size = DEFAULT_CHUNK_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon     = True
+        self.filename   = filename
+        self.columns    = columns
+        self.metadata   = metadata
+        self.chunk_size = chunk_size
+        self.error      = None
+
+    def run(self):
+        try:
+            export_columns(self.filename, self.columns, self.metadata, chunk_size = self.chunk_size)
+        except Exception, exc:
+            self.error = exc
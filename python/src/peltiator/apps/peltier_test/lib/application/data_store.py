@@ -0,0 +1,251 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import threading
+from collections import OrderedDict
+#3rd Party
+import numpy
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_INITIAL_CAPACITY = 1024
+FLOAT_DTYPE  = numpy.float64
+INT_DTYPE    = numpy.int64
+OBJECT_DTYPE = numpy.object_
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def infer_dtype(val):
+    if isinstance(val, bool):
+        return numpy.bool_
+    if isinstance(val, (int, long, numpy.integer)):
+        return INT_DTYPE
+    if isinstance(val, (float, numpy.floating)):
+        return FLOAT_DTYPE
+    return OBJECT_DTYPE
+
+def fill_value(dtype):
+    "value used for samples where a column has no data"
+    kind = numpy.dtype(dtype).kind
+    if kind == 'f':
+        return numpy.nan
+    if kind in 'iub':
+        return 0
+    return None
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ColumnStore(object):
+    """Typed columnar sample store backed by NumPy arrays with O(1) amortized
+       appends. Columns are created from the keys of the appended records, so
+       the schema follows whatever the status record contains.
+
+       By default the buffers grow by doubling. With 'max_length' set the store
+       is a ring holding the newest 'max_length' samples; every value is
+       written twice into a buffer of twice that size, so the newest N samples
+       are always one contiguous slice and can be handed out as views.
+
+       Supports the read-only mapping interface that the plotter and the
+       exporter use: 'store[name]', 'keys()', 'values()', 'items()'.
+    """
+    def __init__(self,
+                 columns          = None,
+                 max_length       = None,
+                 initial_capacity = DEFAULT_INITIAL_CAPACITY,
+                ):
+        self.max_length = max_length
+        if max_length is None:
+            self._capacity = initial_capacity
+        else:
+            self._capacity = max_length
+        self._buffers = OrderedDict()
+        self._count   = 0  #total number of samples ever appended
+        self._lock    = threading.RLock()
+        if columns is not None:
+            for name, dtype in columns:
+                self.add_column(name, dtype)
+
+    def _buffer_size(self):
+        if self.max_length is None:
+            return self._capacity
+        return 2*self._capacity #mirrored ring
+
+    def __len__(self):
+        if self.max_length is None:
+            return self._count
+        return min(self._count, self._capacity)
+
+    @property
+    def total_count(self):
+        "number of samples appended since creation, including overwritten ones"
+        return self._count
+
+    def _window(self, n = None):
+        #slice bounds of the newest 'n' valid samples within the buffers
+        length = len(self)
+        if n is None or n > length:
+            n = length
+        if self.max_length is None or self._count <= self._capacity:
+            end = self._count
+        else:
+            end = self._count % self._capacity + self._capacity
+        return end - n, end
+
+    def add_column(self, name, dtype = FLOAT_DTYPE):
+        with self._lock:
+            if name in self._buffers:
+                return
+            if self._count and numpy.dtype(dtype).kind in 'iub':
+                #the earlier samples have no value, NaN says so where 0 would not
+                dtype = FLOAT_DTYPE
+            buff = numpy.empty(self._buffer_size(), dtype = dtype)
+            buff[:] = fill_value(dtype)
+            self._buffers[name] = buff
+
+    def _promote_column(self, name, dtype):
+        old = self._buffers[name]
+        self._buffers[name] = old.astype(dtype)
+
+    def _grow(self):
+        self._capacity *= 2
+        for name, old in self._buffers.items():
+            new = numpy.empty(self._capacity, dtype = old.dtype)
+            new[:self._count] = old[:self._count]
+            new[self._count:] = fill_value(old.dtype)
+            self._buffers[name] = new
+
+    def append(self, record):
+        "append one sample, keys not seen before become new columns"
+        with self._lock:
+            for key, val in record.items():
+                buff = self._buffers.get(key)
+                if buff is None:
+                    self.add_column(key, infer_dtype(val))
+                elif buff.dtype.kind in 'iub' and isinstance(val, (float, numpy.floating)):
+                    self._promote_column(key, FLOAT_DTYPE)
+            for key, buff in self._buffers.items():
+                if buff.dtype.kind in 'iub' and key not in record:
+                    #a missing integer is stored as NaN, not as a plausible 0
+                    self._promote_column(key, FLOAT_DTYPE)
+            if self.max_length is None:
+                if self._count == self._capacity:
+                    self._grow()
+                positions = (self._count,)
+            else:
+                index = self._count % self._capacity
+                positions = (index, index + self._capacity)
+            for key, buff in self._buffers.items():
+                val = record.get(key, fill_value(buff.dtype))
+                for pos in positions:
+                    buff[pos] = val
+            self._count += 1
+
+    def extend(self, records):
+        with self._lock:
+            for record in records:
+                self.append(record)
+
+    def extend_columns(self, columns):
+        """append a block of samples given as {name: 1D array} of equal length,
+           with whole-array copies instead of per-record appends; names not
+           seen before become new columns, and missing integers follow the
+           same rules as in 'append'
+        """
+        with self._lock:
+            if not columns:
+                return
+            n = len(columns.values()[0])
+            if n == 0:
+                return
+            for name, values in columns.items():
+                buff = self._buffers.get(name)
+                if buff is None:
+                    self.add_column(name, values.dtype)
+                elif buff.dtype.kind in 'iub' and values.dtype.kind == 'f':
+                    self._promote_column(name, FLOAT_DTYPE)
+            for name, buff in self._buffers.items():
+                if buff.dtype.kind in 'iub' and name not in columns:
+                    self._promote_column(name, FLOAT_DTYPE)
+            if self.max_length is None:
+                while self._count + n > self._capacity:
+                    self._grow()
+                chunks = [(self._count, 0, n)]
+            else:
+                #only the newest 'capacity' samples survive the block
+                skip = max(0, n - self._capacity)
+                start = (self._count + skip) % self._capacity
+                first = min(n - skip, self._capacity - start)
+                chunks = [(start, skip, skip + first), (0, skip + first, n)]
+            for name, buff in self._buffers.items():
+                values = columns.get(name)
+                for pos, i, j in chunks:
+                    if i == j:
+                        continue
+                    val = fill_value(buff.dtype) if values is None else values[i:j]
+                    buff[pos:pos + j - i] = val
+                    if self.max_length is not None: #the mirror copy
+                        buff[pos + self._capacity:pos + self._capacity + j - i] = val
+            self._count += n
+
+    def clear(self):
+        #fresh buffers, so views handed out earlier (e.g. to an export) stay intact
+        with self._lock:
+            self._count = 0
+            for name, buff in self._buffers.items():
+                self._buffers[name] = numpy.empty_like(buff)
+                self._buffers[name][:] = fill_value(buff.dtype)
+
+    #--------------------------------------------------------------------------
+    # zero-copy access
+    def last(self, n = None, names = None):
+        """views of the newest 'n' samples (all if None) for the requested
+           columns; the views alias the store, so copy them to keep them
+        """
+        with self._lock:
+            start, end = self._window(n)
+            if names is None:
+                names = self._buffers.keys()
+            return OrderedDict((name, self._buffers[name][start:end]) for name in names)
+
+    def snapshot(self):
+        """a consistent set of columns of all current samples that later appends
+           will not change: views when growing (appends never touch written
+           slots), copies in ring mode (bounded by 'max_length')
+        """
+        with self._lock:
+            columns = self.last()
+            if self.max_length is not None:
+                columns = OrderedDict((name, a.copy()) for name, a in columns.items())
+            return columns
+
+    def column(self, name, n = None):
+        with self._lock:
+            start, end = self._window(n)
+            return self._buffers[name][start:end]
+
+    def dtypes(self):
+        return OrderedDict((name, buff.dtype) for name, buff in self._buffers.items())
+
+    #--------------------------------------------------------------------------
+    # mapping interface
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __contains__(self, name):
+        return name in self._buffers
+
+    def __iter__(self):
+        return iter(self._buffers.keys())
+
+    def keys(self):
+        return self._buffers.keys()
+
+    def values(self):
+        return self.last().values()
+
+    def items(self):
+        return self.last().items()
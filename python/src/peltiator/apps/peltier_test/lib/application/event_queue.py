@@ -0,0 +1,148 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import os, errno, threading
+from collections import deque
+from Queue import Empty
+try:
+    import fcntl
+except ImportError: #e.g. on Windows, consumers poll instead
+    fcntl = None
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+#events that only ask for a refresh, many in a row are served by one
+REFRESH_EVENTS = {'UPDATE'      : (True,  True),  #(sample data, redraw plot)
+                  'UPDATE_DATA' : (True,  False),
+                  'UPDATE_PLOT' : (False, True),
+                 }
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def coalesce_events(events):
+    """merge a batch of (event_type, obj) script events: consecutive 'PRINT's
+       become one, and the refresh events between two other events become a
+       single 'UPDATE', 'UPDATE_DATA' or 'UPDATE_PLOT'. Any other event keeps
+       its place, so e.g. nothing is moved across a 'CLEAR_DATA'.
+    """
+    merged = []
+    prints = []
+    refresh = [False, False]
+    def flush():
+        if prints:
+            merged.append(('PRINT', "\n".join(prints)))
+            del prints[:]
+        if refresh[0] and refresh[1]:
+            merged.append(('UPDATE', None))
+        elif refresh[0]:
+            merged.append(('UPDATE_DATA', None))
+        elif refresh[1]:
+            merged.append(('UPDATE_PLOT', None))
+        refresh[:] = [False, False]
+    for event_type, obj in events:
+        if event_type == 'PRINT':
+            prints.append(obj)
+        elif event_type in REFRESH_EVENTS:
+            data, plot = REFRESH_EVENTS[event_type]
+            refresh[0] = refresh[0] or data
+            refresh[1] = refresh[1] or plot
+        else:
+            flush()
+            merged.append((event_type, obj))
+    flush()
+    return merged
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ScriptEventQueue(object):
+    """Script events for the GUI thread. The first 'put' after a 'drain'
+       writes one byte to a wake-up pipe, so the consumer can sleep on
+       'fileno()' (e.g. a Tk file handler) instead of polling, then take
+       everything that piled up in one coalesced batch with 'drain()'.
+       Without 'fcntl' there is no pipe, 'fileno()' is None and the
+       consumer has to poll.
+
+       'put', 'get', 'get_nowait' and 'empty' behave as for a Queue.
+    """
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._events = deque()
+        self._wake_r = self._wake_w = None
+        if fcntl is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            for fd in (self._wake_r, self._wake_w):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._wake_pending = False
+        self.received  = 0
+        self.delivered = 0 #after coalescing
+
+    def fileno(self):
+        "readable when events are waiting, None without a wake-up pipe"
+        return self._wake_r
+
+    def put(self, event):
+        with self._lock:
+            self._events.append(event)
+            self.received += 1
+            self._not_empty.notify()
+            if self._wake_pending or self._wake_w is None:
+                return
+            self._wake_pending = True
+            try:
+                os.write(self._wake_w, "x")
+            except OSError, exc:
+                if exc.errno != errno.EAGAIN: #pipe full means a wake-up is pending anyway
+                    raise
+
+    def _clear_wakeup(self):
+        if self._wake_r is None:
+            return
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError, exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+        self._wake_pending = False
+
+    def drain(self, coalesce = True):
+        "all waiting events, coalesced unless asked not to"
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            self._clear_wakeup()
+        if coalesce:
+            events = coalesce_events(events)
+        self.delivered += len(events)
+        return events
+
+    def get_nowait(self):
+        with self._lock:
+            if not self._events:
+                raise Empty
+            event = self._events.popleft()
+            if not self._events:
+                self._clear_wakeup()
+            self.delivered += 1
+            return event
+
+    def get(self, block = True, timeout = None):
+        if block:
+            with self._not_empty:
+                if not self._events:
+                    self._not_empty.wait(timeout)
+        return self.get_nowait()
+
+    def empty(self):
+        return not self._events
+
+    def close(self):
+        if self._wake_r is not None:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
@@ -0,0 +1,179 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import time, threading
+from collections import OrderedDict
+#3rd Party
+import numpy
+#application local
+from data_store import ColumnStore
+from journal import JournalWriter, journal_columns, make_journal_filename
+from alignment import InstrumentReader, align_sample
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+#(peltier controller handle, DMM handle) pairs loaded from the configuration
+DEFAULT_FIXTURES = (('peltier_pid', 'dmm'),)
+NAN = float('nan')
+#columns that always exist so that the plots work before the first sample,
+#any other fields of the status record are added as they arrive
+DATA_COLUMNS = (("timestamp"            , numpy.float64),
+                ("temperatureA_target"  , numpy.float64),
+                ("temperatureB_target"  , numpy.float64),
+                ("temperatureA_measured", numpy.float64),
+                ("temperatureB_measured", numpy.float64),
+                ("temperatureC_measured", numpy.float64),
+                ("chanA_output"         , numpy.float64),
+                ("chanB_output"         , numpy.float64),
+                ("voltage"              , numpy.float64),
+               )
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def parse_fixtures(text):
+    """parse a fixture list such as 'peltier_pid:dmm,peltier_pid2:dmm2' into
+       (peltier controller handle, DMM handle) pairs
+    """
+    fixtures = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        handles = item.split(":")
+        if len(handles) != 2 or not all(handles):
+            raise ValueError, "expected 'peltier_pid_handle:dmm_handle', got '%s'" % item
+        fixtures.append(tuple(h.strip() for h in handles))
+    return fixtures
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Fixture(object):
+    """One thermoelectric fixture: a peltier controller and the DMM that reads
+       its sample voltage, with their own data store and journal. The run wide
+       settings (metadata, journal directory, alignment policy, timers) are
+       read from the owning Application.
+
+       'label' is None when the fixture is the only one, which keeps the plain
+       names of stages, latencies and journal files; otherwise it prefixes them.
+    """
+    def __init__(self, app, name, peltier_pid, dmm, label = None):
+        self.app   = app
+        self.name  = name
+        self.label = label
+        self.peltier_pid = peltier_pid
+        self.dmm         = dmm
+        self.journal = None
+        #guards swapping the data store and journal against the acquisition thread
+        self._data_lock = threading.RLock()
+        self._prefix = "" if label is None else label + "."
+        self._dmm_reader = InstrumentReader(self._read_dmm, name = self._prefix + "dmm_reader")
+        self.clear_data()
+
+    def clear_data(self):
+        with self._data_lock:
+            self.close_journal() #the next record starts a new journal
+            self.data = ColumnStore(columns = DATA_COLUMNS, max_length = self.app.data_max_length)
+
+    def _read_dmm(self):
+        t0 = time.time()
+        voltage = self.dmm.read()
+        self.app.latency.record(self._prefix + "dmm.read", time.time() - t0)
+        return voltage
+
+    def _journal_records(self, records):
+        #a journal's column layout is fixed, when the store's changes (a new
+        #field or a promoted type) the journal continues in a new segment
+        columns = journal_columns(self.data.dtypes())
+        if self.journal is not None and columns != self.journal.columns:
+            self.close_journal()
+            self.app.print_comment("The data columns changed, starting a new journal segment.")
+        if self.journal is None:
+            metadata = OrderedDict(self.app.metadata)
+            if self.label is not None:
+                metadata['fixture'] = self.label
+            filename = make_journal_filename(self.app.journal_dirpath, metadata)
+            self.journal = JournalWriter(filename,
+                                         metadata = metadata,
+                                         columns  = columns,
+                                        )
+            self.app.print_comment("Journaling data to '%s'." % self.journal.filename)
+        self.journal.extend(records)
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def update(self, verbose = True):
+        "read the instruments once (or drain the stream) and store the records"
+        stage = self.app.stage_timers.stage
+        prefix = self._prefix + "update."
+        try:
+            if self.peltier_pid.is_streaming():
+                #drain whatever the reader thread has collected so far
+                with stage(prefix + "drain"):
+                    records = self.peltier_pid.drain_records()
+                if not records:
+                    return self.data
+                with stage(prefix + "dmm_read"):
+                    self._dmm_reader.read()
+            else:
+                #read both instruments at the same time
+                #should get_status fail, the next tick's 'result' skips this reading
+                self._dmm_reader.request()
+                with stage(prefix + "get_status"):
+                    records = [self.peltier_pid.get_status()]
+                with stage(prefix + "dmm_wait"):
+                    self._dmm_reader.result()
+            with stage(prefix + "align"):
+                self._align_voltages(records)
+            if verbose:
+                with stage(prefix + "print"):
+                    lines = []
+                    if self.label is not None:
+                        lines.append("\t[%s]" % self.label)
+                    if len(records) > 1:
+                        lines.append("\t(%d streamed records, showing newest)" % len(records))
+                    for key, val in records[-1].items():
+                        lines.append("\t%s: %s" % (key,val))
+                    self.app.print_comment("\n".join(lines))
+            with self._data_lock:
+                with stage(prefix + "store"):
+                    self.data.extend(records)
+                with stage(prefix + "journal"):
+                    self._journal_records(records)
+            with stage(prefix + "listeners"):
+                self.app._notify_data_listeners(self, records)
+        except IOError, exc:
+            if self.label is None:
+                self.app.print_comment("\t***error*** %s" % exc)
+            else:
+                self.app.print_comment("\t***error*** [%s] %s" % (self.label, exc))
+        return self.data
+
+    def _align_voltages(self, records):
+        "pair each status record with a DMM voltage according to the alignment policy"
+        history = self._dmm_reader.get_history()
+        for record in records:
+            aligned = align_sample(history, record['timestamp'],
+                                   policy   = self.app.alignment_policy,
+                                   max_skew = self.app.alignment_max_skew,
+                                  )
+            if aligned is None:
+                record['voltage'], record['voltage_timestamp'] = NAN, NAN
+            else:
+                record['voltage'], record['voltage_timestamp'] = aligned
+
+    def latency_summary(self):
+        "the controller's command latencies, prefixed with the label"
+        summary = self.peltier_pid.latency_summary()
+        return OrderedDict((self._prefix + key, s) for key, s in summary.items())
+
+    def close(self):
+        self._dmm_reader.close()
+        self.close_journal()
+        self.peltier_pid.stop_streaming()
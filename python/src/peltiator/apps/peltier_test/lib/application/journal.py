@@ -0,0 +1,181 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import os, time, errno, struct, threading
+from collections import OrderedDict
+#3rd Party
+import numpy, yaml
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+#file layout: MAGIC, header length (uint32 LE), YAML header, zero padding up to
+#a multiple of DATA_ALIGNMENT, then fixed-width little-endian records
+JOURNAL_MAGIC          = "PLTJRNL1"
+JOURNAL_EXTENSION      = ".journal"
+HEADER_LENGTH_STRUCT   = struct.Struct("<I")
+DATA_ALIGNMENT         = 64
+DEFAULT_FSYNC_PERIOD   = 1.0 #seconds
+JOURNAL_DTYPES = {'f': "<f8", 'i': "<i8", 'u': "<i8", 'b': "<i8"}
+MAX_FILENAME_SUFFIX    = 1000 #'name-2.journal' ... before giving up
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def journal_columns(dtypes):
+    """map column dtypes onto the fixed-width journal types, columns that have
+       no fixed width representation (e.g. strings) are left out
+    """
+    columns = OrderedDict()
+    for name, dtype in dtypes.items():
+        jtype = JOURNAL_DTYPES.get(numpy.dtype(dtype).kind)
+        if jtype is not None:
+            columns[name] = jtype
+    return columns
+
+def _fill_value(jtype):
+    return float('nan') if jtype == "<f8" else 0
+
+def make_journal_filename(dirpath, metadata, timestamp = None):
+    if timestamp is None:
+        timestamp = time.time()
+    stamp = time.strftime("%Y-%m-%d_%H%M%S", time.localtime(timestamp))
+    parts = [stamp, metadata.get('sample_name') or None, metadata.get('fixture') or None, "peltier_test"]
+    filename = "_".join(p for p in parts if p) + JOURNAL_EXTENSION
+    return os.path.join(dirpath, filename)
+
+def open_exclusive(filename):
+    """create and open 'filename' for binary writing, never an existing file:
+       when it is taken, '-2', '-3', ... is added before the extension;
+       returns the file and the name used
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    base, ext = os.path.splitext(filename)
+    candidate = filename
+    for n in xrange(2, MAX_FILENAME_SUFFIX + 2):
+        try:
+            fd = os.open(candidate, flags, 0666)
+        except OSError, exc:
+            if exc.errno != errno.EEXIST:
+                raise
+            candidate = "%s-%d%s" % (base, n, ext)
+            continue
+        return os.fdopen(fd, 'wb'), candidate
+    raise IOError, "could not find a free file name for '%s'" % filename
+
+###############################################################################
+# CLASSES
+###############################################################################
+class JournalWriter(object):
+    """Append-only acquisition journal, one fixed-width binary record per
+       sample after a YAML header holding the metadata and the column layout.
+       Appends only go to the buffered file; a background thread flushes and
+       fsyncs every 'fsync_period' seconds, so a crash loses at most that
+       much data and sampling never waits on the disk.
+
+       An existing file is never overwritten, 'filename' is the name that
+       was actually created (see 'open_exclusive').
+    """
+    def __init__(self, filename, metadata, columns, fsync_period = DEFAULT_FSYNC_PERIOD):
+        self.columns  = OrderedDict(columns)
+        self.fsync_period = fsync_period
+        self._struct  = struct.Struct("<" + "".join('d' if t == "<f8" else 'q' for t in self.columns.values()))
+        self._fills   = [(name, _fill_value(t)) for name, t in self.columns.items()]
+        self._lock    = threading.Lock()
+        self._file, self.filename = open_exclusive(filename)
+        self._write_header(metadata)
+        self.count    = 0
+        self._closed  = threading.Event()
+        self._sync_thread = threading.Thread(target = self._sync_loop)
+        self._sync_thread.daemon = True
+        self._sync_thread.start()
+
+    def _write_header(self, metadata):
+        header = OrderedDict()
+        header['metadata'] = dict((str(k), v) for k, v in metadata.items())
+        header['columns']  = [[name, jtype] for name, jtype in self.columns.items()]
+        header['record_size'] = self._struct.size
+        text = yaml.safe_dump(dict(header))
+        prefix_len = len(JOURNAL_MAGIC) + HEADER_LENGTH_STRUCT.size
+        padding = -(prefix_len + len(text)) % DATA_ALIGNMENT
+        text += "\0"*padding
+        self._file.write(JOURNAL_MAGIC)
+        self._file.write(HEADER_LENGTH_STRUCT.pack(len(text)))
+        self._file.write(text)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, record):
+        data = self._struct.pack(*[record.get(name, fill) for name, fill in self._fills])
+        with self._lock:
+            self._file.write(data)
+            self.count += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def sync(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            fd = self._file.fileno()
+        os.fsync(fd)
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_period):
+            self.sync()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._sync_thread.join()
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+
+class JournalReader(object):
+    """Memory-maps a journal (also one that is still being written or was cut
+       short by a crash) without loading it; 'reader[name]' is a column view
+       and 'reader.records' the structured record array.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic = f.read(len(JOURNAL_MAGIC))
+            if magic != JOURNAL_MAGIC:
+                raise IOError, "'%s' is not an acquisition journal" % filename
+            header_len, = HEADER_LENGTH_STRUCT.unpack(f.read(HEADER_LENGTH_STRUCT.size))
+            header = yaml.safe_load(f.read(header_len).rstrip("\0"))
+        self.metadata = header['metadata']
+        self.columns  = OrderedDict((name, jtype) for name, jtype in header['columns'])
+        self.dtype    = numpy.dtype(list(self.columns.items()))
+        self.data_offset = len(JOURNAL_MAGIC) + HEADER_LENGTH_STRUCT.size + header_len
+        self.refresh()
+
+    def refresh(self):
+        "re-map to pick up records appended since opening, ignores a partial last record"
+        size  = os.path.getsize(self.filename)
+        count = max(size - self.data_offset, 0) // self.dtype.itemsize
+        if count == 0:
+            self.records = numpy.zeros(0, dtype = self.dtype)
+        else:
+            self.records = numpy.memmap(self.filename, dtype = self.dtype, mode = 'r',
+                                        offset = self.data_offset, shape = (count,))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def keys(self):
+        return self.columns.keys()
+
+    def items(self):
+        return [(name, self.records[name]) for name in self.columns.keys()]
+
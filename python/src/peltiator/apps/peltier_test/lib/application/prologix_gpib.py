@@ -1,52 +1,212 @@
-import socket
+import errno, socket, threading, time
+from collections import OrderedDict
+#peltiator framework provided
+from peltiator.apps.lib.reactor import Future, RequestChannel, chain, line_parser
 
 DEFAULT_IP_ADDRESS =  "128.119.56.100"
 DEFAULT_PORT            = 1234
 DEFAULT_RECV_BUFF_SIZE  = 1024
 DEFAULT_EOL             = '\n'
+DEFAULT_CONNECT_TIMEOUT = 5.0 #seconds
+DEFAULT_READ_TIMEOUT    = 3.0 #seconds, instruments may take a while to measure
+DEFAULT_TERMINATOR      = '\n' #ends instrument responses
+#the multiplexer keeps serving the current address for at most this many
+#requests in a row, or until the oldest waiting request has waited this long
+DEFAULT_MAX_RUN         = 16
+DEFAULT_MAX_WAIT        = 1.0 #seconds
 
 
 class GPIBController(object):
+    """Talks to the instruments on a Prologix GPIB-Ethernet adapter. The bus
+       address and EOS mode last set are cached so repeated switches to the
+       same instrument are not sent, and sends made inside 'batch()' are
+       held back and go out in a single socket write with the next read or
+       when the batch ends. 'counters' keeps track of the savings.
+
+       Responses are received into a persistent buffer and framed by
+       'terminator', so partial and merged replies come out whole and in
+       order, whatever their size.
+    """
     def __init__(self, 
                  ip_address,
                  port       = DEFAULT_PORT, 
-                 eol        = DEFAULT_EOL
+                 eol        = DEFAULT_EOL,
+                 terminator = DEFAULT_TERMINATOR,
+                 read_timeout   = DEFAULT_READ_TIMEOUT,
+                 recv_buff_size = DEFAULT_RECV_BUFF_SIZE,
                 ):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.connect((ip_address,port))
+        self._sock.settimeout(read_timeout)
         self.ip_address = ip_address
         self.port       = port
         self.eol = eol
+        self.terminator = terminator
+        self.read_timeout = read_timeout
+        #receive buffers, 'recv_into' the chunk then append to the unframed data
+        self._chunk     = bytearray(recv_buff_size)
+        self._chunk_view = memoryview(self._chunk)
+        self._rx        = bytearray()
+        self._scan_pos  = 0 #no terminator in _rx before this
+        self._addr = None
+        self._eos  = None
+        self._pending = []
+        self._batch_depth = 0
+        self.reset_counters()
         #set the controller to turn off the read-after-write mode
         self.send("++auto 0")
 
+    def reset_counters(self):
+        self.counters = OrderedDict((("commands"         ,0), #commands requested
+                                     ("writes"           ,0), #socket writes made
+                                     ("addr_switches_saved",0),
+                                     ("eos_switches_saved" ,0),
+                                     ("writes_coalesced" ,0),
+                                   ))
+
+    def commands_saved(self):
+        "socket writes avoided by the cache and by batching"
+        c = self.counters
+        return c['addr_switches_saved'] + c['eos_switches_saved'] + c['writes_coalesced']
+
+    def invalidate_cache(self):
+        "forget the bus state, e.g. after the adapter was used by someone else"
+        self._addr = None
+        self._eos  = None
+
     def get_addr(self):
         cmd = "++addr"
-        return int(self.exchange(cmd))
+        self._addr = int(self._query(cmd))
+        return self._addr
 
     def get_eos(self):
         cmd = "++eos"
-        return int(self.exchange(cmd))
+        self._eos = int(self._query(cmd))
+        return self._eos
+
+    def _query(self, cmd):
+        "controller '++' queries answer straight away, without '++read'"
+        self.send(cmd)
+        return self.read_line()
     
     def set_addr(self, addr):
+        if addr == self._addr:
+            self.counters['addr_switches_saved'] += 1
+            return
         cmd = "++addr %d" % addr
         self.send(cmd)
+        self._addr = addr
 
     def set_eos(self, eos):
+        if eos == self._eos:
+            self.counters['eos_switches_saved'] += 1
+            return
         cmd = "++eos %d"  % eos
         self.send(cmd)
-    
+        self._eos = eos
+
+    def batch(self):
+        "context manager, coalesces the sends made inside it into one write"
+        return _Batch(self)
+
     def send(self, cmd):
-        self._sock.send(cmd + self.eol)
+        #set_addr/set_eos re-cache after this
+        if cmd.startswith("++addr "):
+            self._addr = None
+        elif cmd.startswith("++eos "):
+            self._eos = None
+        self.counters['commands'] += 1
+        self._pending.append(cmd + self.eol)
+        if self._batch_depth == 0:
+            self.flush()
+
+    def flush(self):
+        "write out the held back sends"
+        if not self._pending:
+            return
+        data = "".join(self._pending)
+        self.counters['writes_coalesced'] += len(self._pending) - 1
+        self.counters['writes'] += 1
+        del self._pending[:]
+        try:
+            self._sock.sendall(data)
+        except socket.error:
+            self.invalidate_cache() #unknown how much got through
+            raise
         
-    def read(self, recv_buff_size = DEFAULT_RECV_BUFF_SIZE):
-        self.send("++read")
-        resp = self._sock.recv(recv_buff_size)
-        return resp
+    def _request_read(self):
+        #the read request goes out together with anything held back
+        self._pending.append("++read" + self.eol)
+        self.counters['commands'] += 1
+        self.flush()
 
-    def exchange(self, cmd, recv_buff_size = DEFAULT_RECV_BUFF_SIZE):
-        self.send(cmd)
-        resp = self.read(recv_buff_size = recv_buff_size)
+    def read(self, recv_buff_size = None):
+        """address the instrument to talk and return its response through the
+           terminator; 'recv_buff_size' is no longer needed and is ignored
+        """
+        self._request_read()
+        return self.read_line()
+
+    def iter_lines(self, count = None, idle_timeout = None):
+        """address the instrument to talk and yield the lines of a multi-line
+           response as they arrive, up to 'count' lines, otherwise until
+           nothing more arrives for 'idle_timeout' seconds (the read timeout
+           by default)
+        """
+        self._request_read()
+        return self._iter_lines(count, idle_timeout)
+
+    def _iter_lines(self, count, idle_timeout):
+        n = 0
+        while count is None or n < count:
+            try:
+                line = self.read_line(timeout = idle_timeout)
+            except IOError:
+                if count is None:
+                    return
+                raise
+            n += 1
+            yield line
+
+    def read_line(self, terminator = None, timeout = None):
+        "the next response through 'terminator' from the receive buffer"
+        if terminator is None:
+            terminator = self.terminator
+        while True:
+            index = self._rx.find(terminator, self._scan_pos)
+            if index != -1:
+                end = index + len(terminator)
+                line = str(self._rx[:end])
+                del self._rx[:end]
+                self._scan_pos = 0
+                return line
+            #a terminator may straddle the chunk boundary
+            self._scan_pos = max(0, len(self._rx) - len(terminator) + 1)
+            self._fill(timeout)
+
+    def _fill(self, timeout = None):
+        if timeout is not None:
+            self._sock.settimeout(timeout)
+        try:
+            n = self._sock.recv_into(self._chunk)
+        except socket.timeout:
+            raise IOError, "timed out waiting for a response from GPIB address %r" % self._addr
+        finally:
+            if timeout is not None:
+                self._sock.settimeout(self.read_timeout)
+        if n == 0:
+            raise IOError, "connection to %s:%d closed" % (self.ip_address, self.port)
+        self._rx += self._chunk_view[:n]
+
+    def discard_input(self):
+        "drop any received data not yet read, e.g. after a timeout"
+        del self._rx[:]
+        self._scan_pos = 0
+
+    def exchange(self, cmd, recv_buff_size = None):
+        with self.batch():
+            self.send(cmd)
+            resp = self.read()
         return resp
 
     def dump_errors(self):
@@ -62,6 +222,98 @@ class GPIBController(object):
                 err_list.append((errno,msg))
         return err_list
 
+
+class _Batch(object):
+    def __init__(self, controller):
+        self.controller = controller
+
+    def __enter__(self):
+        self.controller._batch_depth += 1
+        return self.controller
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.controller._batch_depth -= 1
+        if self.controller._batch_depth == 0:
+            if exc_type is None:
+                self.controller.flush()
+            else:
+                #nothing held back was sent, the cached bus state may be wrong
+                del self.controller._pending[:]
+                self.controller.invalidate_cache()
+
+
+class AsyncGPIBController(RequestChannel):
+    """Non-blocking variant of GPIBController for use with a 'Reactor', so
+       that a single event loop can drive many controllers. The methods
+       return Futures; each read has its own timeout and responses are
+       framed by the line terminator instead of a single 'recv'.
+    """
+    def __init__(self, reactor,
+                 ip_address,
+                 port       = DEFAULT_PORT,
+                 eol        = DEFAULT_EOL,
+                 connect_timeout = DEFAULT_CONNECT_TIMEOUT,
+                ):
+        self._sock = socket.create_connection((ip_address, port), connect_timeout)
+        self._sock.setblocking(0)
+        self.ip_address = ip_address
+        self.port       = port
+        self.eol = eol
+        RequestChannel.__init__(self, reactor)
+        #set the controller to turn off the read-after-write mode
+        self.send("++auto 0")
+
+    #--------------------------------------------------------------------------
+    # transport
+    def fileno(self):
+        return self._sock.fileno()
+
+    def _read_available(self):
+        try:
+            data = self._sock.recv(DEFAULT_RECV_BUFF_SIZE)
+        except socket.error, exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return "" #a spurious wakeup, nothing has arrived yet
+            raise
+        if not data:
+            raise IOError, "connection to %s:%d closed" % (self.ip_address, self.port)
+        return data
+
+    def _write(self, data):
+        self._sock.sendall(data)
+
+    #--------------------------------------------------------------------------
+    # requests
+    def get_addr(self, timeout = DEFAULT_READ_TIMEOUT):
+        return chain(self._query("++addr", timeout), int)
+
+    def get_eos(self, timeout = DEFAULT_READ_TIMEOUT):
+        return chain(self._query("++eos", timeout), int)
+
+    def _query(self, cmd, timeout):
+        "controller '++' queries answer straight away, without '++read'"
+        return self.submit(cmd + self.eol, line_parser("\n"), timeout)
+
+    def set_addr(self, addr):
+        return self.send("++addr %d" % addr)
+
+    def set_eos(self, eos):
+        return self.send("++eos %d"  % eos)
+
+    def send(self, cmd):
+        return self.submit(cmd + self.eol, None, 0)
+
+    def read(self, timeout = DEFAULT_READ_TIMEOUT):
+        return self.submit("++read" + self.eol, line_parser("\n"), timeout)
+
+    def exchange(self, cmd, timeout = DEFAULT_READ_TIMEOUT):
+        self.send(cmd)
+        return self.read(timeout = timeout)
+
+    def close(self):
+        RequestChannel.close(self)
+        self.reactor.call_soon_threadsafe(self._sock.close)
+
 DEFAULT_EOS_MODE = 2
         
 class GPIBInstrument(object):
@@ -73,17 +325,142 @@ class GPIBInstrument(object):
         self.gpib_controller.set_addr(self.gpib_address)
         self.gpib_controller.set_eos(self.eos_mode)
     def send(self, cmd):
-        self.activate()
-        self.gpib_controller.send(cmd)
-    def read(self, recv_buff_size = DEFAULT_RECV_BUFF_SIZE):
-        self.activate()
-        return self.gpib_controller.read(recv_buff_size = recv_buff_size)
-    def exchange(self, cmd, recv_buff_size = DEFAULT_RECV_BUFF_SIZE):
-        self.send(cmd)
-        resp = self.read(recv_buff_size = recv_buff_size)
+        with self.gpib_controller.batch():
+            self.activate()
+            self.gpib_controller.send(cmd)
+    def read(self, recv_buff_size = None):
+        with self.gpib_controller.batch():
+            self.activate()
+            return self.gpib_controller.read()
+    def iter_lines(self, count = None, idle_timeout = None):
+        with self.gpib_controller.batch():
+            self.activate()
+            return self.gpib_controller.iter_lines(count = count, idle_timeout = idle_timeout)
+    def exchange(self, cmd, recv_buff_size = None):
+        #address, command and read request go out in one write
+        with self.gpib_controller.batch():
+            self.send(cmd)
+            resp = self.read()
         return resp
     
 
+class GPIBMultiplexer(object):
+    """Shares one GPIBController between many instruments and threads. A
+       worker thread owns the controller and carries out queued requests
+       one at a time, so exchanges can no longer interleave on the bus.
+       Waiting requests for the address the bus is already on go first,
+       which saves address switches; per address the order is kept, and
+       'max_run'/'max_wait' bound how long other addresses can be passed
+       over. Every request returns a Future.
+    """
+    def __init__(self, gpib_controller,
+                 max_run  = DEFAULT_MAX_RUN,
+                 max_wait = DEFAULT_MAX_WAIT,
+                ):
+        self.gpib_controller = gpib_controller
+        self.max_run  = max_run
+        self.max_wait = max_wait
+        self._pending = []
+        self._cond    = threading.Condition()
+        self._closed  = False
+        self.reset_counters()
+        self._thread = threading.Thread(target = self._run, name = "gpib_multiplexer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def reset_counters(self):
+        self.counters = OrderedDict((("requests"        ,0),
+                                     ("address_switches",0),
+                                     ("reordered"       ,0), #served ahead of an older request
+                                   ))
+
+    def instrument(self, gpib_address, eos_mode = DEFAULT_EOS_MODE):
+        return MultiplexedInstrument(self, gpib_address, eos_mode = eos_mode)
+
+    def submit(self, gpib_address, eos_mode, func):
+        """queue 'func(gpib_controller)' to run with the bus on 'gpib_address',
+           returns a Future of its result
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise IOError, "GPIB multiplexer is closed"
+            self._pending.append((time.time(), gpib_address, eos_mode, func, future))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        "finish the queued requests, then stop the worker"
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _pick(self, current_addr, run):
+        "index of the next request to serve"
+        oldest_time = self._pending[0][0]
+        if run < self.max_run and time.time() - oldest_time < self.max_wait:
+            for i, request in enumerate(self._pending):
+                if request[1] == current_addr:
+                    return i
+        return 0
+
+    def _run(self):
+        current_addr = None
+        run = 0
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                i = self._pick(current_addr, run)
+                _, addr, eos_mode, func, future = self._pending.pop(i)
+            if i > 0:
+                self.counters['reordered'] += 1
+            if addr == current_addr:
+                run += 1
+            else:
+                self.counters['address_switches'] += 1
+                current_addr = addr
+                run = 1
+            self.counters['requests'] += 1
+            controller = self.gpib_controller
+            try:
+                with controller.batch():
+                    controller.set_addr(addr)
+                    controller.set_eos(eos_mode)
+                    result = func(controller)
+            except Exception, exc:
+                controller.discard_input() #don't let a late reply answer the next request
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+
+class MultiplexedInstrument(object):
+    "an instrument on a GPIBMultiplexer, the methods return Futures"
+    def __init__(self, gpib_multiplexer, gpib_address, eos_mode = DEFAULT_EOS_MODE):
+        self.gpib_multiplexer = gpib_multiplexer
+        self.gpib_address     = gpib_address
+        self.eos_mode         = eos_mode
+    def _submit(self, func):
+        return self.gpib_multiplexer.submit(self.gpib_address, self.eos_mode, func)
+    def send(self, cmd):
+        return self._submit(lambda controller: controller.send(cmd))
+    def read(self):
+        return self._submit(lambda controller: controller.read())
+    def read_lines(self, count = None, idle_timeout = None):
+        "a Future of the list of lines of a multi-line response"
+        return self._submit(lambda controller: list(controller.iter_lines(count = count,
+                                                                          idle_timeout = idle_timeout)))
+    def exchange(self, cmd):
+        def exchange(controller):
+            controller.send(cmd)
+            return controller.read()
+        return self._submit(exchange)
+
+
 ###############################################################################
 #  TEST CODE
 ###############################################################################
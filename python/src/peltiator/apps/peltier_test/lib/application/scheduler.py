@@ -1,32 +1,200 @@
 import time
-from threading import Timer
+from collections import OrderedDict
+#peltiator framework provided
+from peltiator.apps.lib.clock import monotonic
+from peltiator.apps.lib.stats import RunningStats
 
-def loop(period, duration, callback):
-    t0 = time.time()
-    while (time.time()-t0) < duration:
-        timer = Timer(period, callback)
-        timer.start() 
-        timer.join()
+#what to do with ticks whose deadline passed while the callback was running:
+#  'skip'     - drop them and wait for the next deadline on the grid
+#  'coalesce' - run one tick right away for all of them, then stay on the grid
+#  'catchup'  - run every missed tick back to back
+OVERRUN_POLICIES = ('skip', 'coalesce', 'catchup')
+DEFAULT_OVERRUN_POLICY = 'skip'
+
+
+class DeadlineScheduler(object):
+    """Calls 'callback' on an exact cadence of 'period' seconds on the calling
+       thread. Deadlines are computed from the start time on a monotonic
+       clock, so the callback run time does not add up to drift. The
+       lateness of each tick is collected in 'jitter' and missed ticks are
+       counted in 'skipped'.
+
+       With 'adapt', a function returning a period, the period is looked up
+       after every tick and a change starts a new grid from that tick.
+    """
+    def __init__(self, period, callback,
+                 policy     = DEFAULT_OVERRUN_POLICY,
+                 stop_event = None,
+                 adapt      = None,
+                ):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError, "overrun policy must be one of %r, got %r" % (OVERRUN_POLICIES, policy)
+        self.period     = period
+        self.callback   = callback
+        self.policy     = policy
+        self.stop_event = stop_event
+        self.adapt      = adapt
+        self.jitter     = RunningStats()
+        self.ticks      = 0
+        self.skipped    = 0
+
+    def _wait(self, delay):
+        "returns True when asked to stop"
+        if self.stop_event is not None:
+            if delay > 0:
+                return self.stop_event.wait(delay)
+            return self.stop_event.is_set()
+        if delay > 0:
+            time.sleep(delay)
+        return False
+
+    def run(self, duration = None, until = None):
+        """tick at start + k*period for k = 1, 2, ... until 'duration' seconds
+           have been covered (forever if None), the stop event is set or the
+           predicate 'until()', checked after each tick, returns True
+        """
+        t_begin = t_start = monotonic()
+        k = 1
+        while True:
+            deadline = t_start + k*self.period
+            if duration is not None and deadline - t_begin > duration + 1e-9:
+                return
+            if self._wait(deadline - monotonic()):
+                return
+            self.jitter.record(monotonic() - deadline)
+            self.callback()
+            self.ticks += 1
+            if until is not None and until():
+                return
+            if self.adapt is not None:
+                period = self.adapt()
+                if period != self.period:
+                    self.period = period
+                    t_start = deadline
+                    k = 0
+            #find the next deadline according to the overrun policy
+            overdue = int((monotonic() - t_start)/self.period) - k
+            if overdue <= 0 or self.policy == 'catchup':
+                k += 1
+            elif self.policy == 'skip':
+                self.skipped += overdue
+                k += overdue + 1
+            elif self.policy == 'coalesce':
+                self.skipped += overdue - 1
+                k += overdue
+
+    def summary(self):
+        s = OrderedDict()
+        s['period']  = self.period
+        s['ticks']   = self.ticks
+        s['skipped'] = self.skipped
+        s['jitter']  = self.jitter.summary()
+        return s
+
+
+def loop(period, duration, callback, policy = DEFAULT_OVERRUN_POLICY, stop_event = None, until = None,
+         adapt = None):
+    scheduler = DeadlineScheduler(period, callback, policy = policy, stop_event = stop_event, adapt = adapt)
+    scheduler.run(duration = duration, until = until)
+    return scheduler
 
 
 class Scheduler(object):
-    def __init__(self,prog, sampling_period, sampling_duration):
+    """Runs sampling loops for a script. With a SteadyStateDetector as
+       'detector', each step of a gradient schedule ends as soon as the
+       fixture has settled, with 'sampling_duration' as the upper bound.
+    """
+    def __init__(self,prog, sampling_period, sampling_duration, overrun_policy = DEFAULT_OVERRUN_POLICY,
+                 detector = None):
         self.prog = prog
         self.sampling_period = sampling_period
         self.sampling_duration = sampling_duration
+        self.overrun_policy = overrun_policy
+        self.detector = detector
+        self.jitter = RunningStats() #over all loops run by this scheduler
+        self.skipped = 0
 
-    def update_loop(self, sampling_period = None, sampling_duration = None):
+    def update_loop(self, sampling_period = None, sampling_duration = None, until = None):
         if sampling_period is None:
             sampling_period = self.sampling_period
         if sampling_duration is None:
             sampling_duration = self.sampling_duration
         update_callback = lambda: self.prog.send_event("UPDATE")
-        loop(period=sampling_period, duration=sampling_duration, callback=update_callback)
-        
+        #waiting on the script's cancellation token ends the loop on an abort
+        token = getattr(self.prog, 'token', None)
+        #the application's rate policy, if any, overrides the sampling period
+        rate_policy = self.prog.app.rate_policy
+        adapt = None
+        if rate_policy is not None:
+            sampling_period = rate_policy.period
+            adapt = lambda: rate_policy.period
+        deadline_scheduler = loop(period=sampling_period, duration=sampling_duration,
+                                  callback=update_callback, policy=self.overrun_policy,
+                                  stop_event=token.event if token is not None else None,
+                                  until=until, adapt=adapt)
+        self._collect_stats(deadline_scheduler)
+        if token is not None:
+            token.check()
+        return deadline_scheduler
+
+    def _collect_stats(self, deadline_scheduler):
+        self.jitter.merge(deadline_scheduler.jitter)
+        self.skipped += deadline_scheduler.skipped
+
+    def jitter_report(self):
+        s = self.jitter.summary()
+        if not s['count']:
+            return "no ticks yet"
+        return ("%d ticks, %d skipped, lateness mean %0.2f ms, std %0.2f ms, max %0.2f ms"
+                % (s['count'], self.skipped, 1e3*s['mean'], 1e3*s['std'], 1e3*s['max']))
+
     def run_gradient_schedule(self,gradients, sampling_period = None, sampling_duration = None):
+        if sampling_duration is None:
+            sampling_duration = self.sampling_duration
         self.prog.print_back("running gradient schedule: %r" % list(gradients))
-        self.prog.print_back("sampling every %0.1f seconds for a duration of %0.1f seconds" % (self.sampling_period,self.sampling_duration))
-        for grad in gradients:
-            self.prog.print_back("setting gradient: %0.2f" % grad)
-            self.prog.app.change_gradient_setpoint(grad)        
-            self.update_loop(sampling_period=sampling_period,sampling_duration=sampling_duration)
+        self.prog.print_back("sampling every %0.1f seconds for a duration of %0.1f seconds" % (self.sampling_period,sampling_duration))
+        detector = self.detector
+        if detector is None:
+            for grad in gradients:
+                self.prog.print_back("setting gradient: %0.2f" % grad)
+                self.prog.app.change_gradient_setpoint(grad)
+                self.update_loop(sampling_period=sampling_period,sampling_duration=sampling_duration)
+            self.prog.print_back("schedule timing: %s" % self.jitter_report())
+            return
+        #only the records of the fixture this script drives decide when a step is done
+        fixture = self.prog.app.get_fixture()
+        def listener(source, records):
+            if source is fixture:
+                detector.extend(records)
+        self.prog.app.add_data_listener(listener)
+        total_saved = 0.0
+        try:
+            for grad in gradients:
+                self.prog.print_back("setting gradient: %0.2f" % grad)
+                self.prog.app.change_gradient_setpoint(grad)
+                detector.reset()
+                t_step = monotonic()
+                self.update_loop(sampling_period=sampling_period,sampling_duration=sampling_duration,
+                                 until=detector.is_settled)
+                elapsed = monotonic() - t_step
+                if detector.is_settled():
+                    saved = max(sampling_duration - elapsed, 0.0)
+                    total_saved += saved
+                    self.prog.print_back("settled after %0.1f seconds, saved %0.1f seconds" % (elapsed, saved))
+                else:
+                    self.prog.print_back("not settled after %0.1f seconds: %s" % (elapsed, self.settling_report()))
+        finally:
+            self.prog.app.remove_data_listener(listener)
+        self.prog.print_back("steady state detection saved %0.1f seconds in total" % total_saved)
+        self.prog.print_back("schedule timing: %s" % self.jitter_report())
+
+    def settling_report(self):
+        "the detector's current slope and scatter for each signal"
+        settled, details = self.detector.evaluate()
+        items = []
+        for name, trend in details.items():
+            if trend is None:
+                items.append("%s: too few samples" % name)
+            else:
+                items.append("%s: slope %0.3g/s, std %0.3g" % (name, trend[0], trend[1]))
+        return ", ".join(items)
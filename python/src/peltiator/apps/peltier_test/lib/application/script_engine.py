@@ -0,0 +1,219 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import os, sys, imp, inspect, itertools, threading
+from collections import OrderedDict
+#application local
+from script_program import ScriptProgram
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_JOIN_TIMEOUT = 5.0 #seconds
+#attributes a script sees through its fixture rather than the first fixture
+FIXTURE_ATTRIBUTES = ('peltier_pid', 'dmm', 'data', 'journal')
+#attributes whose method calls are checked as well
+DEVICE_ATTRIBUTES  = ('peltier_pid', 'dmm', 'oven')
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def _accepts_fixture(func):
+    try:
+        args, varargs, varkw, defaults = inspect.getargspec(func)
+    except TypeError: #builtins and other callables without an inspectable signature
+        return False
+    return 'fixture' in args
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ScriptCancelled(Exception):
+    pass
+
+
+class CancellationToken(object):
+    """Set by 'cancel()'; a script run checks it at every device call and
+       waits on it instead of sleeping, so an abort takes effect within one
+       sample period without interrupting a call half way.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise ScriptCancelled, "script cancelled"
+
+    def sleep(self, seconds):
+        "like 'time.sleep' but cut short (raising ScriptCancelled) by 'cancel()'"
+        if self.event.wait(seconds):
+            self.check()
+
+
+class CheckedProxy(object):
+    """Stands in for the Application (or one of its devices) in a script: every
+       method call checks the run's cancellation token before and after, and
+       when the run belongs to a fixture, methods taking a 'fixture' argument
+       and the device and data attributes default to that fixture.
+    """
+    def __init__(self, target, token, fixture = None):
+        self.__dict__['_target']  = target
+        self.__dict__['_token']   = token
+        self.__dict__['_fixture'] = fixture
+
+    def __getattr__(self, name):
+        if self._fixture is not None and name in FIXTURE_ATTRIBUTES:
+            value = getattr(self._fixture, name)
+        else:
+            value = getattr(self._target, name)
+        if name in DEVICE_ATTRIBUTES and value is not None:
+            return CheckedProxy(value, self._token)
+        if inspect.isroutine(value): #also the forwarding functions of a FixtureWorker
+            return self._wrap(value)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def _wrap(self, func):
+        token = self._token
+        fixture_name = None
+        if self._fixture is not None and _accepts_fixture(func):
+            fixture_name = self._fixture.name
+        def checked_call(*args, **kwargs):
+            token.check()
+            if fixture_name is not None:
+                kwargs.setdefault('fixture', fixture_name)
+            result = func(*args, **kwargs)
+            token.check()
+            return result
+        checked_call.__name__ = func.__name__
+        checked_call.__doc__  = func.__doc__
+        return checked_call
+
+
+class ModuleCache(object):
+    """Compiled script code keyed by path, recompiled only when the file's
+       modification time or size changes. Every run executes the code in a
+       fresh module, so concurrent runs do not share globals.
+    """
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._cache = {}
+        self.hits   = 0
+        self.misses = 0
+
+    def _compile(self, filepath):
+        with open(filepath, 'rU') as f:
+            source = f.read()
+        return compile(source, filepath, 'exec')
+
+    def load(self, filepath):
+        filepath = os.path.abspath(filepath)
+        st = os.stat(filepath)
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            entry = self._cache.get(filepath)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                code = entry[1]
+            else:
+                self.misses += 1
+                code = self._compile(filepath)
+                self._cache[filepath] = (stamp, code)
+        mod_name, _ = os.path.splitext(os.path.basename(filepath))
+        mod = imp.new_module(mod_name)
+        mod.__file__ = filepath
+        exec code in mod.__dict__
+        return mod
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class ScriptRun(object):
+    "one run of a script's 'main(prog)' on its own thread"
+    def __init__(self, run_id, filepath, prog, thread):
+        self.run_id   = run_id
+        self.filepath = filepath
+        self.prog     = prog
+        self.thread   = thread
+
+    @property
+    def token(self):
+        return self.prog.token
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def cancel(self):
+        self.prog.token.cancel()
+
+    def join(self, timeout = None):
+        self.thread.join(timeout)
+
+
+class ScriptEngine(object):
+    """Runs scripts, several at a time (e.g. one per fixture), from a cache of
+       compiled modules. Aborting cancels the runs' tokens rather than killing
+       their threads.
+    """
+    def __init__(self, app):
+        self.app   = app
+        self.cache = ModuleCache()
+        self.runs  = OrderedDict()
+        self._run_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def run(self, filepath, fixture = None):
+        "start 'main(prog)' of the script, bound to 'fixture' (index or handle) if given"
+        if fixture is not None:
+            fixture = self.app.get_fixture(fixture)
+        token = CancellationToken()
+        prog = ScriptProgram(app = self.app, token = token, fixture = fixture)
+        run_id = next(self._run_ids)
+        def task():
+            try:
+                mod = self.cache.load(filepath)
+                mod.main(prog)
+            except (ScriptCancelled, SystemExit):
+                prog.send_event('ABORTED', run_id)
+            except:
+                prog.send_event('ERROR', sys.exc_info())
+            finally:
+                with self._lock:
+                    self.runs.pop(run_id, None)
+                #wakes the GUI, which checks whether any runs are left
+                prog.send_event('DONE', run_id)
+        thread = threading.Thread(target = task, name = "script_%d" % run_id)
+        thread.daemon = True # make thread a daemon so it will not block on program exit
+        run = ScriptRun(run_id, filepath, prog, thread)
+        with self._lock:
+            self.runs[run_id] = run
+        thread.start()  #launch thread!
+        return run
+
+    def active_runs(self):
+        with self._lock:
+            return self.runs.values()
+
+    def is_running(self):
+        return any(run.is_alive() for run in self.active_runs())
+
+    def cancel_all(self, join_timeout = DEFAULT_JOIN_TIMEOUT):
+        "cancel every run and wait for them to wind down; returns those still alive"
+        runs = self.active_runs()
+        for run in runs:
+            run.cancel()
+        for run in runs:
+            run.join(join_timeout)
+        return [run for run in runs if run.is_alive()]
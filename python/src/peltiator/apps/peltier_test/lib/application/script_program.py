@@ -1,9 +1,25 @@
 ################################################################################
 class ScriptProgram(object):
-    def __init__(self,app):
-        self.app = app                
+    def __init__(self, app, token = None, fixture = None):
+        #imported here, 'script_engine' imports this module
+        from script_engine import CancellationToken, CheckedProxy
+        if token is None:
+            token = CancellationToken()
+        self.token   = token
+        self.fixture = fixture
+        #scripts reach the application and devices through the token's checks
+        self.app = CheckedProxy(app, token, fixture = fixture)
+        self._event_queue = app._script_event_queue
     def send_event(self, event_type, obj = None): 
-        self.app._script_event_queue.put((event_type,obj))
+        self._event_queue.put((event_type,obj))
     def print_back(self, obj): 
+        if self.fixture is not None and self.fixture.label is not None:
+            obj = "[%s] %s" % (self.fixture.label, obj)
         self.send_event('PRINT',str(obj))
+    def check(self):
+        "raise ScriptCancelled if the run was aborted"
+        self.token.check()
+    def sleep(self, seconds):
+        "wait, but return early (raising ScriptCancelled) when aborted"
+        self.token.sleep(seconds)
 ################################################################################
@@ -0,0 +1,118 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import math, threading
+from collections import OrderedDict
+#peltiator framework provided
+from peltiator.apps.lib.stats import RunningRegression
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def _format_fit(s):
+    if s['slope'] is None:
+        return "n=%d, not enough spread in dT yet" % s['count']
+    text = "S = %0.3f" % (1e6*s['slope'])
+    if s['slope_stderr'] is not None:
+        text += " +/- %0.3f" % (1e6*s['slope_stderr'])
+    text += " uV/K, V0 = %0.2f uV, n=%d" % (1e6*s['intercept'], s['count'])
+    return text
+
+def format_seebeck_summary(summary):
+    "text lines for a SeebeckEstimator summary: the overall fit and the current step per fixture"
+    lines = []
+    for name, s in summary.items():
+        lines.append("%s: %s" % (name, _format_fit(s['overall'])))
+        if s['steps']:
+            grad, step = s['steps'][-1]
+            if grad is None:
+                lines.append("  step %d: %s" % (len(s['steps']), _format_fit(step)))
+            else:
+                lines.append("  step %d (GRAD %0.2f): %s" % (len(s['steps']), grad, _format_fit(step)))
+    if not lines:
+        return ["no Seebeck estimate yet"]
+    return lines
+
+###############################################################################
+# CLASSES
+###############################################################################
+class SeebeckStep(object):
+    "the regression over the records of one gradient setpoint"
+    def __init__(self, gradient_setpoint):
+        self.gradient_setpoint = gradient_setpoint
+        self.regression = RunningRegression()
+
+
+class SeebeckFit(object):
+    """The running fit of 'voltage' against 'temperatureA_measured -
+       temperatureB_measured' for one fixture, overall and per gradient
+       step. A new step starts whenever the records' 'gradient_setpoint'
+       changes.
+    """
+    def __init__(self):
+        self.overall = RunningRegression()
+        self.steps   = []
+
+    def record(self, record):
+        try:
+            dT = record['temperatureA_measured'] - record['temperatureB_measured']
+            V  = record['voltage']
+        except (KeyError, TypeError):
+            return
+        if math.isnan(dT) or math.isnan(V): #e.g. no aligned DMM reading
+            return
+        grad = record.get('gradient_setpoint')
+        if grad is not None and math.isnan(grad): #a column the record lacked
+            grad = None
+        if not self.steps or self.steps[-1].gradient_setpoint != grad:
+            self.steps.append(SeebeckStep(grad))
+        self.steps[-1].regression.record(dT, V)
+        self.overall.record(dT, V)
+
+    def summary(self):
+        s = OrderedDict()
+        s['overall'] = self.overall.summary()
+        s['steps']   = [(step.gradient_setpoint, step.regression.summary()) for step in self.steps]
+        return s
+
+
+class SeebeckEstimator(object):
+    """Estimates the Seebeck coefficient (the slope, in V per degree) while a
+       run is going, fed with 'observe(fixture, records)' as an Application
+       data listener. Each record costs O(1), so the estimate can be watched
+       for convergence live instead of fitted after 'export_data'.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fits = OrderedDict() #fixture name: SeebeckFit
+
+    def observe(self, fixture, records):
+        with self._lock:
+            fit = self._fits.get(fixture.name)
+            if fit is None:
+                fit = self._fits[fixture.name] = SeebeckFit()
+            for record in records:
+                fit.record(record)
+
+    def __call__(self, fixture, records):
+        "the data listener signature"
+        self.observe(fixture, records)
+
+    def reset(self, fixture_name = None):
+        "start over for one fixture, or all of them"
+        with self._lock:
+            if fixture_name is None:
+                self._fits.clear()
+            else:
+                self._fits.pop(fixture_name, None)
+
+    def summary(self, fixture_name = None):
+        """{fixture name: {'overall': ..., 'steps': [(gradient_setpoint, ...)]}}
+           of RunningRegression summaries, or the entry of one fixture
+        """
+        with self._lock:
+            if fixture_name is not None:
+                fit = self._fits.get(fixture_name)
+                return fit.summary() if fit is not None else None
+            return OrderedDict((name, fit.summary()) for name, fit in self._fits.items())
@@ -0,0 +1,115 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import threading
+from collections import OrderedDict, deque
+#3rd Party
+import numpy
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_SETTLE_WINDOW = 30.0 #seconds of samples judged at a time
+DEFAULT_MIN_DWELL     = 60.0 #seconds after a reset before settling can be declared
+#signal: (max |slope| per second, max residual standard deviation)
+DEFAULT_TOLERANCES = OrderedDict([("temperatureA_measured", (2e-3, 0.05)), #K/s, K
+                                  ("temperatureB_measured", (2e-3, 0.05)), #K/s, K
+                                  ("voltage"              , (1e-7, 2e-6)), #V/s, V
+                                 ])
+MIN_WINDOW_SAMPLES = 5
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def fit_trend(t, x):
+    """least squares line through (t, x): returns (slope, residual standard
+       deviation), ignoring NaN values; None with too few samples
+    """
+    ok = ~(numpy.isnan(t) | numpy.isnan(x))
+    t, x = t[ok], x[ok]
+    n = len(t)
+    if n < MIN_WINDOW_SAMPLES:
+        return None
+    dt = t - t.mean()
+    dx = x - x.mean()
+    Stt = numpy.dot(dt, dt)
+    if Stt == 0:
+        return None
+    slope = numpy.dot(dt, dx)/Stt
+    residuals = dx - slope*dt
+    return slope, numpy.sqrt(numpy.dot(residuals, residuals)/(n - 2))
+
+###############################################################################
+# CLASSES
+###############################################################################
+class SteadyStateDetector(object):
+    """Decides online whether a fixture has settled after a setpoint change.
+       Over the newest 'window' seconds of samples each signal in 'tolerances'
+       must have a fitted slope and a residual scatter within its limits, the
+       window must be covered, and 'min_dwell' seconds must have passed since
+       'reset()'.
+
+       Feed it with 'extend(records)', e.g. as an Application data listener.
+    """
+    def __init__(self,
+                 tolerances = DEFAULT_TOLERANCES,
+                 window     = DEFAULT_SETTLE_WINDOW,
+                 min_dwell  = DEFAULT_MIN_DWELL,
+                ):
+        self.tolerances = OrderedDict(tolerances)
+        self.window     = window
+        self.min_dwell  = min_dwell
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, timestamp = None):
+        """start over, e.g. right after a setpoint change; the dwell counts from
+           'timestamp' or else from the first sample that arrives
+        """
+        with self._lock:
+            self._samples = deque()
+            self.t_reset  = timestamp
+
+    def extend(self, records):
+        names = self.tolerances.keys()
+        with self._lock:
+            for record in records:
+                t = record['timestamp']
+                if self.t_reset is None:
+                    self.t_reset = t
+                self._samples.append((t,) + tuple(record.get(name, numpy.nan) for name in names))
+            if self._samples:
+                t_newest = self._samples[-1][0]
+                while t_newest - self._samples[0][0] > self.window:
+                    self._samples.popleft()
+
+    def __call__(self, fixture, records):
+        "the data listener signature"
+        self.extend(records)
+
+    def evaluate(self):
+        """(settled, details) where details maps each signal to its
+           (slope, residual std) or None when there is not enough data
+        """
+        with self._lock:
+            samples = numpy.array(self._samples, dtype = numpy.float64)
+            t_reset = self.t_reset
+        details = OrderedDict()
+        if len(samples) == 0:
+            return False, details
+        t = samples[:,0]
+        dwell_ok   = t[-1] - t_reset >= self.min_dwell
+        #the window counts as covered within one sample interval
+        interval   = (t[-1] - t[0])/max(len(t) - 1, 1)
+        window_ok  = t[-1] - t[0] + interval >= self.window
+        settled = dwell_ok and window_ok
+        for i, (name, (max_slope, max_std)) in enumerate(self.tolerances.items()):
+            trend = fit_trend(t, samples[:,i + 1])
+            details[name] = trend
+            if trend is None or abs(trend[0]) > max_slope or trend[1] > max_std:
+                settled = False
+        return settled, details
+
+    def is_settled(self):
+        return self.evaluate()[0]
@@ -0,0 +1,338 @@
+###############################################################################
+# IMPORTS
+###############################################################################
+#Standard Python
+import sys, time, itertools, threading, multiprocessing
+from collections import OrderedDict
+from Queue import Empty
+#3rd Party
+import numpy
+#peltiator framework provided
+from peltiator.apps.lib.clock import monotonic
+from peltiator.apps.lib.shared_ring import SharedRing, DEFAULT_RING_CAPACITY
+#application local
+from alignment import InstrumentReader, align_sample
+from data_store import INT_DTYPE
+from fixture import Fixture, DATA_COLUMNS
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+#the record fields a worker passes through its ring, others are dropped; the
+#integer fields keep the types an in-process ColumnStore would infer for them
+RING_COLUMNS = DATA_COLUMNS + (("voltage_timestamp", numpy.float64),
+                               ("control_mode"     , INT_DTYPE),
+                               ("gradient_setpoint", numpy.float64),
+                               ("chanA_PID_output" , numpy.float64),
+                               ("chanA_func_output", numpy.float64),
+                               ("chanB_PID_output" , numpy.float64),
+                               ("chanB_func_output", numpy.float64),
+                               ("frame_seq"        , INT_DTYPE),
+                               ("device_millis"    , INT_DTYPE),
+                              )
+IDLE_POLL_PERIOD          = 0.1  #seconds between command checks when not sampling
+DEFAULT_CALL_TIMEOUT      = 10.0 #seconds
+DEFAULT_HEARTBEAT_TIMEOUT = 15.0 #seconds, covers loading the devices on start
+DEFAULT_SUPERVISE_PERIOD  = 0.5  #seconds
+DEFAULT_STOP_TIMEOUT      = 2.0  #seconds
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def _worker_main(config, peltier_pid_handle, dmm_handle, ring, period, heartbeat,
+                 running, calls, replies, alignment_policy, alignment_max_skew):
+    "body of a fixture worker process"
+    heartbeat.value = time.time()
+    peltier_pid = config.load_device(peltier_pid_handle)
+    dmm = config.load_device(dmm_handle)
+    dmm.initialize()
+    dmm.setup_measurement('V dc')
+    dmm_reader = InstrumentReader(dmm.read, name = "dmm_reader")
+
+    def sample():
+        #read both instruments at the same time
+        #should get_status fail, the next sample's 'result' skips this reading
+        dmm_reader.request()
+        record = peltier_pid.get_status()
+        dmm_reader.result()
+        aligned = align_sample(dmm_reader.get_history(), record['timestamp'],
+                               policy   = alignment_policy,
+                               max_skew = alignment_max_skew,
+                              )
+        if aligned is not None:
+            record['voltage'], record['voltage_timestamp'] = aligned
+        ring.write(record)
+
+    def controller(name, *args, **kwargs):
+        "a method call on, or an attribute of, the controller"
+        value = getattr(peltier_pid, name)
+        if callable(value):
+            value = value(*args, **kwargs)
+        return value
+
+    handlers = {'sample'     : sample,
+                'controller' : controller,
+               }
+    next_deadline = monotonic()
+    while running.value:
+        heartbeat.value = time.time()
+        #calls from the main process are served between samples
+        while True:
+            try:
+                call_id, name, args, kwargs = calls.get_nowait()
+            except Empty:
+                break
+            try:
+                replies.put((call_id, True, handlers[name](*args, **kwargs)))
+            except Exception, exc:
+                replies.put((call_id, False, exc))
+        if period.value > 0:
+            try:
+                sample()
+            except IOError, exc:
+                sys.stderr.write("#\t***error*** [%s] %s\n" % (peltier_pid_handle, exc))
+            #skip the deadlines that a slow sample overran
+            next_deadline += period.value
+            delay = next_deadline - monotonic()
+            if delay < 0:
+                next_deadline = monotonic()
+                delay = 0
+        else:
+            delay = IDLE_POLL_PERIOD
+            next_deadline = monotonic() + delay
+        time.sleep(delay)
+    dmm_reader.close()
+
+###############################################################################
+# CLASSES
+###############################################################################
+class FixtureWorker(object):
+    """Runs the acquisition of one fixture (a peltier controller and its DMM)
+       in a child process, which writes the decoded records into 'ring'. The
+       devices are only ever opened by the child; commands for the controller
+       are forwarded to it with 'call' and served between samples.
+
+       The worker stands in for the controller: any controller method, e.g.
+       'set_pid_control_mode', called on it runs on the controller in the
+       child, as long as its arguments and result can be pickled.
+    """
+    def __init__(self, config, peltier_pid_handle, dmm_handle,
+                 alignment_policy, alignment_max_skew,
+                 capacity = DEFAULT_RING_CAPACITY,
+                ):
+        self.config = config
+        self.peltier_pid_handle = peltier_pid_handle
+        self.dmm_handle         = dmm_handle
+        self.alignment_policy   = alignment_policy
+        self.alignment_max_skew = alignment_max_skew
+        #shared with the child processes, so created before the first fork
+        self.ring      = SharedRing(RING_COLUMNS, capacity = capacity)
+        self.period    = multiprocessing.RawValue('d', 0.0) #0 pauses sampling
+        self.heartbeat = multiprocessing.RawValue('d', 0.0)
+        self.process   = None
+        self.restarts  = 0
+        self._call_ids  = itertools.count()
+        self._call_lock = threading.Lock()
+
+    def start(self):
+        #fresh queues, a killed child may have left the old ones unusable
+        self._calls      = multiprocessing.Queue()
+        self._replies    = multiprocessing.Queue()
+        #unread calls to a dead worker must not hold up the exit of this process
+        self._calls.cancel_join_thread()
+        #a plain shared flag: a multiprocessing.Event deadlocks 'set' when a
+        #process that was waiting on it has been killed
+        self._running = multiprocessing.RawValue('b', 1)
+        self.heartbeat.value = time.time()
+        self.process = multiprocessing.Process(target = _worker_main,
+                                               name   = "%s_worker" % self.peltier_pid_handle,
+                                               args   = (self.config,
+                                                         self.peltier_pid_handle,
+                                                         self.dmm_handle,
+                                                         self.ring,
+                                                         self.period,
+                                                         self.heartbeat,
+                                                         self._running,
+                                                         self._calls,
+                                                         self._replies,
+                                                         self.alignment_policy,
+                                                         self.alignment_max_skew,
+                                                        ),
+                                              )
+        self.process.daemon = True
+        self.process.start()
+
+    def is_healthy(self, heartbeat_timeout = DEFAULT_HEARTBEAT_TIMEOUT):
+        "alive and still getting around its loop"
+        return self.process.is_alive() and time.time() - self.heartbeat.value < heartbeat_timeout
+
+    def stop(self, timeout = DEFAULT_STOP_TIMEOUT):
+        if self.process is None:
+            return
+        self._running.value = 0
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def restart(self):
+        with self._call_lock:
+            self.stop(timeout = 0)
+            self.restarts += 1
+            self.start()
+
+    def set_period(self, period):
+        "sample every 'period' seconds, 0 to pause"
+        self.period.value = period
+
+    def call(self, name, *args, **kwargs):
+        """run a handler in the worker: 'sample', or 'controller' with the name
+           of a controller method (or attribute) and its arguments
+        """
+        timeout = kwargs.pop('timeout', DEFAULT_CALL_TIMEOUT)
+        with self._call_lock:
+            call_id = next(self._call_ids)
+            self._calls.put((call_id, name, args, kwargs))
+            while True:
+                try:
+                    reply_id, ok, obj = self._replies.get(timeout = timeout)
+                except Empty:
+                    raise IOError, "worker '%s' did not answer '%s' within %f seconds" % (self.process.name, name, timeout)
+                if reply_id == call_id:
+                    break #earlier ids are late replies to calls that timed out
+        if not ok:
+            raise obj
+        return obj
+
+    #--------------------------------------------------------------------------
+    # the controller's interface
+    def __getattr__(self, name):
+        #only reached for names the worker itself lacks
+        if name.startswith('_'):
+            raise AttributeError, name
+        def forward(*args, **kwargs):
+            return self.call('controller', name, *args, **kwargs)
+        forward.__name__ = name
+        return forward
+
+    @property
+    def stream_counters(self):
+        return self.call('controller', 'stream_counters')
+
+    def is_streaming(self):
+        return False
+
+    def start_streaming(self, period):
+        raise IOError, "status streaming is not available with worker processes"
+
+    def stop_streaming(self):
+        pass
+
+
+class WorkerSupervisor(object):
+    """Checks the workers every 'period' seconds on a thread and restarts
+       any that died or stopped beating, leaving the others running.
+    """
+    def __init__(self, workers,
+                 period            = DEFAULT_SUPERVISE_PERIOD,
+                 heartbeat_timeout = DEFAULT_HEARTBEAT_TIMEOUT,
+                 on_restart        = lambda worker: None,
+                ):
+        self.workers = list(workers)
+        self.period  = period
+        self.heartbeat_timeout = heartbeat_timeout
+        self.on_restart = on_restart
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "worker_supervisor")
+        self._thread.daemon = True
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.period):
+            for worker in self.workers:
+                if not worker.is_healthy(self.heartbeat_timeout):
+                    worker.restart()
+                    self.on_restart(worker)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for worker in self.workers:
+            worker.stop()
+
+
+class ProcessFixture(Fixture):
+    """A Fixture sampled by a FixtureWorker process: 'update' only moves the
+       records that arrived in the worker's ring into the data store and the
+       journal. While acquisition is off it asks the worker for one sample.
+    """
+    def __init__(self, app, name, worker, label = None):
+        self.app   = app
+        self.name  = name
+        self.label = label
+        self.worker = worker
+        self.peltier_pid = worker #stands in for the controller
+        self.journal = None
+        self.dropped = 0 #records overwritten before they were read
+        self._data_lock = threading.RLock()
+        self._prefix = "" if label is None else label + "."
+        self._ring_position = worker.ring.count
+        self.clear_data()
+
+    @property
+    def dmm(self):
+        raise AttributeError, ("the DMM of '%s' is only opened in its worker process, "
+                               "run without worker processes to use it directly" % self.name)
+
+    def update(self, verbose = True):
+        stage = self.app.stage_timers.stage
+        prefix = self._prefix + "update."
+        try:
+            if self.worker.period.value <= 0:
+                with stage(prefix + "sample"):
+                    self.worker.call('sample')
+            with stage(prefix + "drain"):
+                rows, self._ring_position, dropped = self.worker.ring.read(self._ring_position)
+                self.dropped += dropped
+            if len(rows) == 0:
+                return self.data
+            with stage(prefix + "decode"):
+                records = self.worker.ring.records(rows)
+            if verbose:
+                with stage(prefix + "print"):
+                    lines = []
+                    if self.label is not None:
+                        lines.append("\t[%s]" % self.label)
+                    if len(records) > 1:
+                        lines.append("\t(%d records, showing newest)" % len(records))
+                    for key, val in records[-1].items():
+                        lines.append("\t%s: %s" % (key,val))
+                    self.app.print_comment("\n".join(lines))
+            with self._data_lock:
+                with stage(prefix + "store"):
+                    self.data.extend_columns(self.worker.ring.column_arrays(rows))
+                with stage(prefix + "journal"):
+                    self._journal_records(records)
+            with stage(prefix + "listeners"):
+                self.app._notify_data_listeners(self, records)
+        except IOError, exc:
+            if self.label is None:
+                self.app.print_comment("\t***error*** %s" % exc)
+            else:
+                self.app.print_comment("\t***error*** [%s] %s" % (self.label, exc))
+        return self.data
+
+    def latency_summary(self):
+        try:
+            return Fixture.latency_summary(self)
+        except IOError: #worker busy or restarting
+            return OrderedDict()
+
+    def close(self):
+        self.close_journal()
+        self.worker.stop()
@@ -1,25 +1,57 @@
 ###############################################################################
 import time
 from Tkinter import *
-from numpy import array
+from numpy import array, asarray, isfinite
 
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.font_manager import FontProperties
-
-from automat.core.plotting.tk_embedded_plots import EmbeddedFigure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+#application local
+from decimation import MinMaxDecimator
 ################################################################################
 DEFAULT_SUPTITLE = "Unknown Sample"
 FIGSIZE = (9,5)
 LABEL_FONT_SIZE  = 8
 LABEL_FONT_PROP  = FontProperties(size=LABEL_FONT_SIZE)
 LEGEND_FONT_PROP = FontProperties(size=6)
+MAX_DISPLAY_BINS = 1000 #about the pixel width of the plots, each bin is 2 points
+X_HEADROOM       = 1.25 #grow the time axis in steps to keep full redraws rare
+Y_HEADROOM       = 0.1  #fraction of the data range added when rescaling
+Y_SHRINK_FRACTION = 0.25 #tighten the limits when the data spans less than this
+Y_SHRINK_UPDATES  = 5    #for this many updates in a row
+TEMPERATURE_MIN_SPAN = 0.1  #deg C, the narrowest temperature range shown
+VOLTAGE_MIN_SPAN     = 1e-6 #V, the narrowest voltage range shown
 
 ################################################################################
+class AggFigure(object):
+    "stands in for the Tk 'EmbeddedFigure' without a display, drawing into an Agg canvas"
+    def __init__(self, figsize=FIGSIZE):
+        self._figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self._figure)
+
+    def get_figure(self):
+        return self._figure
+
+    def update(self):
+        self._figure.canvas.draw()
+
+
 class DataPlotter(Frame):
     def __init__(self, parent):
         Frame.__init__(self, parent)
-        self.figure_widget = EmbeddedFigure(self, figsize=FIGSIZE)
+        from automat.core.plotting.tk_embedded_plots import EmbeddedFigure
+        self.attach_figure(EmbeddedFigure(self, figsize=FIGSIZE))
+
+    def attach_figure(self, figure_widget):
+        """draw into 'figure_widget', anything with 'get_figure()' and 'update()'
+           like the Tk 'EmbeddedFigure' or, headless, an 'AggFigure'
+        """
+        self.figure_widget = figure_widget
+        self._backgrounds = None
         self.setup()
+        canvas = self.figure_widget.get_figure().canvas
+        canvas.mpl_connect('draw_event', self._on_draw)
 
     def pack(self, **kwargs):
         self.figure_widget.pack(side='right',fill='both', expand='yes')
@@ -59,6 +91,9 @@ class DataPlotter(Frame):
         #Voltage 
         self.plot_ax3 = ax3 = figure.add_subplot(313)
         self.plot_line7, = ax3.plot([],[],'c-')
+        #legends are static, they are drawn once with the background
+        ax1.legend(loc="upper left", prop = LEGEND_FONT_PROP)
+        ax2.legend(loc="upper left", prop = LEGEND_FONT_PROP)
         #finish formatting the third axes
         #ax3.set_xlabel("Time (seconds)", fontproperties=LABEL_FONT_PROP)
         ax3.set_ylabel("Voltage", fontproperties=LABEL_FONT_PROP)
@@ -66,67 +101,116 @@ class DataPlotter(Frame):
         ax3.set_ylim(-0.5, 0.5)
         ax3.tick_params(axis='both', which='major', labelsize=LABEL_FONT_SIZE)
         ax3.tick_params(axis='both', which='minor', labelsize=LABEL_FONT_SIZE-2) 
+        #traces are (line, data column, axes), their lines are only drawn by blitting
+        self._traces = ((self.plot_line0, 'temperatureA_measured', ax1),
+                        (self.plot_line1, 'temperatureB_measured', ax1),
+                        (self.plot_line2, 'temperatureC_measured', ax1),
+                        (self.plot_line3, 'temperatureA_target'  , ax1),
+                        (self.plot_line4, 'temperatureB_target'  , ax1),
+                        (self.plot_line5, 'chanA_output'         , ax2),
+                        (self.plot_line6, 'chanB_output'         , ax2),
+                        (self.plot_line7, 'voltage'              , ax3),
+                       )
+        self._decimators = [MinMaxDecimator(max_bins = MAX_DISPLAY_BINS) for _ in self._traces]
+        for line, _, _ in self._traces:
+            line.set_animated(True)
+        #the narrowest data range each rescaled axes shows, and how many updates
+        #in a row its data has stayed narrow enough to shrink the limits
+        self._y_min_spans = {ax1: TEMPERATURE_MIN_SPAN, ax3: VOLTAGE_MIN_SPAN}
+        self._y_narrow_updates = {ax1: 0, ax3: 0}
+        self._num_seen = 0
+        self._t0 = None
+        self._t_last = 0.0
+        self._backgrounds = None
         self.figure_widget.update()
 
     def update(self, data):
-        t = array(data['timestamp'])
-        if len(t) == 0:  #skip update for empty data
+        """render only the samples that arrived since the last call; 'data' is
+           the application's ColumnStore (or any mapping of equal length columns)
+        """
+        count = getattr(data, 'total_count', None)
+        if count is None:
+            count = len(data['timestamp'])
+        if count < self._num_seen or (count - self._num_seen) > len(data['timestamp']):
+            #the data was cleared or samples were lost before we saw them
+            self.setup()
+        num_new = count - self._num_seen
+        if num_new == 0:  #skip update for no new data
             return
-        t -= t[0]
-        #Temperature Plot
-        #line 0
-        y0 = array(data['temperatureA_measured'])
-        self.plot_line0.set_xdata(t)
-        self.plot_line0.set_ydata(y0)
-        #line 1
-        y1 = array(data['temperatureB_measured'])
-        self.plot_line1.set_xdata(t)
-        self.plot_line1.set_ydata(y1)
-        #line 2
-        y2 = array(data['temperatureC_measured'])
-        self.plot_line2.set_xdata(t)
-        self.plot_line2.set_ydata(y2)
-        #line 3
-        y3 = array(data['temperatureA_target'])
-        self.plot_line3.set_xdata(t)
-        self.plot_line3.set_ydata(y3)
-        #line 4
-        y4 = array(data['temperatureB_target'])
-        self.plot_line4.set_xdata(t)
-        self.plot_line4.set_ydata(y4)
-        #adjust the plot window
-        y_min = min(y0.min(),y1.min(),y2.min(), y3.min(), y4.min())
-        y_max = max(y0.max(),y1.max(),y2.max(), y3.max(), y4.max())
-        self.plot_ax1.set_ylim(y_min*0.9, y_max*1.1,) 
-        self.plot_ax1.set_xlim(0,t[-1]*1.1)
-        self.plot_ax1.legend(loc="upper left", prop = LEGEND_FONT_PROP)
-        #PID output plot
-        y5 = array(data['chanA_output'])
-        self.plot_line5.set_xdata(t)
-        self.plot_line5.set_ydata(y5)
-        y6 = array(data['chanB_output'])
-        self.plot_line6.set_xdata(t)
-        self.plot_line6.set_ydata(y6)
-        self.plot_ax2.set_xlim(0, t[-1]*1.1)
-        self.plot_ax2.legend(loc="upper left", prop = LEGEND_FONT_PROP)
-        #obtain voltage
-        y7 = array(data['voltage'])
-        self.plot_line7.set_xdata(t)
-        self.plot_line7.set_ydata(y7)
-        y_min = y7.min()
-        y_max = y7.max()
-        if y_min < 0:
-            y_min *= 1.1
+        names = ['timestamp'] + [column for _, column, _ in self._traces]
+        if hasattr(data, 'last'):
+            chunk = data.last(num_new, names = names)
         else:
-            y_min *= 0.9
-        if y_max > 0:
-            y_max *= 1.1
+            chunk = dict((name, asarray(data[name][-num_new:])) for name in names)
+        self._num_seen = count
+        t = array(chunk['timestamp'], dtype = float)
+        if self._t0 is None:
+            self._t0 = t[0]
+        t -= self._t0
+        self._t_last = t[-1]
+        for (line, column, _), decimator in zip(self._traces, self._decimators):
+            decimator.extend(t, chunk[column])
+            line.set_data(*decimator.get_xy())
+        if self._rescale():
+            #limits changed, redraw everything, the draw event recaptures the backgrounds
+            self.figure_widget.update()
         else:
-            y_max *= 0.9
-        self.plot_ax3.set_ylim(y_min, y_max,) 
-        self.plot_ax3.set_xlim(0, t[-1]*1.1)
-        #done        
-        self.figure_widget.update()
+            self._blit()
+
+    def _axes_range(self, ax):
+        lo = min(d.y_min for (_, _, a), d in zip(self._traces, self._decimators) if a is ax)
+        hi = max(d.y_max for (_, _, a), d in zip(self._traces, self._decimators) if a is ax)
+        return lo, hi
+
+    def _rescale(self):
+        """widen the axes limits in steps when the data leaves them, tighten
+           them once the data has stayed narrow for a while
+        """
+        changed = False
+        for ax in (self.plot_ax1, self.plot_ax2, self.plot_ax3):
+            x_lo, x_hi = ax.get_xlim()
+            if self._t_last > x_hi:
+                ax.set_xlim(0, max(self._t_last, 1.0)*X_HEADROOM)
+                changed = True
+        for ax in (self.plot_ax1, self.plot_ax3):
+            y_min, y_max = self._axes_range(ax)
+            if not (isfinite(y_min) and isfinite(y_max)):
+                continue
+            y_lo, y_hi = ax.get_ylim()
+            span = max(y_max - y_min, self._y_min_spans[ax])
+            if span < Y_SHRINK_FRACTION*(y_hi - y_lo):
+                self._y_narrow_updates[ax] += 1
+            else:
+                self._y_narrow_updates[ax] = 0
+            too_loose = self._y_narrow_updates[ax] >= Y_SHRINK_UPDATES
+            if y_min < y_lo or y_max > y_hi or too_loose:
+                #centered on the data, so a narrow plateau far from 0 stays narrow
+                center = 0.5*(y_min + y_max)
+                half = 0.5*span*(1 + 2*Y_HEADROOM)
+                ax.set_ylim(center - half, center + half)
+                self._y_narrow_updates[ax] = 0
+                changed = True
+        return changed
+
+    def _on_draw(self, event):
+        #a full draw leaves out the animated lines, save it as the background
+        canvas = self.figure_widget.get_figure().canvas
+        axes = (self.plot_ax1, self.plot_ax2, self.plot_ax3)
+        self._backgrounds = [(ax, canvas.copy_from_bbox(ax.bbox)) for ax in axes]
+        for line, _, ax in self._traces:
+            ax.draw_artist(line)
+
+    def _blit(self):
+        if self._backgrounds is None:
+            self.figure_widget.update()
+            return
+        canvas = self.figure_widget.get_figure().canvas
+        for ax, background in self._backgrounds:
+            canvas.restore_region(background)
+            for line, _, line_ax in self._traces:
+                if line_ax is ax:
+                    ax.draw_artist(line)
+            canvas.blit(ax.bbox)
 
     def change_title(self, new_title):
         figure = self.figure_widget.get_figure()       
@@ -0,0 +1,86 @@
+###############################################################################
+import numpy
+################################################################################
+DEFAULT_MAX_BINS = 1000
+################################################################################
+class MinMaxDecimator(object):
+    """Incrementally reduces an (x,y) series for display by keeping only the
+       minimum and maximum point of each bin of consecutive samples, so peaks
+       and glitches stay visible.  Points are fed with 'extend' as they arrive
+       and each one is only touched once; whenever the number of bins exceeds
+       'max_bins' neighbouring bins are merged pairwise and the bin size
+       doubles, which bounds the output to about 2*'max_bins' points no matter
+       how long the run.  Also tracks the running y range for autoscaling.
+    """
+    def __init__(self, max_bins = DEFAULT_MAX_BINS):
+        self.max_bins = max_bins
+        self.reset()
+
+    def reset(self):
+        self.bin_size = 1
+        self.count    = 0
+        self.y_min    = numpy.inf
+        self.y_max    = -numpy.inf
+        empty = numpy.empty(0)
+        self._x_lo = self._y_lo = self._x_hi = self._y_hi = empty
+        self._x_pending = self._y_pending = empty
+
+    def extend(self, x, y):
+        x = numpy.asarray(x, dtype = float)
+        y = numpy.asarray(y, dtype = float)
+        if len(y) == 0:
+            return
+        self.count += len(y)
+        finite = y[numpy.isfinite(y)]
+        if len(finite):
+            self.y_min = min(self.y_min, finite.min())
+            self.y_max = max(self.y_max, finite.max())
+        x = numpy.concatenate((self._x_pending, x))
+        y = numpy.concatenate((self._y_pending, y))
+        num_bins = len(y) // self.bin_size
+        used = num_bins*self.bin_size
+        self._x_pending, self._y_pending = x[used:], y[used:]
+        if num_bins:
+            self._append_bins(x[:used].reshape((num_bins, self.bin_size)),
+                              y[:used].reshape((num_bins, self.bin_size)))
+        while len(self._y_lo) > self.max_bins:
+            self._merge_bins()
+
+    def _append_bins(self, xb, yb):
+        #NaNs must neither win the min nor the max
+        nan = numpy.isnan(yb)
+        i_lo = numpy.where(nan, numpy.inf, yb).argmin(axis = 1)
+        i_hi = numpy.where(nan, -numpy.inf, yb).argmax(axis = 1)
+        rows = numpy.arange(len(yb))
+        self._x_lo = numpy.concatenate((self._x_lo, xb[rows, i_lo]))
+        self._y_lo = numpy.concatenate((self._y_lo, yb[rows, i_lo]))
+        self._x_hi = numpy.concatenate((self._x_hi, xb[rows, i_hi]))
+        self._y_hi = numpy.concatenate((self._y_hi, yb[rows, i_hi]))
+
+    def _merge_bins(self):
+        #combine bins pairwise, an odd last bin is carried over unchanged
+        n = len(self._y_lo) // 2 * 2
+        def merge(xs, ys, pick):
+            x2 = xs[:n].reshape((-1, 2))
+            y2 = ys[:n].reshape((-1, 2))
+            col = pick(y2)
+            rows = numpy.arange(len(y2))
+            return (numpy.concatenate((x2[rows, col], xs[n:])),
+                    numpy.concatenate((y2[rows, col], ys[n:])))
+        self._x_lo, self._y_lo = merge(self._x_lo, self._y_lo,
+                                       lambda y2: ((y2[:, 1] < y2[:, 0]) | numpy.isnan(y2[:, 0])).astype(int))
+        self._x_hi, self._y_hi = merge(self._x_hi, self._y_hi,
+                                       lambda y2: ((y2[:, 1] > y2[:, 0]) | numpy.isnan(y2[:, 0])).astype(int))
+        self.bin_size *= 2
+
+    def get_xy(self):
+        "the decimated series in time order, followed by the undecimated tail"
+        lo_first = self._x_lo <= self._x_hi
+        x = numpy.empty(2*len(self._x_lo))
+        y = numpy.empty(2*len(self._y_lo))
+        x[0::2] = numpy.where(lo_first, self._x_lo, self._x_hi)
+        x[1::2] = numpy.where(lo_first, self._x_hi, self._x_lo)
+        y[0::2] = numpy.where(lo_first, self._y_lo, self._y_hi)
+        y[1::2] = numpy.where(lo_first, self._y_hi, self._y_lo)
+        return (numpy.concatenate((x, self._x_pending)),
+                numpy.concatenate((y, self._y_pending)))
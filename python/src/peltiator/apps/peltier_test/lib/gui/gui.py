@@ -10,8 +10,6 @@ from FileDialog import FileDialog, SaveFileDialog
 import numpy
 #Automat framework provided
 from automat.core.gui.text_widgets import TextDisplayBox
-#pyTEIS framework provided
-from pyTEIS.apps.lib.thread2 import Thread as KillableThread
 #application local
 from data_plotter import DataPlotter
 ###############################################################################
@@ -21,7 +19,11 @@ WAIT_DELAY              = 100 #milliseconds
 TEXT_BUFFER_SIZE        = 10*2**20 #ten megabytes
 DATA_UPDATE_PERIOD        = 100  #milliseconds
 PLOT_UPDATE_PERIOD        = 1000 #milliseconds
-SCRIPT_LOOP_UPDATE_PERIOD = 10   #milliseconds
+SCRIPT_LOOP_UPDATE_PERIOD = 10   #milliseconds, only where Tk has no file handlers
+EXPORT_POLL_PERIOD        = 200  #milliseconds
+STAGE_TIMING_UPDATE_PERIOD = 1000 #milliseconds
+ABORT_WARNING_DELAY        = 5000 #milliseconds before warning about scripts that did not stop
+SEEBECK_UPDATE_PERIOD      = 1000 #milliseconds
 
 TEXT_DISPLAY_HEIGHT = 10
 
@@ -39,15 +41,47 @@ def NoticeKeyboardInterrupt():
     """
     return signal.signal(signal.SIGINT, signal.default_int_handler)
 
+def format_stage_timing(summary):
+    "one compact line per stage: median and 95th percentile in milliseconds"
+    lines = []
+    for name, s in summary.items():
+        if s['count']:
+            lines.append("%-20s %7.2f %7.2f" % (name, 1e3*s['p50'], 1e3*s['p95']))
+    if not lines:
+        return "no stage timings yet"
+    return "\n".join(["%-20s %7s %7s" % ("stage (ms)", "p50", "p95")] + lines)
+
+def format_seebeck(summary):
+    "per fixture the overall and the current step's Seebeck coefficient in uV/K"
+    def fit(s):
+        if s['slope'] is None:
+            return "%9s %7s n=%d" % ("-", "", s['count'])
+        if s['slope_stderr'] is None:
+            return "%9.3f %7s n=%d" % (1e6*s['slope'], "", s['count'])
+        return "%9.3f %7.3f n=%d" % (1e6*s['slope'], 1e6*s['slope_stderr'], s['count'])
+    lines = []
+    for name, s in summary.items():
+        lines.append("%-12s %s" % (name, fit(s['overall'])))
+        if s['steps']:
+            lines.append("%-12s %s" % ("  step %d" % len(s['steps']), fit(s['steps'][-1][1])))
+    if not lines:
+        return "no Seebeck estimate yet"
+    return "\n".join(["%-12s %9s %7s" % ("S (uV/K)", "slope", "+/-")] + lines)
+
 ###############################################################################
 class GUI(object):
-    def __init__(self, application):
+    def __init__(self, application, show_stage_timing = False):
         self.app = application
+        self.show_stage_timing = show_stage_timing
         self.app.print_comment("Starting GUI interface:")
         self.app.print_comment("please wait while the application loads...")
         self._mode = "standby"
         self._update_counter = 0
         self.data = None
+        #text printed from worker threads is handed to the Tk thread
+        self._main_thread = threading.current_thread()
+        self._text_queue  = Queue()
+        self._script_events_polled = True #until '_init_script_events'
         #build the GUI interface as a seperate window
         win = Tk()
         Pmw.initialise(win) #initialize Python MegaWidgets
@@ -106,6 +140,15 @@ class GUI(object):
                                                 label_text = 'Sample Name',
                                                 command = self.change_sample_name)
         self.sample_name_entry.pack()
+        #optional status readout of the hot path stage timings
+        self.stage_timing_label = Label(right_panel, justify='left', anchor='nw',
+                                        font=("Courier", 8))
+        if self.show_stage_timing:
+            self.stage_timing_label.pack(side='top', fill='x', pady=10)
+        #live Seebeck coefficient estimate, to see when a run has converged
+        self.seebeck_label = Label(right_panel, justify='left', anchor='nw',
+                                   font=("Courier", 8))
+        self.seebeck_label.pack(side='top', fill='x', pady=10)
         right_panel.pack(side='right', fill='both', padx=10)
         #make a dialog window for sending a command
         self.command_dialog = Pmw.Dialog(parent = win, buttons = ('OK', 'Cancel'), defaultbutton = 'OK')
@@ -130,28 +173,41 @@ class GUI(object):
         #run the GUI handling loop
         IgnoreKeyboardInterrupt()
         self.win.deiconify()
+        self._loop_text_queue()
+        self._init_script_events()
+        if self.show_stage_timing:
+            self._loop_stage_timing()
+        self._loop_seebeck()
         #loop until killed
         self.win.mainloop()
         NoticeKeyboardInterrupt()
 
     def update_data(self):
-        self.data = self.app.update_data()
+        #sampled off the Tk thread, 'update_plot' shows what has arrived so far
+        self.app.request_update()
            
     def update_plot(self):
-        self.data_plotter.update(self.data)
+        #the application's store is shared with the acquisition thread, only read it
+        self.data = self.app.data
+        with self.app.stage_timers.stage("gui.plot"):
+            self.data_plotter.update(self.data)
+
+    def _loop_stage_timing(self):
+        self.stage_timing_label.config(text = format_stage_timing(self.app.stage_timers.summary()))
+        self.win.after(STAGE_TIMING_UPDATE_PERIOD, self._loop_stage_timing)
         
+    def _loop_seebeck(self):
+        self.seebeck_label.config(text = format_seebeck(self.app.seebeck_report(verbose = False)))
+        self.win.after(SEEBECK_UPDATE_PERIOD, self._loop_seebeck)
+
     def start_loop(self):
         self.start_loop_button.config(state='disabled')
         self.stop_loop_button.config(state='normal')
         self._mode = "loop"
-        self._loop_data_update()
+        #sampling runs on the application's worker thread, not in Tk callbacks
+        self.app.start_acquisition(period = DATA_UPDATE_PERIOD/1000.0, verbose = True)
         self._loop_plot_update()
 
-    def _loop_data_update(self):
-        if self._mode == "loop":
-            self.update_data()
-            self.win.after(DATA_UPDATE_PERIOD, self._loop_data_update)
-    
     def _loop_plot_update(self):
         if self._mode == "loop":
             self.update_plot()
@@ -160,6 +216,7 @@ class GUI(object):
     def stop_loop(self):
         self.stop_loop_button.config(state='disabled')
         self.start_loop_button.config(state='normal')
+        self.app.stop_acquisition()
         self._mode = "standby"
     
     def toggle_chanA_pid_mode(self):
@@ -205,53 +262,88 @@ class GUI(object):
             self.disable_controls()
             self.abort_script_button.config(state='normal')
             self._mode = "scripting"
-            self.app.run_script(filepath)
-            self._script_loop() 
+            if len(self.app.fixtures) > 1:
+                self.app.run_script_per_fixture(filepath)
+            else:
+                self.app.run_script(filepath)
         
 
-    def _script_loop(self):
-        if self._mode == "scripting":
-            while not self.app._script_event_queue.empty():
-                event_type, obj = self.app._script_event_queue.get()
-                if event_type == "PRINT":
-                    self.app.print_comment(obj)
-                elif event_type == "UPDATE_DATA":
-                    self.update_data()
-                elif event_type == "UPDATE_PLOT":
-                    self.update_plot()
-                elif event_type == "UPDATE":
-                    self.update_data()
-                    self.update_plot()
-                elif event_type == "CLEAR_DATA":
-                    self.clear_data()
-                elif event_type == "ERROR":
-                    exc_type, exc, tb = obj
-                    msg = traceback.format_exception(exc_type, exc, tb)
-                    msg = "".join(msg)
-                    self.app.print_comment("Caught Error in Script: %s" % msg)
-                    msg = "%s\nCheck the console for the traceback" % (exc,)                    
-                    Pmw.MessageDialog(parent = self.win, 
-                                      title = 'Script Error',
-                                      message_text = msg,
-                                      iconpos = 'w',
-                                      icon_bitmap = 'error',buttons = ('OK',)
-                                      )
-                elif event_type == "ABORTED":
-                    self.app.print_comment("Script aborted.")
-                else:
-                    self.app.print_comment("Got unknown event '%s' with obj=%r" % (event_type,obj))
-            if self.app._script_thread.is_alive():
-                self.win.after(SCRIPT_LOOP_UPDATE_PERIOD, self._script_loop)
-            else:
-                self.app.print_comment("Script finished.")
-                self.enable_controls()
-                self._mode = "standby"
+    def _init_script_events(self):
+        #script events wake Tk through the queue's pipe rather than being polled
+        queue = self.app._script_event_queue
+        if queue.fileno() is None: #no wake-up pipe on this platform
+            self._poll_script_events()
+            return
+        try:
+            self.win.tk.createfilehandler(queue.fileno(), READABLE,
+                                          lambda fd, mask: self._deliver_script_events())
+            self._script_events_polled = False
+        except (AttributeError, RuntimeError, TclError): #e.g. Tk on Windows
+            self._script_events_polled = True
+            self._poll_script_events()
+
+    def _poll_script_events(self):
+        if not self.app._script_event_queue.empty():
+            self._deliver_script_events()
+        self.win.after(SCRIPT_LOOP_UPDATE_PERIOD, self._poll_script_events)
+
+    def _deliver_script_events(self):
+        #everything that piled up since the last wake-up, coalesced into at
+        #most one refresh and one text insert between other events
+        for event_type, obj in self.app._script_event_queue.drain():
+            with self.app.stage_timers.stage("script.%s" % event_type.lower()):
+                self._handle_script_event(event_type, obj)
+
+    def _finish_scripting(self):
+        self.app.print_comment("Script finished.")
+        self.abort_script_button.config(state='disabled')
+        self.enable_controls()
+        self._mode = "standby"
+
+    def _handle_script_event(self, event_type, obj):
+        if event_type == "PRINT":
+            self.app.print_comment(obj)
+        elif event_type == "UPDATE_DATA":
+            self.update_data()
+        elif event_type == "UPDATE_PLOT":
+            self.update_plot()
+        elif event_type == "UPDATE":
+            self.update_data()
+            self.update_plot()
+        elif event_type == "CLEAR_DATA":
+            self.clear_data()
+        elif event_type == "ERROR":
+            exc_type, exc, tb = obj
+            msg = traceback.format_exception(exc_type, exc, tb)
+            msg = "".join(msg)
+            self.app.print_comment("Caught Error in Script: %s" % msg)
+            msg = "%s\nCheck the console for the traceback" % (exc,)                    
+            Pmw.MessageDialog(parent = self.win, 
+                              title = 'Script Error',
+                              message_text = msg,
+                              iconpos = 'w',
+                              icon_bitmap = 'error',buttons = ('OK',)
+                              )
+        elif event_type == "ABORTED":
+            self.app.print_comment("Script aborted.")
+        elif event_type == "DONE":
+            if self._mode == "scripting" and not self.app.is_script_running():
+                self._finish_scripting()
+        else:
+            self.app.print_comment("Got unknown event '%s' with obj=%r" % (event_type,obj))
     
     def abort_script(self):
-        self.app._script_thread.terminate()
-        self.app._script_thread.join()
+        #the scripts stop at their next device call or sample, their 'DONE'
+        #events then restore the controls; never wait for them on the Tk thread
+        runs = self.app.abort_scripts(wait = False)
         self.abort_script_button.config(state='disabled')
-        self.enable_controls()
+        if runs:
+            self.win.after(ABORT_WARNING_DELAY, lambda: self._check_aborted_runs(runs))
+
+    def _check_aborted_runs(self, runs):
+        for run in runs:
+            if run.is_alive():
+                self.app.print_comment("Warning: script '%s' did not stop after being aborted" % run.filepath)
         
     def disable_controls(self):
         #disable all controls
@@ -280,7 +372,20 @@ class GUI(object):
         self.export_button.config(state='normal')
     
     def print_to_text_display(self, text, eol='\n'):
-        self.text_display.print_text(text, eol=eol)
+        if threading.current_thread() is self._main_thread:
+            self.text_display.print_text(text, eol=eol)
+        else:
+            #Tk is not thread safe, defer to '_loop_text_queue'
+            self._text_queue.put((text, eol))
+
+    def _loop_text_queue(self):
+        while True:
+            try:
+                text, eol = self._text_queue.get_nowait()
+            except Empty:
+                break
+            self.text_display.print_text(text, eol=eol)
+        self.win.after(WAIT_DELAY, self._loop_text_queue)
 
     def warn(self, msg):
         warnings.warn(msg)
@@ -323,7 +428,21 @@ class GUI(object):
                            key = None
                           )
         if filename:
-            self.app.export_data(filename)
+            #write in the background so that acquisition and the GUI keep going
+            export_thread = self.app.export_data(filename, background = True)
+            if export_thread is not None:
+                self._poll_export(export_thread)
+
+    def _poll_export(self, export_thread):
+        if export_thread.is_alive():
+            self.win.after(EXPORT_POLL_PERIOD, lambda: self._poll_export(export_thread))
+        elif export_thread.error is not None:
+            self.warn("export to '%s' failed: %s" % (export_thread.filename, export_thread.error))
+        else:
+            self.app.print_comment("finished exporting data to '%s'" % export_thread.filename)
 
     def _close(self):
+        self.app.stop_acquisition()
+        if not self._script_events_polled:
+            self.win.tk.deletefilehandler(self.app._script_event_queue.fileno())
         self.win.destroy()
@@ -21,6 +21,8 @@ def main():
     from pyTEIS import pkg_info
     #application local
     from lib.application.application import Application
+    from lib.application.fixture import parse_fixtures
+    from lib.application.adaptive_rate import AdaptiveRatePolicy, DEFAULT_MAX_PERIOD
     from lib.gui.gui import GUI
     
     ############################################################################
@@ -34,15 +36,57 @@ def main():
                   action = 'store_true',
                   help="run the interactive shell rather than the GUI"
                  )
+    OP.add_option("--simulate",dest="simulate",default=False,
+                  action = 'store_true',
+                  help="use simulated devices instead of the hardware"
+                 )
+    OP.add_option("--speedup",dest="speedup",default=1.0,
+                  type = 'float',
+                  help="with --simulate, run the simulation this many times faster than real time"
+                 )
+    OP.add_option("--fixtures",dest="fixtures",default=None,
+                  help="acquire from several fixtures, e.g. 'peltier_pid:dmm,peltier_pid2:dmm2' "
+                       "(device handles from the configuration), with --simulate the number of fixtures"
+                 )
+    OP.add_option("--worker-processes",dest="worker_processes",default=False,
+                  action = 'store_true',
+                  help="sample each fixture in its own supervised process"
+                 )
+    OP.add_option("--adaptive-sampling",dest="adaptive_sampling",default=False,
+                  action = 'store_true',
+                  help="sample fast after setpoint changes and back off while the signals are quiet"
+                 )
+    OP.add_option("--max-sampling-period",dest="max_sampling_period",default=DEFAULT_MAX_PERIOD,
+                  type = 'float',
+                  help="with --adaptive-sampling, the longest period in seconds to back off to"
+                 )
+    OP.add_option("--show-timing",dest="show_timing",default=False,
+                  action = 'store_true',
+                  help="show the acquisition stage timings in the GUI"
+                 )
     opts, args = OP.parse_args()
+    fixtures = None #as listed by the configuration
     #load the configuration
-    config_dirpath = pkg_info.platform['config_dirpath']
-    config_filepath = os.path.sep.join((config_dirpath, CONFIG_FILENAME))
-    config = Configuration(config_filepath)    
+    if opts.simulate:
+        from peltiator.drivers.devices.arduino.simulator import SimulatedConfiguration
+        config = SimulatedConfiguration(speedup = opts.speedup, fixtures = int(opts.fixtures or 1))
+    else:
+        config_dirpath = pkg_info.platform['config_dirpath']
+        config_filepath = os.path.sep.join((config_dirpath, CONFIG_FILENAME))
+        config = Configuration(config_filepath)    
+        if opts.fixtures:
+            fixtures = parse_fixtures(opts.fixtures)
+    rate_policy = None
+    if opts.adaptive_sampling:
+        rate_policy = AdaptiveRatePolicy(max_period = opts.max_sampling_period)
     #initialize the control application
-    app = Application(config)
+    app = Application(config,
+                      fixtures         = fixtures,
+                      worker_processes = opts.worker_processes,
+                      rate_policy      = rate_policy,
+                     )
     #start the graphical interface
-    gui = GUI(app)
+    gui = GUI(app, show_stage_timing = opts.show_timing)
     #give the app the ability to print to the GUI's textbox
     app.setup_textbox_printer(gui.print_to_text_display)
     #detach
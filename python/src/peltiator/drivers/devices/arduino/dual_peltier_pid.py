@@ -3,29 +3,200 @@
 """
 ###############################################################################
 #Dependencies
-import time
+import time, struct, threading
+from collections import OrderedDict, deque
+from Queue import Queue, Empty
 #Automat framework provided
 from automat.core.hwcontrol.devices.device import Device 
 from automat.core.hwcontrol.communication.serial_mixin import SerialCommunicationsMixIn
 #3rd Party
-import yaml
+import yaml, numpy
+#peltiator framework provided
+from peltiator.apps.lib.stats import LatencyHistograms, StageTimers
+from peltiator.apps.lib.reactor import Future, RequestChannel, chain, line_parser
 ###############################################################################
 #Module constants
 YAML_DOC_START = "---"
 YAML_DOC_END   = "..."
 
+#binary status frame: SYNC LENGTH PAYLOAD[LENGTH] CHECKSUM, see 'writeStatusFrame'
+#in peltierPID.ino; all multibyte fields are little-endian (AVR byte order)
+STATUS_FRAME_SYNC   = "\xaa\x55"
+STATUS_FRAME_FIELDS = (("frame_seq"            , "<u2"),
+                       ("device_millis"        , "<u4"),
+                       ("control_mode"         , "u1"),
+                       ("gradient_setpoint"    , "<f4"),
+                       ("temperatureA_measured", "<f4"),
+                       ("temperatureA_target"  , "<f4"),
+                       ("chanA_PID_output"     , "<f4"),
+                       ("chanA_func_output"    , "<f4"),
+                       ("chanA_output"         , "<f4"),
+                       ("temperatureB_measured", "<f4"),
+                       ("temperatureB_target"  , "<f4"),
+                       ("chanB_PID_output"     , "<f4"),
+                       ("chanB_func_output"    , "<f4"),
+                       ("chanB_output"         , "<f4"),
+                       ("temperatureC_measured", "<f4"),
+                      )
+STATUS_FRAME_NAMES  = tuple(name for name, _ in STATUS_FRAME_FIELDS)
+STATUS_FRAME_STRUCT = struct.Struct("<HIB12f")
+STATUS_FRAME_DTYPE  = numpy.dtype(list(STATUS_FRAME_FIELDS))
+STATUS_FRAME_SIZE   = len(STATUS_FRAME_SYNC) + 1 + STATUS_FRAME_STRUCT.size + 1
+
+#streaming mode
+DEFAULT_STREAM_PERIOD      = 0.1  #seconds
+DEFAULT_STREAM_BUFFER_SIZE = 4096 #records
+STREAM_LATE_FACTOR         = 1.5  #records arriving later than this many periods count as late
+FRAME_SEQ_MODULUS          = 2**16
+DEVICE_MILLIS_MODULUS      = 2**32
+
+#exchanges return as soon as their terminator arrives, these are the budgets
+#in seconds before giving up; the firmware services commands once per ~0.1 s loop
+PING_COMMAND    = "PING"
+PING_RESPONSE   = "PONG"
+DEFAULT_COMMAND_TIMEOUT = 0.5
+COMMAND_TIMEOUTS = {"STATUS?"     : 1.0,
+                    "STATUS_BIN?" : 0.5,
+                    PING_COMMAND  : 0.5,
+                   }
+DEFAULT_BAUDRATE = 115200 #SERIAL_SPEED in peltierPID.ino
+
+#Arduino's Print::printFloat writes these for values it cannot print
+ARDUINO_FLOAT_WORDS = {"nan": float('nan'),
+                       "inf": float('inf'),
+                       "-inf": float('-inf'),
+                       "ovf": float('nan'), #magnitude too large, sign unknown
+                      }
+
+###############################################################################
+# STATUS DOCUMENT DECODING
+
+def decode_status_yaml(doc):
+    """decode a 'printStatusYAML' document: flat 'key: number' lines between
+       '---' and '...', where '#' lines (the firmware's '### Error' messages)
+       are comments as in YAML. Anything else falls back to 'yaml.safe_load'.
+    """
+    record = {}
+    for line in doc.splitlines():
+        line = line.strip()
+        if not line or line[0] == '#' or line == YAML_DOC_START or line == YAML_DOC_END:
+            continue
+        key, sep, value = line.partition(": ")
+        if not sep:
+            return _decode_status_yaml_fallback(doc)
+        try:
+            if "." in value or "e" in value:
+                record[key] = float(value)
+            else:
+                record[key] = int(value)
+        except ValueError:
+            value = ARDUINO_FLOAT_WORDS.get(value)
+            if value is None:
+                return _decode_status_yaml_fallback(doc)
+            record[key] = value
+    return record
+
+def _decode_status_yaml_fallback(doc):
+    record = yaml.safe_load(doc)
+    if not isinstance(record, dict):
+        raise IOError, "expected a status document, got: %r" % doc
+    return record
+
+###############################################################################
+# STATUS FRAME DECODING
+
+def status_frame_checksum(data):
+    "8-bit sum of the length byte and payload, matches the firmware"
+    return sum(bytearray(data)) & 0xFF
+
+def decode_status_frame(payload):
+    "decode a single frame payload into a status record"
+    return OrderedDict(zip(STATUS_FRAME_NAMES, STATUS_FRAME_STRUCT.unpack(payload)))
+
+def decode_status_frames(payloads):
+    """decode a sequence of frame payloads in one shot into a NumPy structured
+       array with dtype STATUS_FRAME_DTYPE
+    """
+    return numpy.frombuffer("".join(payloads), dtype = STATUS_FRAME_DTYPE)
+
+def check_status_frame(frame):
+    """validate a complete frame (starting with the sync bytes) and return its
+       payload, raises IOError on a malformed frame
+    """
+    if not frame.startswith(STATUS_FRAME_SYNC):
+        raise IOError, "status frame is missing the sync bytes, got: %r" % frame[:2]
+    length = ord(frame[2])
+    if length != STATUS_FRAME_STRUCT.size:
+        raise IOError, "status frame has length %d, expected %d" % (length, STATUS_FRAME_STRUCT.size)
+    if len(frame) != STATUS_FRAME_SIZE:
+        raise IOError, "status frame is truncated, got %d of %d bytes" % (len(frame), STATUS_FRAME_SIZE)
+    checksum = ord(frame[-1])
+    if status_frame_checksum(frame[2:-1]) != checksum:
+        raise IOError, "status frame failed checksum"
+    return frame[3:-1]
+
+def parse_status_frame(buff):
+    "response parser for 'STATUS_BIN?', skips any text before the sync bytes"
+    start = buff.find(STATUS_FRAME_SYNC)
+    if start == -1 or len(buff) - start < STATUS_FRAME_SIZE:
+        return None
+    end = start + STATUS_FRAME_SIZE
+    return decode_status_frame(check_status_frame(buff[start:end])), end
+
+def parse_status_yaml(buff):
+    "response parser for 'STATUS?', a YAML document ending with '...'"
+    index = buff.find("\n" + YAML_DOC_END)
+    if index == -1:
+        return None
+    end = buff.find("\n", index + 1)
+    if end == -1:
+        return None
+    end += 1
+    return decode_status_yaml(buff[:end]), end
+
+def parse_until_ping(buff):
+    "response parser for a command followed by the 'PING' sentinel"
+    index = buff.find(PING_RESPONSE)
+    if index == -1:
+        return None
+    end = buff.find("\n", index)
+    if end == -1:
+        return None
+    return buff[:index], end + 1
+
 ###############################################################################
 # INTERFACE
 
 
 class Interface(Device, SerialCommunicationsMixIn):
-    def __init__(self, port, **kwargs):
+    def __init__(self, port, binary_status = 'auto', **kwargs):
         #initialize serial communication
         SerialCommunicationsMixIn.__init__(self, port, **kwargs)
+        #binary status mode: 'auto' negotiates at 'initialize', or force True/False
+        self._binary_status_request = binary_status
+        self.binary_status = False
+        self._stream_thread = None
+        self.stream_period  = None
+        self.reset_stream_counters()
+        #sentinel 'PING' support is negotiated at 'initialize'
+        self.has_ping = False
+        self._rx_buff = ""
+        self.command_timeouts = dict(COMMAND_TIMEOUTS)
+        self.latency = LatencyHistograms()
+        #split of 'get_status' into exchange and parsing, the application
+        #replaces this with its own (enabled) timers
+        self.stage_timers = StageTimers(enabled = False)
+        #serializes exchanges from the acquisition thread and the GUI/scripts
+        self._io_lock = threading.RLock()
     # Implementation of the Instrument Interface
     def initialize(self):
         self._send("GRAD 0.0")
         #time.sleep(1.0)
+        self.has_ping = self.probe_ping()
+        if self._binary_status_request == 'auto':
+            self.binary_status = self.probe_binary_status()
+        else:
+            self.binary_status = bool(self._binary_status_request)
     def identify(self):
         idn = self._exchange("*IDN?")
         return idn
@@ -36,16 +207,118 @@ class Interface(Device, SerialCommunicationsMixIn):
     #--------------------------------------------------------------------------
     # Implementation 
     def send_command(self,cmd):
-        self.ser.flushInput()
-        self.ser.flushOutput()
-        self._send(cmd)        
+        t0 = time.time()
+        with self._io_lock:
+            if self.is_streaming():
+                return self._send_command_streaming(cmd, t0)
+            return self._send_command_polled(cmd, t0)
+
+    def _send_command_polled(self, cmd, t0):
+        self._flush_input()
+        timeout = self.get_command_timeout(cmd)
         buff = []
+        if self.has_ping:
+            #the firmware handles commands in order, so everything before the
+            #sentinel's reply belongs to this command
+            self.ser.write("%s\n%s\n" % (cmd, PING_COMMAND))
+            deadline = t0 + timeout
+            while True:
+                line = self._read_until("\n", deadline)
+                if line.strip() == PING_RESPONSE:
+                    break
+                buff.append(line)
+        else:
+            #older firmware stays silent on success, so wait out the budget
+            self._send(cmd)
+            deadline = t0 + timeout
+            try:
+                while True:
+                    buff.append(self._read_until("\n", deadline))
+            except IOError:
+                buff.append(self._pop_rx())
+        self._record_latency(cmd, t0)
+        return "".join(buff)
+
+    def _send_command_streaming(self, cmd, t0):
+        #the reader thread owns the input, it forwards any text lines
+        deadline = t0 + self.get_command_timeout(cmd)
+        buff = []
+        if self.has_ping:
+            self.ser.write("%s\n%s\n" % (cmd, PING_COMMAND))
+        else:
+            self._send(cmd)
         while True:
-            time.sleep(0.01)
-            line = self._read(strip_EOL = False)
-            if not line:
-                return "".join(buff)
+            try:
+                line = self._stream_text.get(timeout = max(0.0, deadline - time.time()))
+            except Empty:
+                if self.has_ping:
+                    raise IOError, "'send_command' timed out waiting for %r" % PING_RESPONSE
+                break
+            if self.has_ping and line.strip() == PING_RESPONSE:
+                break
             buff.append(line)
+        self._record_latency(cmd, t0)
+        return "".join(buff)
+
+    def get_command_timeout(self, cmd):
+        return self.command_timeouts.get(self._command_type(cmd), DEFAULT_COMMAND_TIMEOUT)
+
+    def _command_type(self, cmd):
+        parts = cmd.split(None, 1)
+        return parts[0] if parts else cmd
+
+    def _record_latency(self, cmd, t0):
+        self.latency.record(self._command_type(cmd), time.time() - t0)
+
+    def _flush_input(self):
+        self.ser.flushInput()
+        self._rx_buff = ""
+
+    def _pop_rx(self):
+        data, self._rx_buff = self._rx_buff, ""
+        return data
+
+    def _fill_rx(self):
+        #take everything that is waiting, otherwise block for at most 'ser.timeout'
+        self._rx_buff += self.ser.read(max(1, self.ser.inWaiting()))
+
+    def _read_until(self, terminator, deadline):
+        "read through the first 'terminator' or raise IOError at the 'deadline'"
+        while True:
+            index = self._rx_buff.find(terminator)
+            if index != -1:
+                end = index + len(terminator)
+                data, self._rx_buff = self._rx_buff[:end], self._rx_buff[end:]
+                return data
+            if time.time() > deadline:
+                raise IOError, "timed out waiting for %r" % terminator
+            self._fill_rx()
+
+    def _read_exactly(self, size, deadline):
+        while len(self._rx_buff) < size:
+            if time.time() > deadline:
+                raise IOError, "timed out waiting for %d bytes" % size
+            self._fill_rx()
+        data, self._rx_buff = self._rx_buff[:size], self._rx_buff[size:]
+        return data
+
+    def probe_ping(self):
+        "check whether the firmware answers the 'PING' sentinel command"
+        self._flush_input()
+        self.ser.write(PING_COMMAND + "\n")
+        deadline = time.time() + self.get_command_timeout(PING_COMMAND)
+        try:
+            while True:
+                line = self._read_until("\n", deadline)
+                if line.strip() == PING_RESPONSE:
+                    return True
+        except IOError:
+            self._flush_input()
+            return False
+
+    def latency_summary(self):
+        "p50/p95/p99 exchange latencies per command type"
+        return self.latency.summary()
 
     def set_pid_control_mode(self, chan, mode):
         if mode is True:
@@ -53,32 +326,330 @@ class Interface(Device, SerialCommunicationsMixIn):
         elif mode is False:
             mode = 'off'        
         cmd = "PID_%s %s" % (chan,mode)
-        self._send(cmd)
+        with self._io_lock:
+            self._send(cmd)
+
+    def probe_binary_status(self):
+        """check whether the firmware understands 'STATUS_BIN?', older firmware
+           answers with an error line instead of a frame
+        """
+        try:
+            self._get_status_binary()
+            return True
+        except IOError:
+            self._flush_input()
+            return False
 
     def get_status(self):
-        self.ser.flushInput()
-        self.ser.flushOutput()
-        self.ser.write("STATUS?\n")
-        time.sleep(0.1)
-        buff = []
-        line = self.ser.readline()
-#        if not line.startswith(YAML_DOC_START):
-#            raise IOError, "expected a YAML document start tag '%s', instead got:\n%r" % (YAML_DOC_START, line)
-        buff.append(line)
-        while True:
-            line = self.ser.readline()
-            buff.append(line)
-            if line == "":
-                raise IOError, "'get_status' timed out after %f seconds" % self.ser.timeout
-            elif line.startswith(YAML_DOC_END):
-                yaml_doc = "".join(buff)
-                #try:
-                record = yaml.load(yaml_doc)
-                #except yaml.S
-                record['timestamp'] = time.time()
-                return record
-        
+        if self.is_streaming():
+            #don't disturb the stream, report the most recent record instead
+            record = self._stream_latest
+            if record is None:
+                raise IOError, "'get_status' has not yet received a streamed record"
+            return record
+        with self._io_lock:
+            if self.binary_status:
+                return self._get_status_binary()
+            return self._get_status_yaml()
+
+    def _read_status_frame(self, deadline):
+        #scan for the sync bytes, skipping over any text from the firmware
+        try:
+            self._read_until(STATUS_FRAME_SYNC, deadline)
+            rest = self._read_exactly(STATUS_FRAME_SIZE - len(STATUS_FRAME_SYNC), deadline)
+        except IOError:
+            raise IOError, "'get_status' timed out after %f seconds" % self.get_command_timeout("STATUS_BIN?")
+        frame = STATUS_FRAME_SYNC + rest
+        return check_status_frame(frame)
+
+    def _get_status_binary(self):
+        t0 = time.time()
+        with self.stage_timers.stage("status.exchange"):
+            self._flush_input()
+            self.ser.write("STATUS_BIN?\n")
+            payload = self._read_status_frame(deadline = t0 + self.get_command_timeout("STATUS_BIN?"))
+        with self.stage_timers.stage("status.parse"):
+            record = decode_status_frame(payload)
+        #stamp with the middle of the exchange, when the firmware took the sample
+        record['timestamp'] = 0.5*(t0 + time.time())
+        self._record_latency("STATUS_BIN?", t0)
+        return record
+
+    def _get_status_yaml(self):
+        t0 = time.time()
+        with self.stage_timers.stage("status.exchange"):
+            self._flush_input()
+            self.ser.write("STATUS?\n")
+            deadline = t0 + self.get_command_timeout("STATUS?")
+            buff = []
+#            if not line.startswith(YAML_DOC_START):
+#                raise IOError, "expected a YAML document start tag '%s', instead got:\n%r" % (YAML_DOC_START, line)
+            while True:
+                try:
+                    line = self._read_until("\n", deadline)
+                except IOError:
+                    raise IOError, "'get_status' timed out after %f seconds" % self.get_command_timeout("STATUS?")
+                buff.append(line)
+                if line.startswith(YAML_DOC_END):
+                    break
+        t1 = time.time()
+        with self.stage_timers.stage("status.parse"):
+            record = decode_status_yaml("".join(buff))
+        #stamp with the middle of the exchange, when the firmware took the sample
+        record['timestamp'] = 0.5*(t0 + t1)
+        self._record_latency("STATUS?", t0)
+        return record
         
+
+    #--------------------------------------------------------------------------
+    # Streaming mode
+    def is_streaming(self):
+        return self._stream_thread is not None
+
+    def reset_stream_counters(self):
+        self.stream_counters = OrderedDict((("received"  ,0),
+                                            ("dropped"   ,0),
+                                            ("late"      ,0),
+                                            ("bad_frames",0),
+                                          ))
+
+    def start_streaming(self,
+                        period      = DEFAULT_STREAM_PERIOD,
+                        buffer_size = DEFAULT_STREAM_BUFFER_SIZE,
+                       ):
+        """ask the controller to push status frames every 'period' seconds, a
+           background thread decodes them into a ring buffer of 'buffer_size'
+           records, which is emptied by 'drain_records'
+        """
+        if not self.binary_status:
+            raise IOError, "streaming requires firmware support for binary status frames"
+        if self.is_streaming():
+            self.stop_streaming()
+        self.stream_period   = period
+        self._stream_records = deque(maxlen = buffer_size)
+        self._stream_lock    = threading.Lock()
+        self._stream_text    = Queue()
+        self._stream_text_tail = "" #an unfinished line between frames
+        self._stream_latest  = None
+        self._stream_stop    = threading.Event()
+        self.reset_stream_counters()
+        self._flush_input()
+        self._send("STREAM %d" % int(round(period*1000)))
+        self._stream_thread = threading.Thread(target = self._stream_reader_loop)
+        self._stream_thread.daemon = True
+        self._stream_thread.start()
+
+    def stop_streaming(self):
+        if not self.is_streaming():
+            return
+        self._send("STREAM 0")
+        self._stream_stop.set()
+        self._stream_thread.join()
+        self._stream_thread = None
+        self._flush_input()
+
+    def drain_records(self):
+        "remove and return all records that have arrived since the last call"
+        with self._stream_lock:
+            records = list(self._stream_records)
+            self._stream_records.clear()
+        return records
+
+    def _stream_reader_loop(self):
+        buff = ""
+        last_seq     = None
+        last_arrival = None
+        anchor       = None #(host time, device millis) pair for timestamps
+        counters = self.stream_counters
+        while not self._stream_stop.is_set():
+            chunk = self.ser.read(max(1, self.ser.inWaiting()))
+            if not chunk:
+                continue
+            arrival = time.time()
+            buff += chunk
+            while True:
+                start = buff.find(STATUS_FRAME_SYNC)
+                if start == -1:
+                    #keep a possible partial sync byte, the rest is text
+                    text_end = len(buff) - 1 if buff.endswith(STATUS_FRAME_SYNC[0]) else len(buff)
+                    self._forward_stream_text(buff[:text_end])
+                    buff = buff[text_end:]
+                    break
+                if start > 0:
+                    self._forward_stream_text(buff[:start])
+                    buff = buff[start:]
+                if len(buff) < STATUS_FRAME_SIZE:
+                    break
+                frame = buff[:STATUS_FRAME_SIZE]
+                try:
+                    payload = check_status_frame(frame)
+                except IOError:
+                    counters['bad_frames'] += 1
+                    buff = buff[1:]
+                    continue
+                buff = buff[STATUS_FRAME_SIZE:]
+                record = decode_status_frame(payload)
+                #place the record on the host clock using the device clock,
+                #re-anchoring whenever the mapped time would be in the future
+                millis = record['device_millis']
+                if anchor is not None:
+                    elapsed = ((millis - anchor[1]) % DEVICE_MILLIS_MODULUS)*1e-3
+                    timestamp = anchor[0] + elapsed
+                if anchor is None or timestamp > arrival:
+                    anchor    = (arrival, millis)
+                    timestamp = arrival
+                record['timestamp'] = timestamp
+                #bookkeeping
+                seq = record['frame_seq']
+                if last_seq is not None:
+                    counters['dropped'] += (seq - last_seq - 1) % FRAME_SEQ_MODULUS
+                last_seq = seq
+                if last_arrival is not None and (arrival - last_arrival) > STREAM_LATE_FACTOR*self.stream_period:
+                    counters['late'] += 1
+                last_arrival = arrival
+                counters['received'] += 1
+                with self._stream_lock:
+                    if len(self._stream_records) == self._stream_records.maxlen:
+                        counters['dropped'] += 1 #overwritten before being drained
+                    self._stream_records.append(record)
+                self._stream_latest = record
+
+    def _forward_stream_text(self, text):
+        "queue the complete lines of the text between frames, keeping the unfinished tail"
+        lines = (self._stream_text_tail + text).splitlines(True)
+        self._stream_text_tail = ""
+        if lines and not lines[-1].endswith("\n"):
+            self._stream_text_tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                self._stream_text.put(line)
+
+class AsyncInterface(RequestChannel):
+    """Non-blocking variant of Interface for use with a 'Reactor', so that a
+       single event loop can drive many controllers. The methods return
+       Futures and every request has its own timeout (the same budgets as
+       Interface). Requests to one controller are answered in order.
+
+       Opens 'port' itself in non-blocking mode unless an open serial object
+       is passed as 'ser'.
+    """
+    def __init__(self, reactor, port = None,
+                 baudrate      = DEFAULT_BAUDRATE,
+                 binary_status = 'auto',
+                 ser           = None,
+                ):
+        if ser is None:
+            import serial
+            ser = serial.Serial(port, baudrate = baudrate, timeout = 0)
+        self.ser = ser
+        self._binary_status_request = binary_status
+        self.binary_status = False
+        self.has_ping = False
+        self.command_timeouts = dict(COMMAND_TIMEOUTS)
+        self.latency = LatencyHistograms()
+        RequestChannel.__init__(self, reactor)
+
+    #--------------------------------------------------------------------------
+    # transport
+    def fileno(self):
+        return self.ser.fileno()
+
+    def _read_available(self):
+        return self.ser.read(max(1, self.ser.inWaiting()))
+
+    def _write(self, data):
+        self.ser.write(data)
+
+    #--------------------------------------------------------------------------
+    # requests
+    def initialize(self):
+        """zero the gradient and negotiate the firmware features, returns a
+           Future that completes when they are known
+        """
+        self.submit("GRAD 0.0\n", None, 0)
+        ping   = self.exchange(PING_COMMAND)
+        binary = self.submit("STATUS_BIN?\n", parse_status_frame,
+                             self.get_command_timeout("STATUS_BIN?"))
+        #requests complete in order, so the ping result is in when this runs
+        def negotiate(_):
+            self.has_ping = ping.exception() is None and ping.result().strip() == PING_RESPONSE
+            if self._binary_status_request == 'auto':
+                self.binary_status = binary.exception() is None
+            else:
+                self.binary_status = bool(self._binary_status_request)
+            return True
+        done = Future()
+        binary.add_done_callback(lambda f: done.set_result(negotiate(f)))
+        return done
+
+    def shutdown(self):
+        return self.send("GRAD 0.0")
+
+    def send(self, cmd):
+        "write a command without waiting for any reply"
+        return self.submit(cmd + "\n", None, 0)
+
+    def read(self, terminator = "\n", timeout = DEFAULT_COMMAND_TIMEOUT):
+        "the next 'terminator' delimited response, without sending anything"
+        return self.submit("", line_parser(terminator), timeout)
+
+    def exchange(self, cmd, terminator = "\n", timeout = None):
+        "send 'cmd' and return its first 'terminator' delimited response line"
+        if timeout is None:
+            timeout = self.get_command_timeout(cmd)
+        request = self.submit(cmd + "\n", line_parser(terminator), timeout)
+        return self._timed(cmd, request)
+
+    def send_command(self, cmd, timeout = None):
+        "send 'cmd' and return all of the text it produced"
+        if timeout is None:
+            timeout = self.get_command_timeout(cmd)
+        if self.has_ping:
+            request = self.submit("%s\n%s\n" % (cmd, PING_COMMAND), parse_until_ping, timeout)
+        else:
+            #older firmware stays silent on success, so wait out the budget
+            request = self.submit(cmd + "\n", lambda buff: None, timeout,
+                                  on_timeout = lambda buff: buff)
+        return self._timed(cmd, request)
+
+    def get_status(self, timeout = None):
+        cmd = "STATUS_BIN?" if self.binary_status else "STATUS?"
+        parser = parse_status_frame if self.binary_status else parse_status_yaml
+        if timeout is None:
+            timeout = self.get_command_timeout(cmd)
+        request = self.submit(cmd + "\n", parser, timeout)
+        def stamp(record):
+            #the middle of the exchange, when the firmware took the sample
+            record['timestamp'] = 0.5*(request.t_sent + request.t_done)
+            return record
+        return chain(self._timed(cmd, request), stamp)
+
+    def set_pid_control_mode(self, chan, mode):
+        if mode is True:
+            mode = 'on'
+        elif mode is False:
+            mode = 'off'
+        return self.send("PID_%s %s" % (chan, mode))
+
+    #--------------------------------------------------------------------------
+    # helpers
+    def get_command_timeout(self, cmd):
+        return self.command_timeouts.get(self._command_type(cmd), DEFAULT_COMMAND_TIMEOUT)
+
+    def _command_type(self, cmd):
+        parts = cmd.split(None, 1)
+        return parts[0] if parts else cmd
+
+    def _timed(self, cmd, request):
+        def record(f):
+            if f.exception() is None:
+                self.latency.record(self._command_type(cmd), f.t_done - f.t_sent)
+        request.add_done_callback(record)
+        return request
+
+    def latency_summary(self):
+        return self.latency.summary()
+
 def get_interface(**kwargs):
     iface = Interface(**kwargs)
     return iface
@@ -0,0 +1,537 @@
+"""
+   simulator - host side stand-in for the Arduino dual peltier PID controller
+               and the DMM, for running the application without hardware
+
+   SimulatedController runs the peltierPID.ino command set and control loop
+   against a lumped thermal model and talks over a pseudo-terminal, so the
+   real 'dual_peltier_pid.Interface' can open its 'port'. FakeDMM reads the
+   Seebeck voltage across the two stages. 'speedup' runs the simulated time
+   that many times faster than the wall clock.
+"""
+###############################################################################
+#Dependencies
+import os, pty, tty, time, math, random, select, threading
+#peltiator framework provided
+from peltiator.drivers.devices.arduino.dual_peltier_pid import (STATUS_FRAME_SYNC,
+    STATUS_FRAME_STRUCT, FRAME_SEQ_MODULUS, DEVICE_MILLIS_MODULUS, status_frame_checksum)
+###############################################################################
+#Module constants
+#firmware, see peltierPID.ino
+HBRIDGE_DRIVE_PERIOD = 0.1 #seconds, one pass of 'loop()'
+PID_SAMPLE_PERIOD    = 0.1
+PID_OUTPUT_MIN = -1.0
+PID_OUTPUT_MAX =  1.0
+Kp = 0.10
+Ki = 0.01
+Kd = 0.01
+CONTROL_MODE_GRADIENT = 0b00000001
+CONTROL_MODE_PID_A    = 0b00000010
+CONTROL_MODE_PID_B    = 0b00000100
+CONTROL_MODE_FUNC_A   = 0b00001000
+CONTROL_MODE_FUNC_B   = 0b00010000
+SERIALCOMMANDBUFFER   = 64
+EOL = "\r\n" #Serial.println
+
+#thermal model, temperatures in deg C and times in seconds
+T_AMBIENT        = 25.0
+PELTIER_GAIN     = 0.5   #deg C/s pumped into a stage at full drive
+JOULE_GAIN       = 0.05  #deg C/s of resistive heating at full drive
+TAU_SINK         = 20.0  #stage to heat sink
+TAU_COUPLE       = 200.0 #stage to stage, through the sample
+TAU_AMBIENT      = 600.0 #heat sink to ambient
+HEAT_REJECTION   = 0.005 #deg C/s into the heat sink per unit of drive
+MODEL_TIME_STEP  = 0.01
+THERMISTOR_NOISE = 0.02  #deg C rms
+
+#DMM
+SEEBECK_COEFFICIENT = 40e-6 #V/deg C
+DMM_OFFSET          = 0.0   #V
+DMM_NOISE           = 50e-9 #V rms
+DMM_READ_TIME       = 0.02  #seconds of integration per reading
+###############################################################################
+# FIRMWARE LIBRARIES
+
+class PID(object):
+    "port of the Arduino PID_v1 library in DIRECT mode"
+    def __init__(self, kp, ki, kd, sample_time = PID_SAMPLE_PERIOD,
+                 output_min = PID_OUTPUT_MIN, output_max = PID_OUTPUT_MAX):
+        self.sample_time = sample_time
+        self.kp = kp
+        self.ki = ki*sample_time
+        self.kd = kd/sample_time
+        self.output_min = output_min
+        self.output_max = output_max
+        self.in_auto    = False
+        self.iterm      = 0.0
+        self.last_input = 0.0
+        self.last_time  = None
+
+    def _clamp(self, x):
+        return min(max(x, self.output_min), self.output_max)
+
+    def set_mode(self, automatic, input, output):
+        if automatic and not self.in_auto:
+            #bumpless transfer
+            self.iterm      = self._clamp(output)
+            self.last_input = input
+        self.in_auto = automatic
+
+    def compute(self, now, input, setpoint, output):
+        "returns the new output, or the unchanged 'output' between samples"
+        if not self.in_auto:
+            return output
+        if self.last_time is not None and now - self.last_time < self.sample_time - 1e-9:
+            return output
+        error = setpoint - input
+        self.iterm = self._clamp(self.iterm + self.ki*error)
+        d_input = input - self.last_input
+        output = self._clamp(self.kp*error + self.iterm - self.kd*d_input)
+        self.last_input = input
+        self.last_time  = now
+        return output
+
+
+class FunctionGenerator(object):
+    "port of FuncGenLib"
+    def __init__(self, now = 0.0):
+        self.set_func_off(now)
+
+    def reset_time(self, now):
+        self.t0 = now
+
+    def set_func_off(self, now):
+        self.func  = None
+        self.freq  = self.amp = self.phase = 0.0
+        self.reset_time(now)
+
+    def set_func_sin(self, now, freq, amp, phase = 0.0):
+        self.func  = 'sin'
+        self.freq, self.amp, self.phase = freq, amp, phase
+        self.reset_time(now)
+
+    def compute(self, now):
+        if self.func == 'sin':
+            return self.amp*math.sin(2.0*math.pi*self.freq*(now - self.t0) + self.phase)
+        return 0.0
+
+###############################################################################
+# THERMAL MODEL
+
+class ThermalModel(object):
+    """Two peltier stages A and B mounted on a common heat sink, whose
+       temperature the reference thermistor C reads. Positive drive pumps
+       heat into a stage, and both the pumped heat and the Joule heating end
+       up in the heat sink, which relaxes to ambient.
+    """
+    def __init__(self, T_ambient = T_AMBIENT, seed = None):
+        self.T_ambient = T_ambient
+        self.T_A = self.T_B = self.T_C = T_ambient
+        self.rng = random.Random(seed)
+
+    def step(self, dt, drive_A, drive_B):
+        "advance by 'dt' seconds with the stage drives in [-1, 1]"
+        steps = max(1, int(math.ceil(dt/MODEL_TIME_STEP)))
+        h = dt/steps
+        for _ in xrange(steps):
+            T_A, T_B, T_C = self.T_A, self.T_B, self.T_C
+            dT_A = (PELTIER_GAIN*drive_A + JOULE_GAIN*drive_A**2
+                    - (T_A - T_C)/TAU_SINK - (T_A - T_B)/TAU_COUPLE)
+            dT_B = (PELTIER_GAIN*drive_B + JOULE_GAIN*drive_B**2
+                    - (T_B - T_C)/TAU_SINK - (T_B - T_A)/TAU_COUPLE)
+            dT_C = ((self.T_ambient - T_C)/TAU_AMBIENT
+                    + HEAT_REJECTION*(abs(drive_A) + abs(drive_B)))
+            self.T_A += h*dT_A
+            self.T_B += h*dT_B
+            self.T_C += h*dT_C
+
+    def read_thermistors(self):
+        noise = lambda: self.rng.gauss(0.0, THERMISTOR_NOISE)
+        return self.T_A + noise(), self.T_B + noise(), self.T_C + noise()
+
+###############################################################################
+# CONTROLLER
+
+class SimulatedController(object):
+    """Runs the peltierPID.ino firmware logic on a thread, on the far end of a
+       pseudo-terminal whose name is 'port'. Commands are handled once per
+       simulated 'loop()' pass of HBRIDGE_DRIVE_PERIOD seconds, just as on
+       the device, and responses are formatted the same way.
+    """
+    def __init__(self, speedup = 1.0, T_ambient = T_AMBIENT, seed = None):
+        self.speedup = float(speedup)
+        self.model   = ThermalModel(T_ambient = T_ambient, seed = seed)
+        self._lock   = threading.Lock()
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self.now = 0.0 #simulated seconds since reset
+        self.control_mode = 0
+        self.gradient_setpoint = 0.0
+        self.T_A = self.T_B = self.T_C = self.model.T_ambient
+        self.chanA_PID_setpoint = self.chanB_PID_setpoint = 0.0
+        self.chanA_PID_output   = self.chanB_PID_output   = 0.0
+        self.chanA_func_output  = self.chanB_func_output  = 0.0
+        self.chanA_output       = self.chanB_output       = 0.0
+        self.chanA_PID = PID(Kp, Ki, Kd)
+        self.chanB_PID = PID(Kp, Ki, Kd)
+        self.chanA_PID.set_mode(True, self.T_A, 0.0)
+        self.chanB_PID.set_mode(True, self.T_B, 0.0)
+        self.chanA_FGen = FunctionGenerator()
+        self.chanB_FGen = FunctionGenerator()
+        self.status_frame_seq = 0
+        self.stream_period_ms = 0
+        self.stream_last_ms   = 0
+        self._rx = ""
+        self._tx = []
+        self._set_gradient_target(0.0) #safe initial condition
+        self._commands = {"STATUS?"    : self._status_command,
+                          "STATUS_BIN?": self._status_binary_command,
+                          "TEMP_A"     : lambda args: self._temp_command('A', args),
+                          "TEMP_B"     : lambda args: self._temp_command('B', args),
+                          "GRAD"       : self._grad_command,
+                          "PID_A"      : lambda args: self._pid_mode_command('A', args),
+                          "PID_B"      : lambda args: self._pid_mode_command('B', args),
+                          "FUNC_A"     : lambda args: self._func_command('A', args),
+                          "FUNC_B"     : lambda args: self._func_command('B', args),
+                          "FUNC_SYNC"  : self._func_sync_command,
+                          "STREAM"     : self._stream_command,
+                          "PING"       : self._ping_command,
+                         }
+
+    #--------------------------------------------------------------------------
+    # running
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target = self._run, name = "simulated_controller")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def millis(self):
+        return int(self.now*1000) % DEVICE_MILLIS_MODULUS
+
+    def true_temperatures(self):
+        "the model temperatures, without thermistor noise"
+        with self._lock:
+            return self.model.T_A, self.model.T_B, self.model.T_C
+
+    def _run(self):
+        t_start = time.time()
+        k = 0
+        while not self._stop_event.is_set():
+            self.loop()
+            k += 1
+            delay = t_start + k*HBRIDGE_DRIVE_PERIOD/self.speedup - time.time()
+            if delay > 0:
+                self._stop_event.wait(delay)
+
+    def loop(self):
+        "one pass of the firmware 'loop()', then the hardware runs for its drive period"
+        self.T_A, self.T_B, self.T_C = self.model.read_thermistors()
+        self._read_serial()
+        if self.control_mode & CONTROL_MODE_GRADIENT:
+            self.chanA_PID_setpoint = self.T_C + self.gradient_setpoint/2.0
+            self.chanB_PID_setpoint = self.T_C - self.gradient_setpoint/2.0
+        if self.control_mode & CONTROL_MODE_PID_A:
+            self.chanA_PID_output = self.chanA_PID.compute(self.now, self.T_A,
+                                                           self.chanA_PID_setpoint, self.chanA_PID_output)
+        else:
+            self.chanA_PID_output = 0.0
+        if self.control_mode & CONTROL_MODE_PID_B:
+            self.chanB_PID_output = self.chanB_PID.compute(self.now, self.T_B,
+                                                           self.chanB_PID_setpoint, self.chanB_PID_output)
+        else:
+            self.chanB_PID_output = 0.0
+        self.chanA_func_output = self.chanA_FGen.compute(self.now) if self.control_mode & CONTROL_MODE_FUNC_A else 0.0
+        self.chanB_func_output = self.chanB_FGen.compute(self.now) if self.control_mode & CONTROL_MODE_FUNC_B else 0.0
+        clamp = lambda x: min(max(x, -1.0), 1.0)
+        self.chanA_output = clamp(self.chanA_PID_output + self.chanA_func_output)
+        self.chanB_output = clamp(self.chanB_PID_output + self.chanB_func_output)
+        if self.stream_period_ms > 0 and self.millis() - self.stream_last_ms >= self.stream_period_ms:
+            self.stream_last_ms = self.millis()
+            self._write_status_frame()
+        self._flush_tx()
+        with self._lock:
+            self.model.step(HBRIDGE_DRIVE_PERIOD, self.chanA_output, self.chanB_output)
+        self.now += HBRIDGE_DRIVE_PERIOD
+
+    #--------------------------------------------------------------------------
+    # serial port
+    def _read_serial(self):
+        while select.select([self._master], [], [], 0)[0]:
+            self._rx += os.read(self._master, 4096)
+        #like SerialCommand.readSerial, an empty command ends the pass
+        while "\n" in self._rx:
+            line, self._rx = self._rx.split("\n", 1)
+            line = "".join(c for c in line if " " <= c <= "~")[:SERIALCOMMANDBUFFER - 1]
+            tokens = line.split()
+            if not tokens:
+                return
+            handler = self._commands.get(tokens[0])
+            if handler is None:
+                self._println("### Error: command not recognized ###")
+            else:
+                handler(tokens[1:])
+
+    def _print(self, text):
+        self._tx.append(text)
+
+    def _println(self, text = ""):
+        self._tx.append(text + EOL)
+
+    def _flush_tx(self):
+        if self._tx:
+            data = "".join(self._tx)
+            self._tx = []
+            while data:
+                n = os.write(self._master, data)
+                data = data[n:]
+
+    #--------------------------------------------------------------------------
+    # helpers
+    def _set_pid_mode(self, chan, state):
+        pid = self.chanA_PID if chan == 'A' else self.chanB_PID
+        flag = CONTROL_MODE_PID_A if chan == 'A' else CONTROL_MODE_PID_B
+        T, output = (self.T_A, self.chanA_PID_output) if chan == 'A' else (self.T_B, self.chanB_PID_output)
+        pid.set_mode(state, T, output)
+        if state:
+            self.control_mode |= flag
+        else:
+            self.control_mode &= ~flag
+
+    def _set_gradient_target(self, grad):
+        self.gradient_setpoint = grad
+        self.control_mode |= CONTROL_MODE_GRADIENT | CONTROL_MODE_PID_A | CONTROL_MODE_PID_B
+
+    def _set_temperature_target(self, chan, temp):
+        self.gradient_setpoint = 0.0
+        if chan == 'A':
+            self.chanA_PID_setpoint = temp
+            self.control_mode |= CONTROL_MODE_PID_A
+        else:
+            self.chanB_PID_setpoint = temp
+            self.control_mode |= CONTROL_MODE_PID_B
+        self.control_mode &= ~CONTROL_MODE_GRADIENT
+
+    def _status_values(self):
+        return (self.control_mode, self.gradient_setpoint,
+                self.T_A, self.chanA_PID_setpoint, self.chanA_PID_output,
+                self.chanA_func_output, self.chanA_output,
+                self.T_B, self.chanB_PID_setpoint, self.chanB_PID_output,
+                self.chanB_func_output, self.chanB_output,
+                self.T_C,
+               )
+
+    def _print_status_yaml(self):
+        names = ("control_mode", "gradient_setpoint",
+                 "temperatureA_measured", "temperatureA_target", "chanA_PID_output",
+                 "chanA_func_output", "chanA_output",
+                 "temperatureB_measured", "temperatureB_target", "chanB_PID_output",
+                 "chanB_func_output", "chanB_output",
+                 "temperatureC_measured",
+                )
+        values = self._status_values()
+        self._println("---")
+        self._println("%s: %d" % (names[0], values[0]))
+        for name, value in zip(names[1:], values[1:]):
+            self._println("%s: %0.2f" % (name, value)) #Serial.println(double)
+        self._println("...")
+
+    def _write_status_frame(self):
+        payload = STATUS_FRAME_STRUCT.pack(self.status_frame_seq, self.millis(), *self._status_values())
+        self.status_frame_seq = (self.status_frame_seq + 1) % FRAME_SEQ_MODULUS
+        body = chr(len(payload)) + payload
+        self._print(STATUS_FRAME_SYNC + body + chr(status_frame_checksum(body)))
+
+    #--------------------------------------------------------------------------
+    # command handlers
+    def _status_command(self, args):
+        if args:
+            self._println("### Error: STATUS requires 0 arguments ###")
+        else:
+            self._print_status_yaml()
+
+    def _status_binary_command(self, args):
+        if args:
+            self._println("### Error: STATUS_BIN? requires 0 arguments ###")
+        else:
+            self._write_status_frame()
+
+    def _grad_command(self, args):
+        if args:
+            self._set_gradient_target(_atof(args[0]))
+        else:
+            self._println("### Error: GRAD requires 1 argument (float grad) ###")
+
+    def _temp_command(self, chan, args):
+        if args:
+            self._set_temperature_target(chan, _atof(args[0]))
+        else:
+            self._println("### Error: TEMP_%s requires 1 argument (float temp) ###" % chan)
+
+    def _pid_mode_command(self, chan, args):
+        if not args:
+            self._println("### Error: PID_%s requires 1 argument (char *mode) {'on','off'} ###" % chan)
+        elif args[0] == "on":
+            self._set_pid_mode(chan, True)
+        elif args[0] == "off":
+            self._set_pid_mode(chan, False)
+        else:
+            self._println("### Error: PID_%s (char *mode) must be in {'on','off'} ###" % chan)
+
+    def _func_command(self, chan, args):
+        fgen = self.chanA_FGen if chan == 'A' else self.chanB_FGen
+        flag = CONTROL_MODE_FUNC_A if chan == 'A' else CONTROL_MODE_FUNC_B
+        if not args:
+            self._println("### Error: FUNC_%s requires at least 1 argument (char *func) ###" % chan)
+        elif args[0] == "off":
+            fgen.set_func_off(self.now)
+            self.control_mode &= ~flag
+        elif args[0] == "sin":
+            params = [1.0, 1.0, 0.0] #freq, amp, phase
+            for i, arg in enumerate(args[1:4]):
+                params[i] = _atof(arg)
+            fgen.set_func_sin(self.now, *params)
+            self.control_mode &= ~CONTROL_MODE_GRADIENT
+            self.control_mode |= flag
+        else:
+            self._println("### Error: FUNC_%s (char *func) must be in {'sin'} ###" % chan)
+
+    def _func_sync_command(self, args):
+        if args:
+            self._println("### Error: FUNC_SYNC requires 0 arguments ###")
+        else:
+            self.chanA_FGen.reset_time(self.now)
+            self.chanB_FGen.reset_time(self.now)
+
+    def _stream_command(self, args):
+        if args:
+            self.stream_period_ms = int(_atof(args[0]))
+            self.stream_last_ms   = self.millis()
+        else:
+            self._println("### Error: STREAM requires 1 argument (unsigned long period_ms) ###")
+
+    def _ping_command(self, args):
+        self._println("PONG")
+
+
+def _atof(text):
+    "like C 'atof', the longest numeric prefix or 0.0"
+    for end in xrange(len(text), 0, -1):
+        try:
+            return float(text[:end])
+        except ValueError:
+            pass
+    return 0.0
+
+###############################################################################
+# DMM
+
+class FakeDMM(object):
+    """Stands in for the GPIB voltmeter, reading the thermoelectric voltage
+       of a sample bridging the two stages of a SimulatedController
+    """
+    def __init__(self, controller,
+                 seebeck_coefficient = SEEBECK_COEFFICIENT,
+                 offset    = DMM_OFFSET,
+                 noise     = DMM_NOISE,
+                 read_time = DMM_READ_TIME,
+                 seed      = None,
+                ):
+        self.controller = controller
+        self.seebeck_coefficient = seebeck_coefficient
+        self.offset    = offset
+        self.noise     = noise
+        self.read_time = read_time
+        self.rng = random.Random(seed)
+        self.mode = None
+
+    def initialize(self):
+        pass
+
+    def setup_measurement(self, mode):
+        self.mode = mode
+
+    def read(self):
+        if self.read_time > 0:
+            time.sleep(self.read_time/self.controller.speedup)
+        T_A, T_B, _ = self.controller.true_temperatures()
+        return self.seebeck_coefficient*(T_A - T_B) + self.offset + self.rng.gauss(0.0, self.noise)
+
+    def shutdown(self):
+        pass
+
+###############################################################################
+# CONFIGURATION
+
+class SimulatedConfiguration(object):
+    """Provides the simulated devices through the same 'load_device' call as
+       the automat Configuration, e.g. 'Application(SimulatedConfiguration())'
+
+       With several 'fixtures' each gets its own controller, the handles are
+       'peltier_pid', 'dmm' for the first and 'peltier_pid<N>', 'dmm<N>' for
+       the N-th; 'self.fixtures' lists them as the Application expects.
+    """
+    def __init__(self, speedup = 1.0, seed = None, fixtures = 1, **interface_kwargs):
+        self.controllers = []
+        for i in range(fixtures):
+            if seed is not None:
+                seed_i = seed + i
+            else:
+                seed_i = None
+            self.controllers.append(SimulatedController(speedup = speedup, seed = seed_i).start())
+        self.controller = self.controllers[0]
+        self.fixtures = [(self._handle('peltier_pid', i), self._handle('dmm', i)) for i in range(fixtures)]
+        self.interface_kwargs = interface_kwargs
+        self._devices = {}
+
+    @staticmethod
+    def _handle(base, index):
+        if index == 0:
+            return base
+        return "%s%d" % (base, index + 1)
+
+    def _controller_for(self, handle, base):
+        for index in range(len(self.controllers)):
+            if handle == self._handle(base, index):
+                return self.controllers[index]
+        raise KeyError, "no simulated device for handle '%s'" % handle
+
+    def load_device(self, handle):
+        device = self._devices.get(handle)
+        if device is not None:
+            return device
+        if handle.startswith('peltier_pid'):
+            from peltiator.drivers.devices.arduino.dual_peltier_pid import Interface
+            controller = self._controller_for(handle, 'peltier_pid')
+            device = Interface(port = controller.port, **self.interface_kwargs)
+            device.initialize()
+        elif handle.startswith('dmm'):
+            device = FakeDMM(self._controller_for(handle, 'dmm'))
+        elif handle == 'oven':
+            return None #not simulated
+        else:
+            raise KeyError, "no simulated device for handle '%s'" % handle
+        self._devices[handle] = device
+        return device
+
+    def close(self):
+        for controller in self.controllers:
+            controller.close()
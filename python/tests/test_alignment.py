@@ -0,0 +1,83 @@
+"""
+   tests of matching DMM readings to status records
+"""
+import unittest
+from threading import Event
+
+from peltiator.apps.peltier_test.lib.application.alignment import align_sample, InstrumentReader
+
+HISTORY = [(1.0, 10.0), (2.0, 20.0), (4.0, 40.0)]
+
+
+class AlignSampleTest(unittest.TestCase):
+    def test_empty_history(self):
+        for policy in ('nearest', 'interpolate'):
+            self.assertEqual(align_sample([], 1.0, policy = policy), None)
+
+    def test_nearest(self):
+        self.assertEqual(align_sample(HISTORY, 1.2), (10.0, 1.0))
+        self.assertEqual(align_sample(HISTORY, 1.8), (20.0, 2.0))
+        self.assertEqual(align_sample(HISTORY, 2.0), (20.0, 2.0))
+        #outside the history
+        self.assertEqual(align_sample(HISTORY, 0.0), (10.0, 1.0))
+        self.assertEqual(align_sample(HISTORY, 9.0), (40.0, 4.0))
+
+    def test_nearest_max_skew(self):
+        self.assertEqual(align_sample(HISTORY, 1.2, max_skew = 0.5), (10.0, 1.0))
+        self.assertEqual(align_sample(HISTORY, 3.0, max_skew = 0.5), None)
+        self.assertEqual(align_sample(HISTORY, 9.0, max_skew = 0.5), None)
+
+    def test_interpolate(self):
+        self.assertEqual(align_sample(HISTORY, 1.5, policy = 'interpolate'), (15.0, 1.5))
+        self.assertEqual(align_sample(HISTORY, 3.0, policy = 'interpolate'), (30.0, 3.0))
+        #on a sample and outside the history it is the nearest sample
+        self.assertEqual(align_sample(HISTORY, 2.0, policy = 'interpolate'), (20.0, 2.0))
+        self.assertEqual(align_sample(HISTORY, 0.0, policy = 'interpolate'), (10.0, 1.0))
+        self.assertEqual(align_sample(HISTORY, 5.0, policy = 'interpolate'), (40.0, 4.0))
+
+    def test_interpolate_max_skew(self):
+        #a gap wider than twice the skew is not bridged
+        self.assertEqual(align_sample(HISTORY, 1.5, policy = 'interpolate', max_skew = 0.5), (15.0, 1.5))
+        self.assertEqual(align_sample(HISTORY, 3.0, policy = 'interpolate', max_skew = 0.5), None)
+        self.assertEqual(align_sample(HISTORY, 5.0, policy = 'interpolate', max_skew = 0.5), None)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, align_sample, HISTORY, 1.0, policy = 'latest')
+
+
+class InstrumentReaderTest(unittest.TestCase):
+    def test_late_result_is_dropped(self):
+        #the first read outlives its timeout, the next request still gets its own reading
+        release = Event()
+        values  = iter([1, 2])
+        def read():
+            value = next(values)
+            if value == 1:
+                release.wait()
+            return value
+        reader = InstrumentReader(read, name = "test_reader")
+        try:
+            reader.request()
+            self.assertRaises(IOError, reader.result, timeout = 0.05)
+            self.assertTrue(reader.is_busy())
+            release.set()
+            reader.request()
+            self.assertEqual(reader.result(timeout = 5.0)[1], 2)
+            self.assertFalse(reader.is_busy())
+            self.assertEqual([value for _, value in reader.get_history()], [1, 2])
+        finally:
+            release.set()
+            reader.close()
+
+    def test_read_error(self):
+        def read():
+            raise IOError, "no answer"
+        reader = InstrumentReader(read, name = "test_reader")
+        try:
+            self.assertRaises(IOError, reader.read, timeout = 5.0)
+        finally:
+            reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+   tests of the script event merging rules
+"""
+import unittest
+
+from peltiator.apps.peltier_test.lib.application.event_queue import coalesce_events, ScriptEventQueue
+
+
+class CoalesceEventsTest(unittest.TestCase):
+    def test_prints_merge(self):
+        events = [('PRINT', "a"), ('PRINT', "b"), ('PRINT', "c")]
+        self.assertEqual(coalesce_events(events), [('PRINT', "a\nb\nc")])
+
+    def test_refreshes_merge(self):
+        events = [('UPDATE_DATA', None), ('UPDATE_DATA', None)]
+        self.assertEqual(coalesce_events(events), [('UPDATE_DATA', None)])
+        events = [('UPDATE_PLOT', None)]*3
+        self.assertEqual(coalesce_events(events), [('UPDATE_PLOT', None)])
+        #sampling and redrawing together make a full 'UPDATE'
+        events = [('UPDATE_DATA', None), ('UPDATE_PLOT', None)]
+        self.assertEqual(coalesce_events(events), [('UPDATE', None)])
+        events = [('UPDATE', None), ('UPDATE_DATA', None)]
+        self.assertEqual(coalesce_events(events), [('UPDATE', None)])
+
+    def test_prints_come_before_refreshes(self):
+        events = [('UPDATE', None), ('PRINT', "a"), ('UPDATE', None), ('PRINT', "b")]
+        self.assertEqual(coalesce_events(events), [('PRINT', "a\nb"), ('UPDATE', None)])
+
+    def test_nothing_moves_across_other_events(self):
+        events = [('PRINT', "a"),
+                  ('UPDATE', None),
+                  ('CLEAR_DATA', None),
+                  ('PRINT', "b"),
+                  ('UPDATE_DATA', None),
+                 ]
+        self.assertEqual(coalesce_events(events), [('PRINT', "a"),
+                                                   ('UPDATE', None),
+                                                   ('CLEAR_DATA', None),
+                                                   ('PRINT', "b"),
+                                                   ('UPDATE_DATA', None),
+                                                  ])
+
+    def test_other_events_are_kept(self):
+        events = [('CLEAR_DATA', None), ('CLEAR_DATA', None), ('SCRIPT_DONE', 1)]
+        self.assertEqual(coalesce_events(events), events)
+
+    def test_empty(self):
+        self.assertEqual(coalesce_events([]), [])
+
+
+class ScriptEventQueueTest(unittest.TestCase):
+    def test_drain(self):
+        queue = ScriptEventQueue()
+        for event in [('PRINT', "a"), ('UPDATE', None), ('PRINT', "b")]:
+            queue.put(event)
+        self.assertEqual(queue.drain(), [('PRINT', "a\nb"), ('UPDATE', None)])
+        self.assertEqual((queue.received, queue.delivered), (3, 2))
+        self.assertTrue(queue.empty())
+        self.assertEqual(queue.drain(), [])
+        queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+   tests of the DeadlineScheduler overrun policies on a simulated clock,
+   run from the 'python' directory with 'make test'
+"""
+import unittest
+from threading import Event
+
+from peltiator.apps.peltier_test.lib.application import scheduler
+
+
+class FakeClock(object):
+    "stands in for 'monotonic' and 'time.sleep', time only moves when asked to"
+    def __init__(self):
+        self.now = 0.0
+    def monotonic(self):
+        return self.now
+    def sleep(self, delay):
+        self.now += delay
+
+
+class DeadlineSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self._saved = scheduler.monotonic, scheduler.time
+        scheduler.monotonic = self.clock.monotonic
+        scheduler.time = self.clock
+
+    def tearDown(self):
+        scheduler.monotonic, scheduler.time = self._saved
+
+    def run_ticks(self, policy, work, duration, period = 1.0, **kwargs):
+        """run for 'duration' seconds, the n-th tick taking work[n] seconds
+           (0.1 past the end of the list); returns the scheduler and tick times
+        """
+        times = []
+        def callback():
+            times.append(self.clock.now)
+            self.clock.now += work[len(times) - 1] if len(times) <= len(work) else 0.1
+        s = scheduler.DeadlineScheduler(period, callback, policy = policy, **kwargs)
+        s.run(duration = duration)
+        return s, times
+
+    def test_on_time(self):
+        for policy in scheduler.OVERRUN_POLICIES:
+            self.clock.now = 0.0
+            s, times = self.run_ticks(policy, [], duration = 3)
+            self.assertEqual(times, [1.0, 2.0, 3.0])
+            self.assertEqual((s.ticks, s.skipped), (3, 0))
+            self.assertEqual(s.jitter.summary()['max'], 0.0)
+
+    def test_skip(self):
+        #the first tick overruns to 3.5: the ticks due at 2 and 3 are dropped
+        s, times = self.run_ticks('skip', [2.5], duration = 5)
+        self.assertEqual(times, [1.0, 4.0, 5.0])
+        self.assertEqual(s.skipped, 2)
+
+    def test_coalesce(self):
+        #one tick right away stands in for the two missed ones
+        s, times = self.run_ticks('coalesce', [2.5], duration = 5)
+        self.assertEqual(times, [1.0, 3.5, 4.0, 5.0])
+        self.assertEqual(s.skipped, 1)
+
+    def test_catchup(self):
+        #every missed tick runs, back to back
+        s, times = self.run_ticks('catchup', [2.5], duration = 5)
+        self.assertEqual(times, [1.0, 3.5, 3.6, 4.0, 5.0])
+        self.assertEqual(s.skipped, 0)
+
+    def test_no_drift(self):
+        #ticks taking most of the period do not push the later deadlines back
+        s, times = self.run_ticks('skip', [0.9]*4, duration = 4)
+        self.assertEqual(times, [1.0, 2.0, 3.0, 4.0])
+
+    def test_jitter(self):
+        s, times = self.run_ticks('coalesce', [2.5], duration = 3)
+        self.assertAlmostEqual(s.jitter.summary()['max'], 0.5)
+
+    def test_adapt_restarts_the_grid(self):
+        #the period doubles after the second tick, the grid restarts from it
+        periods = iter([1.0, 2.0, 2.0, 2.0])
+        s, times = self.run_ticks('skip', [], duration = 6, adapt = lambda: next(periods))
+        self.assertEqual(times, [1.0, 2.0, 4.0, 6.0])
+        self.assertEqual(s.period, 2.0)
+
+    def test_until(self):
+        times = []
+        def callback():
+            times.append(self.clock.now)
+        s = scheduler.DeadlineScheduler(1.0, callback)
+        s.run(duration = 10, until = lambda: len(times) == 3)
+        self.assertEqual(times, [1.0, 2.0, 3.0])
+
+    def test_stop_event(self):
+        stop_event = Event()
+        stop_event.set()
+        calls = []
+        s = scheduler.DeadlineScheduler(1.0, lambda: calls.append(1), stop_event = stop_event)
+        s.run()
+        self.assertEqual(calls, [])
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, scheduler.DeadlineScheduler, 1.0, lambda: None, policy = 'later')
+
+
+if __name__ == "__main__":
+    unittest.main()
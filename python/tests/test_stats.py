@@ -0,0 +1,106 @@
+"""
+   tests of the running least squares fit
+"""
+import math, random, unittest
+
+from peltiator.apps.lib.stats import RunningRegression
+
+
+def batch_fit(xs, ys):
+    "two pass least squares: slope, intercept, slope and intercept standard errors"
+    n = len(xs)
+    mx = sum(xs)/n
+    my = sum(ys)/n
+    sxx = sum((x - mx)**2 for x in xs)
+    sxy = sum((x - mx)*(y - my) for x, y in zip(xs, ys))
+    slope = sxy/sxx
+    intercept = my - slope*mx
+    var = sum((y - intercept - slope*x)**2 for x, y in zip(xs, ys))/(n - 2)
+    return slope, intercept, math.sqrt(var/sxx), math.sqrt(var*(1.0/n + mx*mx/sxx))
+
+
+def noisy_line(n, slope, intercept, noise, x0 = 0.0, seed = 0):
+    rand = random.Random(seed)
+    xs = [x0 + rand.uniform(-2.0, 2.0) for _ in range(n)]
+    ys = [slope*x + intercept + rand.gauss(0.0, noise) for x in xs]
+    return xs, ys
+
+
+class RunningRegressionTest(unittest.TestCase):
+    def assertFitEqual(self, reg, xs, ys, places = 7):
+        expected = batch_fit(xs, ys)
+        actual   = (reg.slope, reg.intercept, reg.slope_stderr, reg.intercept_stderr)
+        for a, e in zip(actual, expected):
+            self.assertAlmostEqual(a/e, 1.0, places = places)
+
+    def test_exact_line(self):
+        reg = RunningRegression()
+        for x in range(5):
+            reg.record(x, 2.0*x + 1.0)
+        self.assertAlmostEqual(reg.slope, 2.0)
+        self.assertAlmostEqual(reg.intercept, 1.0)
+        self.assertAlmostEqual(reg.residual_variance, 0.0)
+        self.assertAlmostEqual(reg.slope_stderr, 0.0)
+
+    def test_matches_batch_fit(self):
+        #a Seebeck-like slope in V/K
+        xs, ys = noisy_line(500, 40e-6, 2e-6, 50e-9)
+        reg = RunningRegression()
+        for x, y in zip(xs, ys):
+            reg.record(x, y)
+        self.assertEqual(reg.count, 500)
+        self.assertFitEqual(reg, xs, ys)
+
+    def test_large_offset(self):
+        #running means keep the fit accurate far from the origin, e.g. timestamps
+        xs, ys = noisy_line(200, 0.5, 3.0, 0.01, x0 = 1e6)
+        reg = RunningRegression()
+        for x, y in zip(xs, ys):
+            reg.record(x, y)
+        self.assertAlmostEqual(reg.slope/batch_fit(xs, ys)[0], 1.0, places = 6)
+
+    def test_merge(self):
+        xs, ys = noisy_line(300, -1.5, 0.25, 0.1, seed = 1)
+        first, second, empty = RunningRegression(), RunningRegression(), RunningRegression()
+        for x, y in zip(xs[:100], ys[:100]):
+            first.record(x, y)
+        for x, y in zip(xs[100:], ys[100:]):
+            second.record(x, y)
+        first.merge(second)
+        first.merge(empty)
+        self.assertEqual(first.count, 300)
+        self.assertFitEqual(first, xs, ys)
+        #into an empty one
+        empty.merge(first)
+        self.assertFitEqual(empty, xs, ys)
+
+    def test_too_few_points(self):
+        reg = RunningRegression()
+        self.assertEqual(reg.slope, None)
+        self.assertEqual(reg.summary()['mean_x'], None)
+        reg.record(1.0, 1.0)
+        self.assertEqual(reg.slope, None)
+        reg.record(2.0, 3.0)
+        self.assertAlmostEqual(reg.slope, 2.0)
+        #a slope but no scatter estimate from two points
+        self.assertEqual(reg.slope_stderr, None)
+        self.assertEqual(reg.intercept_stderr, None)
+
+    def test_no_spread_in_x(self):
+        reg = RunningRegression()
+        for y in (1.0, 2.0, 3.0):
+            reg.record(5.0, y)
+        s = reg.summary()
+        self.assertEqual((s['slope'], s['intercept'], s['slope_stderr']), (None, None, None))
+        self.assertAlmostEqual(s['mean_y'], 2.0)
+
+    def test_reset(self):
+        reg = RunningRegression()
+        reg.record(1.0, 1.0)
+        reg.record(2.0, 2.0)
+        reg.reset()
+        self.assertEqual((reg.count, reg.slope), (0, None))
+
+
+if __name__ == "__main__":
+    unittest.main()